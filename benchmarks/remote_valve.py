@@ -0,0 +1,91 @@
+"""Compare a directly attached valve with one behind a serial-to-Ethernet bridge.
+
+Runs the same switching workload against the valve firmware simulator over
+a pseudo-terminal (direct) and over TCP through ``SerialBridgeSimulator``
+with a configurable round-trip time, once waiting for every reply and once
+pipelined. Reports the time the caller is blocked per switch.
+
+Usage (from project root):
+    python benchmarks/remote_valve.py
+    python benchmarks/remote_valve.py --rtt-ms 10 --switches 400 --depth 8
+    python benchmarks/remote_valve.py --serve 5020 --rtt-ms 5   # stand-in bridge for cli.py
+        (then VALVE_SERIAL_PORT=tcp://127.0.0.1:5020 python cli.py --no-detect ...)
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import statistics
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from src.controllers.sim_control import SerialBridgeSimulator  # noqa: E402
+from src.controllers.valve_control import ValveController  # noqa: E402
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Benchmark local vs networked valve command latency.")
+    p.add_argument("--rtt-ms", type=float, default=5.0, help="Simulated network round trip (default 5 ms)")
+    p.add_argument("--switches", type=int, default=200, help="ON/OFF commands per case (default 200)")
+    p.add_argument("--depth", type=int, default=4, help="Pipeline depth for the pipelined case (default 4)")
+    p.add_argument("--gap-ms", type=float, default=0.0,
+                   help="Pause between switches, as in a timed protocol (default 0)")
+    p.add_argument("--serve", type=int, metavar="PORT", help="Only run the stand-in bridge on PORT until Ctrl+C")
+    return p
+
+
+def run_case(valve: ValveController, switches: int, gap_s: float) -> dict:
+    blocked = []
+    start = time.perf_counter()
+    for i in range(switches):
+        t0 = time.perf_counter()
+        valve.on() if i % 2 == 0 else valve.off()
+        blocked.append(time.perf_counter() - t0)
+        if gap_s:
+            time.sleep(gap_s)
+    valve.flush()
+    total = time.perf_counter() - start
+    state = valve.state()
+    return {"total_s": total, "mean_ms": 1e3 * statistics.fmean(blocked),
+            "p99_ms": 1e3 * sorted(blocked)[int(0.99 * (len(blocked) - 1))],
+            "errors": len(valve.pipeline_errors), "state": state}
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    one_way = args.rtt_ms / 2e3
+    if args.serve is not None:
+        with SerialBridgeSimulator(host="0.0.0.0", port=args.serve, one_way_delay_s=one_way) as bridge:
+            print(f"Stand-in bridge on {bridge.url} (RTT {args.rtt_ms:g} ms); Ctrl+C to stop")
+            try:
+                while True:
+                    time.sleep(1)
+            except KeyboardInterrupt:
+                pass
+        return 0
+
+    gap_s = args.gap_ms / 1e3
+    results = []
+    valve = ValveController("sim://valve")
+    results.append(("direct (pty)", run_case(valve, args.switches, gap_s)))
+    valve.close()
+    with SerialBridgeSimulator(one_way_delay_s=one_way) as bridge:
+        for label, depth in (("tcp, wait for each reply", 1), (f"tcp, pipelined x{args.depth}", args.depth)):
+            valve = ValveController(bridge.url, pipeline_depth=depth)
+            results.append((label, run_case(valve, args.switches, gap_s)))
+            valve.close()
+
+    print(f"{args.switches} switches, RTT {args.rtt_ms:g} ms, gap {args.gap_ms:g} ms")
+    for label, r in results:
+        print(f"  {label:<28} total {r['total_s'] * 1e3:7.1f} ms   blocked/switch mean {r['mean_ms']:6.2f} ms "
+              f"p99 {r['p99_ms']:6.2f} ms   errors {r['errors']}   final {r['state']}")
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
@@ -0,0 +1,264 @@
+"""End-to-end schedule-accuracy benchmark for YAML protocols.
+
+Runs ``cli.run_sequence`` against simulated devices (``sim_control``) and
+compares the time every valve/pump transition actually happened with the
+time the protocol intended. Reports per-protocol timing error (offset,
+drift, worst case), the maximum sustainable valve toggle rate, and CPU use.
+
+Usage (from project root):
+    python benchmarks/schedule_accuracy.py                      # bundled examples + rate sweep
+    python benchmarks/schedule_accuracy.py config_examples/continuous_switching.yaml --time-scale 1
+    python benchmarks/schedule_accuracy.py --json bench.json --no-examples
+    python benchmarks/schedule_accuracy.py --no-examples --precise       # precision timing engine
+
+``--time-scale`` shrinks every protocol duration (default 0.05, so the 400 s
+continuous_switching run takes 20 s); device latencies are not scaled. Use
+``--time-scale 1`` to measure true long-run drift.
+"""
+
+from __future__ import annotations
+
+import argparse
+import copy
+import glob
+import io
+import itertools
+import json
+import os
+import statistics
+import sys
+import time
+from contextlib import redirect_stdout
+from typing import Any, Dict, List, Optional, Tuple
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+from cli import load_yaml_config, run_sequence  # noqa: E402
+from src.controllers.sim_control import SimEvent, SimulatedPump, SimulatedValve  # noqa: E402
+from src.utils.precision_timing import TimingEngine  # noqa: E402
+
+# State transitions compared against the schedule (settings changes are not timed)
+_TRANSITIONS = {("valve", "on"), ("valve", "off"), ("pump", "start"), ("pump", "stop")}
+DEFAULT_RATES = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)
+_BLOCK_END_TOLERANCE_S = 1e-6  # per second of block: a segment starting this close to the end does not run
+
+
+def scale_config(config: Dict[str, Any], factor: float) -> Dict[str, Any]:
+    """Return a copy of `config` with every duration multiplied by `factor`."""
+    scaled = copy.deepcopy(config)
+    for step in scaled.get("run", []):
+        if not isinstance(step, dict):
+            continue
+        if "duration" in step:
+            step["duration"] = float(step["duration"]) * factor
+        if "pump_cycle" in step:
+            step["pump_cycle"] = float(step["pump_cycle"]) * factor
+        for cmd in step.get("commands", []) or []:
+            cmd["duration"] = float(cmd.get("duration", 0)) * factor
+    return scaled
+
+
+def intended_transitions(config: Dict[str, Any]) -> List[Tuple[float, str, str]]:
+    """Ideal (zero-latency) schedule of transitions as ``(t, device, action)``."""
+    t = 0.0
+    valve_state = False
+    out: List[Tuple[float, str, str]] = []
+    for step in config.get("run", []):
+        if not isinstance(step, dict):
+            continue
+        if "pump_on" in step or "pump_start" in step:
+            out.append((t, "pump", "start"))
+        elif "pump_off" in step or "pump_stop" in step:
+            out.append((t, "pump", "stop"))
+        elif "pump_cycle" in step:
+            duration = float(step["pump_cycle"]) or 0.0
+            out += [(t, "pump", "start"), (t + duration, "pump", "stop")]
+            t += duration
+        elif "valve_on" in step or "valve_off" in step or "valve_toggle" in step:
+            valve_state = "valve_on" in step or ("valve_toggle" in step and not valve_state)
+            out.append((t, "valve", "on" if valve_state else "off"))
+        elif "duration" in step and "commands" in step:
+            total = float(step["duration"])
+            commands = step.get("commands") or []
+            if not any(float(c.get("duration", 0)) > 0 for c in commands):
+                continue
+            # Mirrors run_sequence: a command starts only while block time remains. Start times
+            # come from the cycle index, not a running float sum, so a segment ending exactly at
+            # `total` is not counted as one more start through rounding
+            segments = [float(c.get("duration", 0)) for c in commands]
+            starts = [sum(segments[:i]) for i in range(len(segments))]
+            cycle = sum(segments)
+            eps = _BLOCK_END_TOLERANCE_S * max(1.0, total)
+            elapsed = 0.0
+            for n in itertools.count():
+                for cmd, start in zip(commands, starts):
+                    offset = n * cycle + start
+                    if offset >= total - eps:
+                        break
+                    action = cmd.get("action")
+                    if action in ("valve_on", "valve_off"):
+                        valve_state = action == "valve_on"
+                        out.append((t + offset, "valve", action[6:]))
+                    elapsed = offset + float(cmd.get("duration", 0))
+                else:
+                    continue
+                break
+            t += elapsed
+        elif list(step.keys()) == ["duration"]:
+            t += float(step["duration"]) or 0.0
+    return out
+
+
+def run_protocol(config: Dict[str, Any], *, pump_latency: float, valve_latency: float,
+                 engine: Optional[TimingEngine] = None) -> Dict[str, Any]:
+    """Execute `config` against simulated devices and score the achieved timing.
+
+    With `engine` the run executes on its timing thread with precision waits.
+    """
+    events: List[SimEvent] = []
+    pump = SimulatedPump(latency_s=pump_latency, events=events)
+    valve = SimulatedValve(latency_s=valve_latency, events=events)
+    profiles = config.get("pump settings", {})
+
+    cpu0 = time.process_time()
+    t0 = time.perf_counter()
+    with redirect_stdout(io.StringIO()):
+        if engine is not None:
+            engine.run(run_sequence, config, pump, valve, profiles, dry_run=True, sleep=engine.sleep)
+        else:
+            run_sequence(config, pump, valve, profiles, dry_run=True)
+    wall = time.perf_counter() - t0
+    cpu = time.process_time() - cpu0
+
+    intended = intended_transitions(config)
+    achieved = [(e.t - t0, e.device, e.action) for e in events if (e.device, e.action) in _TRANSITIONS]
+    errors: List[float] = []
+    worst: Tuple[float, Optional[Tuple[float, str, str]]] = (0.0, None)
+    for device in ("pump", "valve"):
+        want = [x for x in intended if x[1] == device]
+        got = [x for x in achieved if x[1] == device]
+        for w, g in zip(want, got):
+            err = g[0] - w[0]
+            errors.append(err)
+            if abs(err) > abs(worst[0]):
+                worst = (err, w)
+
+    valve_errors = [g[0] - w[0] for w, g in zip([x for x in intended if x[1] == "valve"],
+                                                [x for x in achieved if x[1] == "valve"])]
+    return {
+        "intended_transitions": len(intended),
+        "achieved_transitions": len(achieved),
+        "intended_end_s": intended[-1][0] if intended else 0.0,
+        "wall_s": wall,
+        "cpu_s": cpu,
+        "cpu_pct": 100.0 * cpu / wall if wall > 0 else 0.0,
+        "mean_abs_error_ms": 1e3 * statistics.fmean(abs(e) for e in errors) if errors else 0.0,
+        "max_abs_error_ms": 1e3 * abs(worst[0]),
+        "worst_transition": list(worst[1]) if worst[1] else None,
+        "valve_offset_ms": 1e3 * valve_errors[0] if valve_errors else 0.0,
+        "valve_drift_ms": 1e3 * (valve_errors[-1] - valve_errors[0]) if valve_errors else 0.0,
+        "device_commands": pump.commands + valve.commands,
+    }
+
+
+def toggle_config(rate_hz: float, duration_s: float) -> Dict[str, Any]:
+    """Synthetic protocol switching the valve `rate_hz` times per second (on and off both count)."""
+    segment = 1.0 / rate_hz
+    return {
+        "run": [{
+            "duration": duration_s,
+            "commands": [
+                {"action": "valve_on", "duration": segment},
+                {"action": "valve_off", "duration": segment},
+            ],
+        }]
+    }
+
+
+def sweep_toggle_rate(rates, *, duration_s: float, valve_latency: float, tolerance: float,
+                      engine: Optional[TimingEngine] = None) -> Dict[str, Any]:
+    """Find the highest toggle rate whose worst transition error stays within
+    `tolerance` x segment length and where every intended transition happened.
+
+    Rates are tried in increasing order and the sweep stops at the first failure.
+    """
+    results = []
+    max_ok = 0.0
+    for rate in sorted(rates):
+        r = run_protocol(toggle_config(rate, duration_s), pump_latency=0.0, valve_latency=valve_latency,
+                         engine=engine)
+        limit_ms = 1e3 * tolerance / rate
+        ok = (r["achieved_transitions"] >= r["intended_transitions"]
+              and r["max_abs_error_ms"] <= limit_ms)
+        results.append({"rate_hz": rate, "ok": ok, "limit_ms": limit_ms, **r})
+        if not ok:
+            break  # faster rates are not sustainable either
+        max_ok = rate
+    return {"max_sustainable_rate_hz": max_ok, "rates": results}
+
+
+def _print_protocol(name: str, r: Dict[str, Any]) -> None:
+    print(f"\n== {name}")
+    print(f"  transitions    {r['achieved_transitions']}/{r['intended_transitions']}"
+          f"  (intended end {r['intended_end_s']:.2f}s, wall {r['wall_s']:.2f}s)")
+    print(f"  error          mean {r['mean_abs_error_ms']:.2f} ms, max {r['max_abs_error_ms']:.2f} ms"
+          f"  worst at {r['worst_transition']}")
+    print(f"  valve          offset {r['valve_offset_ms']:.2f} ms, drift {r['valve_drift_ms']:.2f} ms")
+    print(f"  cpu            {r['cpu_s']:.3f}s ({r['cpu_pct']:.1f}% of wall)")
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Measure how accurately run_sequence executes YAML protocols.")
+    p.add_argument("yaml_files", nargs="*", help="Protocols to run (default: config_examples/*.yaml)")
+    p.add_argument("--time-scale", type=float, default=0.05, help="Multiply protocol durations (default 0.05)")
+    p.add_argument("--pump-latency", type=float, default=0.24, help="Simulated pump command latency (s)")
+    p.add_argument("--valve-latency", type=float, default=0.002, help="Simulated valve command latency (s)")
+    p.add_argument("--no-examples", action="store_true", help="Skip protocols; only run the toggle-rate sweep")
+    p.add_argument("--no-rate-sweep", action="store_true", help="Skip the toggle-rate sweep")
+    p.add_argument("--rate-duration", type=float, default=2.0, help="Seconds per toggle rate (default 2)")
+    p.add_argument("--tolerance", type=float, default=0.25,
+                   help="Allowed worst error as a fraction of the toggle segment (default 0.25)")
+    p.add_argument("--precise", action="store_true", help="Run on the precision timing engine (sleep + spin)")
+    p.add_argument("--realtime", action="store_true",
+                   help="With --precise: SCHED_FIFO + mlockall where permitted (Linux)")
+    p.add_argument("--json", metavar="FILE", help="Also write all results as JSON")
+    return p
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    report: Dict[str, Any] = {"time_scale": args.time_scale, "protocols": {}}
+    engine = TimingEngine(realtime=args.realtime) if (args.precise or args.realtime) else None
+
+    if not args.no_examples:
+        files = args.yaml_files or sorted(glob.glob(os.path.join(PROJECT_ROOT, "config_examples", "*.yaml")))
+        for path in files:
+            config = scale_config(load_yaml_config(path), args.time_scale)
+            r = run_protocol(config, pump_latency=args.pump_latency, valve_latency=args.valve_latency,
+                             engine=engine)
+            report["protocols"][os.path.basename(path)] = r
+            _print_protocol(os.path.basename(path), r)
+
+    if not args.no_rate_sweep:
+        sweep = sweep_toggle_rate(DEFAULT_RATES, duration_s=args.rate_duration,
+                                  valve_latency=args.valve_latency, tolerance=args.tolerance, engine=engine)
+        report["toggle_rate"] = sweep
+        print("\n== valve toggle-rate sweep")
+        for r in sweep["rates"]:
+            print(f"  {r['rate_hz']:>6} Hz  {'ok ' if r['ok'] else 'FAIL'}"
+                  f"  {r['achieved_transitions']:>5}/{r['intended_transitions']:<5}"
+                  f"  max err {r['max_abs_error_ms']:8.2f} ms (limit {r['limit_ms']:.2f})"
+                  f"  cpu {r['cpu_pct']:5.1f}%")
+        print(f"  max sustainable toggle rate: {sweep['max_sustainable_rate_hz']} Hz")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nResults written to {args.json}")
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
@@ -0,0 +1,73 @@
+"""Measure sensor-stream decode throughput (PacketParser + SampleRing).
+
+Encodes a synthetic firmware stream (with interleaved reply lines and a
+few corrupted packets), feeds it to the parser in serial-read-sized chunks
+and reports samples decoded per second and per-chunk cost.
+
+Usage (from project root):
+    python benchmarks/sensor_decode.py
+    python benchmarks/sensor_decode.py --seconds 60 --rate 2000 --chunk 512
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+PROJECT_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+import numpy as np  # noqa: E402
+
+from src.controllers.sensor_stream import PACKET_SIZE, PacketParser, SampleRing, encode_packets  # noqa: E402
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Benchmark vectorised sensor packet decoding.")
+    p.add_argument("--seconds", type=float, default=30.0, help="Stream length to simulate (default 30)")
+    p.add_argument("--rate", type=float, default=1000.0, help="Sample rate in Hz (default 1000)")
+    p.add_argument("--chunk", type=int, default=1024, help="Bytes per parser call (default 1024)")
+    p.add_argument("--corrupt", type=int, default=10, help="Packets to corrupt (default 10)")
+    p.add_argument("--seed", type=int, default=0)
+    return p
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    rng = np.random.default_rng(args.seed)
+    n = int(args.seconds * args.rate) // 8 * 8
+    t_us = (np.arange(n) * 1e6 / args.rate).astype(np.int64)
+    adc = rng.integers(0, 1024, size=(n, 2))
+    data = bytearray(encode_packets(t_us, adc))
+    packets = n // 8
+    for index in rng.choice(packets, size=min(args.corrupt, packets), replace=False):
+        data[index * PACKET_SIZE + 10] ^= 0xFF
+    for index in sorted(rng.choice(packets, size=min(20, packets), replace=False), reverse=True):
+        data[index * PACKET_SIZE:index * PACKET_SIZE] = b"OK ON\r\n"
+    data = bytes(data)
+
+    parser = PacketParser()
+    ring = SampleRing(65536)
+    lines = 0
+    worst = 0.0
+    start = time.perf_counter()
+    for offset in range(0, len(data), args.chunk):
+        t0 = time.perf_counter()
+        t, values, text = parser.feed(data[offset:offset + args.chunk])
+        ring.extend(t, values)
+        lines += len(text)
+        worst = max(worst, time.perf_counter() - t0)
+    elapsed = time.perf_counter() - start
+    calls = -(-len(data) // args.chunk)
+    print(f"{ring.count} samples ({len(data) / 1e6:.1f} MB, {args.seconds:g} s at {args.rate:g} Hz) "
+          f"decoded in {elapsed * 1e3:.0f} ms: {ring.count / elapsed / 1e6:.2f} Msamples/s")
+    print(f"{calls} calls of {args.chunk} bytes: mean {1e6 * elapsed / calls:.0f} us, worst {1e6 * worst:.0f} us")
+    print(f"{parser.bad_packets} corrupt packets skipped, {lines} reply lines recovered")
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
@@ -0,0 +1,164 @@
+"""Calibrate command pacing for the connected pump and valve.
+
+For each device this finds the smallest inter-command delay at which every
+command is still acknowledged, an ack timeout matched to the measured reply
+latency, and (for an Arduino that reboots on port open) the time until its
+ready banner. Results are stored per device serial number in the pacing
+profile file (``pacing.json`` or ``$PACING_PROFILES``); ``UsbPumpController``,
+``ValveController`` and ``serial_manager.send_command`` use them automatically.
+
+The pump is sent ``boff`` during calibration, so run it with the pump idle.
+Its FTDI bridge answers every read with modem-status bytes whether or not
+the command was accepted, so for the pump only the ack timeout is
+calibrated and the delay never goes below the default.
+
+``--simulate`` does not touch the real profile file; give ``--store`` to
+keep the simulated profiles somewhere.
+
+Usage examples (from project root):
+    python calibrate.py                       # pump and valve from .env / detection
+    python calibrate.py --valve --port COM5   # only the valve on COM5
+    python calibrate.py --simulate            # simulated pump link and sim://valve (not saved)
+    python calibrate.py --show                # list stored profiles
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from typing import Optional
+
+from cli import load_env_once, resolve_device_port
+from src.utils.pacing import (DEFAULT_PACING, CalibrationResult, PacingError, PacingProfile, PacingStore,
+                              calibrate, measure_ready, valve_device_id)
+from src.utils.serial_manager import READY_BANNER
+from src.utils.transport import TransportError, open_transport
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Measure and store per-device command pacing.")
+    p.add_argument("--pump", action="store_true", help="Calibrate the pump (default: pump and valve)")
+    p.add_argument("--valve", action="store_true", help="Calibrate the valve (default: pump and valve)")
+    p.add_argument("--port", help="Valve port (default: VALVE_SERIAL_PORT / detection)")
+    p.add_argument("--pump-serial", help="USB serial number of the pump (default: PUMP_SERIAL)")
+    p.add_argument("--trials", type=int, default=10, help="Commands per tested delay (default 10)")
+    p.add_argument("--store", help="Profile file (default: pacing.json or $PACING_PROFILES)")
+    p.add_argument("--simulate", action="store_true", help="Calibrate simulated devices instead of hardware")
+    p.add_argument("--no-save", action="store_true", help="Print the results without storing them")
+    p.add_argument("--show", action="store_true", help="List stored profiles and exit")
+    return p
+
+
+def format_profile(device_id: str, profile: PacingProfile) -> str:
+    line = (f"{device_id:<24} delay {1e3 * profile.command_delay_s:6.1f} ms   "
+            f"ack timeout {1e3 * profile.ack_timeout_s:6.1f} ms")
+    if profile.ready_timeout_s is not None:
+        line += f"   ready {profile.ready_timeout_s:.2f} s"
+    if profile.calibrated_at:
+        line += f"   ({time.strftime('%Y-%m-%d %H:%M', time.localtime(profile.calibrated_at))})"
+    return line
+
+
+def report(device_id: str, default: PacingProfile, result: CalibrationResult) -> None:
+    p = result.profile
+    print(f"[CAL] {device_id}: delay {1e3 * default.command_delay_s:.1f} -> {1e3 * p.command_delay_s:.1f} ms, "
+          f"ack timeout {1e3 * default.ack_timeout_s:.0f} -> {1e3 * p.ack_timeout_s:.1f} ms "
+          f"(acks {1e3 * min(result.latencies):.1f}-{1e3 * max(result.latencies):.1f} ms, "
+          f"{len(result.tested)} batches, {'verified' if result.verified else 'NOT verified: kept default delay'})")
+
+
+def calibrate_pump(args) -> tuple[str, PacingProfile]:
+    from src.controllers.pump_control import UsbPumpController
+
+    if args.simulate:
+        from src.controllers.sim_control import SimulatedPumpLink
+
+        pump = UsbPumpController(vid=0, pid=0, auto_connect=False, auto_reconnect=False, pacing=False)
+        pump._attach(SimulatedPumpLink())
+    else:
+        pump = UsbPumpController(serial=args.pump_serial or os.getenv("PUMP_SERIAL") or None,
+                                 auto_reconnect=False, pacing=False)
+    try:
+        default = DEFAULT_PACING["pump"]
+        # A reply only shows the link is up, not that the pump took the command: keep the default delay
+        result = calibrate(pump.pacing_probe, default=default, trials=args.trials,
+                           min_delay_s=default.command_delay_s, recover=pump.transport.reset_input)
+        report(pump.device_id, default, result)
+        return pump.device_id, result.profile
+    finally:
+        pump.close()
+
+
+def calibrate_valve(args) -> tuple[str, PacingProfile]:
+    from src.controllers.valve_control import ValveController
+
+    port = "sim://valve" if args.simulate else (args.port or resolve_device_port("valve")["port"])
+    baudrate = int(os.getenv("VALVE_BAUDRATE", "115200"))
+    valve = ValveController(port, baudrate, pacing=False)
+    if valve.transport is None:
+        raise PacingError(f"Valve on {port} could not be opened")
+    try:
+        default = DEFAULT_PACING["valve"]
+        result = calibrate(valve.pacing_probe, default=default, trials=args.trials,
+                           recover=valve.transport.reset_input)
+        profile = result.profile
+        if valve.transport.resets_on_open:
+            def reopen() -> float:
+                valve.transport.close()
+                start = time.perf_counter()
+                try:
+                    valve.transport = open_transport(port, baudrate, reset=True)
+                except TransportError as exc:
+                    raise PacingError(str(exc)) from exc
+                if not valve.transport.wait_for_line(READY_BANNER.encode(), 10.0):
+                    raise PacingError(f"No ready banner from {port} within 10 s")
+                return time.perf_counter() - start
+
+            profile = profile._replace(ready_timeout_s=measure_ready(reopen))
+        result = result._replace(profile=profile)
+        device_id = valve_device_id(port)
+        report(device_id, default, result)
+        if profile.ready_timeout_s is not None:
+            print(f"[CAL] {device_id}: ready banner timeout {default.ready_timeout_s:.2f} -> "
+                  f"{profile.ready_timeout_s:.2f} s")
+        return device_id, profile
+    finally:
+        valve.close()
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    load_env_once()
+    store = PacingStore(args.store)
+    if args.show:
+        profiles = store.load()
+        if not profiles:
+            print(f"No pacing profiles in {store.path}")
+        for device_id, profile in profiles.items():
+            print(format_profile(device_id, profile))
+        return 0
+    if args.store:
+        os.environ["PACING_PROFILES"] = args.store
+    elif args.simulate and not args.no_save:
+        print(f"[CAL] Simulated devices: results are not saved to {store.path} (use --store FILE to keep them)")
+        args.no_save = True
+    devices = [name for name in ("pump", "valve") if getattr(args, name)] or ["pump", "valve"]
+    failed = 0
+    for device in devices:
+        try:
+            device_id, profile = calibrate_pump(args) if device == "pump" else calibrate_valve(args)
+        except Exception as exc:
+            print(f"[CAL] {device}: calibration failed: {exc}", file=sys.stderr)
+            failed += 1
+            continue
+        if not args.no_save:
+            store.put(device_id, profile)
+    if not args.no_save and failed < len(devices):
+        print(f"[CAL] Profiles saved to {store.path}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
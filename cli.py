@@ -8,6 +8,35 @@ Usage examples (from project root):
 Flags:
     --dry-run     Simulate; no serial ports opened (mock devices)
     --no-detect   Disable VID/PID auto-detection and rely only on .env/default ports
+    --init-timeout S
+                  Per-device startup timeout; pump and valve are opened concurrently
+    --profile [--profile-json FILE]
+                  Time every step and controller call; print wall / I/O / sleep /
+                  lateness breakdown per step type and device at exit (JSON to FILE)
+    --record-trace FILE
+                  Record every pump/valve write and read (with timing) to a trace file
+    --replay-trace FILE [--replay-speed X]
+                  Serve devices from a recorded trace (offline regression benchmarks)
+    --precise / --realtime [--cpu N]
+                  Execute the run on a dedicated timing thread waiting on perf_counter_ns
+                  deadlines (sleep, then spin); --realtime adds SCHED_FIFO + mlockall
+    --store [--store-db DB] [--rig NAME]
+                  Append every step, device call and measurement to a SQLite run store
+                  for cross-run queries (python -m src.utils.run_store latency valve on)
+    --save-frames DIR
+                  Save all microscope frames under DIR/run-<timestamp>/ via background
+                  writer processes (chunked, compressed, with a frame timestamp index)
+    --daemon [--socket SOCKET]
+                  Submit the run to a running device daemon (see daemon.py); devices
+                  stay open between runs so startup costs milliseconds
+    --checkpoint / --resume [--journal FILE]
+                  Journal the step in progress, its elapsed time and the device state
+                  (default <yaml>.checkpoint.json); --resume restores the devices and
+                  continues an interrupted run from that step
+
+Valve connection:
+    VALVE_SUPPRESS_RESET=1 keeps DTR/RTS low on open so the Arduino does not reboot;
+    otherwise the CLI waits for the firmware's "Valve controller ready" banner.
 
 Port resolution order (when not --dry-run):
     1. Explicit environment: PUMP_PORT / VALVE_SERIAL_PORT (or legacy PUMP_COM)
@@ -26,6 +55,24 @@ commands:
     required hardware:
         pump: true
         valve: true
+        microscope: false    # true = capture continuously during the run (numpy required)
+
+    microscope settings:     # optional
+        camera: synthetic    # or opencv (device: 0)
+        width: 640
+        height: 480
+        fps: 30
+        buffer_frames: 64    # preallocated ring; memory is fixed at start-up
+        continuous: true     # false = only grab frames for capture triggers
+        compression: zlib    # --save-frames: none (memory-mappable .npy) | zlib | lz4
+        chunk_frames: 32
+        writer_workers: 2
+
+    capture triggers:        # optional; frames taken at offsets after device events
+        - event: valve_on    # valve_on/off/toggle/mask/pulse, pump_start/stop/voltage/freq/waveform
+          offset_ms: 200
+          frames: 1          # optional: several frames spaced interval_ms apart
+          interval_ms: 0
 
     run:
         # Original style (profile application + start). Now simplified to a mere start
@@ -48,6 +95,13 @@ commands:
         - valve_toggle: 0
         - valve_state: 0           # queries and prints state
         - valve_pulse: 150         # pulse N ms (pump must support; Arduino handles it)
+        - valve_pwm: {period_ms: 1000, duty: 25}   # relay ON 25% of every second, timed
+                                   # on the Arduino (also [1000, 25]); `valve_pwm: off`,
+                                   # valve_on/valve_off/valve_toggle end it
+
+        # Valve bank (manifold) commands; needs `valve bank: true` under required hardware:
+        - valve_mask: 0x0005       # set every valve in one command (bit i = valve i open)
+        - valve_mask: [0, 2]       # same, as a list of open valves
 
         # Mixed timed block (unchanged semantics):
         - duration: 20
@@ -56,6 +110,9 @@ commands:
                     duration: 2
                 - action: valve_off
                     duration: 2
+                - action: valve_mask   # valve bank only
+                    mask: 0x00F0
+                    duration: 2
 
         # Simple wait:
         - duration: 10
@@ -63,17 +120,18 @@ commands:
 
 from __future__ import annotations
 
-# Ensure project root (two levels up from this file) is on sys.path when executed as a script
+# Ensure project root (the directory of this file) is on sys.path when executed as a script
 import os as _os, sys as _sys
-_SRC_DIR = _os.path.abspath(_os.path.join(_os.path.dirname(__file__), ".."))
+_SRC_DIR = _os.path.abspath(_os.path.dirname(__file__))
 if _SRC_DIR not in _sys.path:
     _sys.path.insert(0, _SRC_DIR)
 
 import argparse
+import json
 import os
 import sys
 import time
-from typing import Any, Dict, List
+from typing import Any, Callable, Dict, List, Optional
 
 import yaml
 
@@ -82,10 +140,26 @@ try:
 except ImportError:  # pragma: no cover - optional dependency
     load_dotenv = None  # type: ignore
 
-# Local imports (package-relative). Classes actually defined in pump/valve modules.
-from device_control.pump import BartelsPumpController
-from device_control.valve import ValveController
-from device_control.resolve_ports import get_port_by_id
+# Local imports (project-relative). Classes actually defined in pump/valve modules.
+from src.controllers.pump_control import UsbPumpController
+from src.controllers.valve_control import ValveController, parse_valve_pwm
+from src.controllers.valve_bank_control import ValveBank, parse_valve_mask
+from src.utils.flow_control import FlowControlError, build_flow_controller
+from src.utils.device_startup import DeviceInitError, start_devices
+from src.utils.capture_sync import CaptureSync, parse_triggers
+from src.utils.checkpoint import (CheckpointError, RunJournal, default_journal_path, load_checkpoint,
+                                  run_fingerprint)
+from src.utils.precision_timing import TimingEngine
+from src.utils.run_profiler import RunProfiler
+from src.utils.run_store import RunRecorder, RunStore
+from src.utils.io_trace import TraceWriter, load_trace, record_pump, record_valve, replay_pump, replay_valve
+from src.utils.resolve_ports import get_port_by_id
+
+# Per-device startup timeouts (seconds); valve includes the Arduino reset + banner wait
+DEFAULT_INIT_TIMEOUTS = {"pump": 5.0, "valve": 6.0}
+
+# Commands a timed block understands (each holds for its `duration`)
+BLOCK_ACTIONS = ("valve_on", "valve_off", "valve_mask")
 
 
 class MockPump:
@@ -121,6 +195,7 @@ class MockValve:
     def __init__(self, name: str = "MockValve"):
         self.name = name
         self.state_val = False
+        self.stream = None
 
     def on(self):
         self.state_val = True
@@ -130,7 +205,38 @@ class MockValve:
         self.state_val = False
         print("[DRY-RUN][VALVE] OFF")
 
+    def set_mask(self, mask):
+        mask = parse_valve_mask(mask)
+        self.state_val = bool(mask)
+        print(f"[DRY-RUN][VALVE] MASK {mask:04X}")
+        return mask
+
+    def pwm(self, period_ms, duty):
+        self.state_val = duty > 0
+        print(f"[DRY-RUN][VALVE] PWM {period_ms} ms, {duty}% on")
+
+    def pwm_off(self):
+        self.state_val = False
+        print("[DRY-RUN][VALVE] PWM OFF")
+
+    def start_stream(self, rate_hz: int = 1000, *, capacity: int = 65536, channels=None):
+        from src.controllers.sensor_stream import SensorStream, SimulatedSensorTransport
+
+        print(f"[DRY-RUN][VALVE] STREAM {rate_hz} (simulated sensors)")
+        self.stream = SensorStream(SimulatedSensorTransport(rate_hz), rate_hz=rate_hz, capacity=capacity,
+                                   channels=channels)
+        return self.stream
+
+    def stop_stream(self):
+        stream, self.stream = self.stream, None
+        if stream is not None:
+            stream.stop()
+            stream.transport.close()
+            print("[DRY-RUN][VALVE] STREAM OFF")
+        return stream
+
     def close(self):
+        self.stop_stream()
         print("[DRY-RUN][VALVE] CLOSE")
 
 
@@ -151,49 +257,136 @@ def load_env_once():
     """Load project .env file if present (idempotent)."""
     if not load_dotenv:
         return
-    root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
+    root = os.path.abspath(os.path.dirname(__file__))
     env_path = os.path.join(root, ".env")
     if os.path.exists(env_path):
         load_dotenv(env_path)  # ignore return
 
 
-def resolve_ports_from_env(prefer_detection: bool = True) -> dict:
-    """Determine ports using layered strategy:
-    1. Explicit env overrides (PUMP_PORT / VALVE_SERIAL_PORT)
-    2. VID/PID detection via get_port_by_id('pump'/'arduino') when available
-    3. Fallback defaults (COM4 / COM5)
-    """
+def resolve_device_port(device: str, prefer_detection: bool = True) -> dict:
+    """Resolve a single device port ('pump' or 'valve') using the layered strategy
+    described in :func:`resolve_ports_from_env`. Safe to call from worker threads."""
     load_env_once()
-    pump_port_env = os.getenv("PUMP_PORT") or os.getenv("PUMP_COM")
-    valve_port_env = os.getenv("VALVE_SERIAL_PORT")
+    if device == "pump":
+        port_env = os.getenv("PUMP_PORT") or os.getenv("PUMP_COM")
+        detect_id, fallback = "pump", "COM4"
+    elif device == "valve":
+        port_env = os.getenv("VALVE_SERIAL_PORT")
+        detect_id, fallback = "arduino", "COM5"
+    else:
+        raise ValueError(f"Unknown device type: {device}. Use 'pump' or 'valve'.")
 
-    detected_pump = None
-    detected_valve = None
+    detected = None
     if prefer_detection:
         # Attempt detection; suppress exceptions and fall back
         try:
-            detected_pump = get_port_by_id("pump")
+            detected = get_port_by_id(detect_id)
         except Exception:
-            detected_pump = None
-        try:
-            detected_valve = get_port_by_id("arduino")
-        except Exception:
-            detected_valve = None
+            detected = None
+    return {
+        "port": port_env or detected or fallback,
+        "detected": bool(detected),
+        "from_env": bool(port_env is not None),
+    }
 
-    pump_port = pump_port_env or detected_pump or "COM4"
-    valve_port = valve_port_env or detected_valve or "COM5"
 
+def resolve_ports_from_env(prefer_detection: bool = True) -> dict:
+    """Determine ports using layered strategy:
+    1. Explicit env overrides (PUMP_PORT / VALVE_SERIAL_PORT)
+    2. VID/PID detection via get_port_by_id('pump'/'arduino') when available
+    3. Fallback defaults (COM4 / COM5)
+    """
+    pump = resolve_device_port("pump", prefer_detection)
+    valve = resolve_device_port("valve", prefer_detection)
     return {
-        "pump_port": pump_port,
-        "valve_port": valve_port,
+        "pump_port": pump["port"],
+        "valve_port": valve["port"],
         "valve_baud": int(os.getenv("VALVE_BAUDRATE", "115200")),
-        "pump_detected": bool(detected_pump),
-        "valve_detected": bool(detected_valve),
-        "pump_from_env": bool(pump_port_env is not None),
-        "valve_from_env": bool(valve_port_env is not None),
+        "valve_suppress_reset": os.getenv("VALVE_SUPPRESS_RESET", "").strip().lower() in ("1", "true", "yes"),
+        "pump_detected": pump["detected"],
+        "valve_detected": valve["detected"],
+        "pump_from_env": pump["from_env"],
+        "valve_from_env": valve["from_env"],
     }
 
 
+def init_pump(pump_profiles: Optional[Dict[str, Any]] = None) -> UsbPumpController:
+    """Open the USB pump and apply the first profile (if any) as its initial configuration.
+    ``PUMP_SERIAL`` selects one pump by USB serial number when several are attached."""
+    load_env_once()
+    pump = UsbPumpController(serial=os.getenv("PUMP_SERIAL") or None)
+    print(f"[INFO] Pump connected (VID=0x{pump.vid:04x}, PID=0x{pump.pid:04x}"
+          + (f", serial {pump.serial})" if pump.serial else ")"))
+    try:
+        if pump_profiles:
+            # Initial configuration (first profile) is applied once here; pump_on only starts.
+            apply_pump_profile(pump, next(iter(pump_profiles)), pump_profiles, start=False)
+        # Fail-fast if underlying USB handle missing
+        if not pump.connected:
+            raise RuntimeError(
+                "Pump USB connection not established. "
+                "Check wiring, drivers, or PUMP_VID/PUMP_PID in .env."
+            )
+        # Allow device settle
+        time.sleep(0.3)
+    except BaseException:
+        pump.close()
+        raise
+    return pump
+
+
+def init_valve(prefer_detection: bool = True, *, bank: bool = False) -> ValveController:
+    """Resolve the valve port and open it (waits for the firmware ready banner).
+    With ``bank`` the port drives a multi-valve manifold (valve_bank_serial.ino)."""
+    resolved = resolve_device_port("valve", prefer_detection)
+    print(
+        f"[INFO] Valve{' bank' if bank else ''} port resolved: {resolved['port']} "
+        f"(env={resolved['from_env']}, detected={resolved['detected']})"
+    )
+    valve_cls = ValveBank if bank else ValveController
+    depth = os.getenv("VALVE_PIPELINE_DEPTH", "").strip()
+    return valve_cls(
+        resolved["port"],
+        int(os.getenv("VALVE_BAUDRATE", "115200")),
+        reset_on_open=os.getenv("VALVE_SUPPRESS_RESET", "").strip().lower() not in ("1", "true", "yes"),
+        **({"pipeline_depth": int(depth)} if depth else {}),
+    )
+
+
+def device_factories(
+    pump_profiles: Dict[str, Any],
+    *,
+    pump_enabled: bool,
+    valve_enabled: bool,
+    dry_run: bool = False,
+    prefer_detection: bool = True,
+    valve_bank: bool = False,
+    microscope_settings: Dict[str, Any] | None = None,
+) -> Dict[str, Callable[[], Any]]:
+    """Return the startup callables for :func:`start_devices`, keyed by device name.
+
+    ``microscope_settings`` (None = no microscope) configures the camera; dry
+    runs always use the synthetic camera.
+    """
+    factories: Dict[str, Callable[[], Any]] = {}
+    if pump_enabled:
+        factories["pump"] = MockPump if dry_run else (lambda: init_pump(pump_profiles))
+    if valve_enabled:
+        factories["valve"] = MockValve if dry_run else (lambda: init_valve(prefer_detection, bank=valve_bank))
+    if microscope_settings is not None:
+        factories["microscope"] = lambda: init_microscope(microscope_settings, dry_run=dry_run)
+    return factories
+
+
+def init_microscope(settings: Dict[str, Any], *, dry_run: bool = False):
+    """Open the microscope camera (numpy required; imported lazily)."""
+    from src.controllers.microscope_control import MicroscopeControl
+
+    if dry_run:
+        settings = {**settings, "camera": "synthetic"}
+    return MicroscopeControl(settings)
+
+
 def apply_pump_profile(pump, name: str, profiles: Dict[str, Any], *, start: bool = True):  # pump can be real or mock
     """Apply pump profile with correct ordering (stop -> waveform -> voltage -> frequency -> start)."""
     profile = profiles.get(name)
@@ -210,15 +403,17 @@ def apply_pump_profile(pump, name: str, profiles: Dict[str, Any], *, start: bool
     waveform = profile.get("waveform")
     voltage = profile.get("voltage")
     freq = profile.get("freq")
+    # Extra settle time between settings, unneeded once the pump's own pacing is calibrated
+    gap = 0.0 if getattr(pump, "pacing", None) is not None else 0.05
     if waveform is not None:
         pump.bartels_set_waveform(waveform)
-        time.sleep(0.05)
+        time.sleep(gap)
     if voltage is not None:
         pump.bartels_set_voltage(voltage)
-        time.sleep(0.05)
+        time.sleep(gap)
     if freq is not None:
         pump.bartels_set_freq(freq)
-        time.sleep(0.05)
+        time.sleep(gap)
     if start:
         pump.bartels_start()
 
@@ -230,11 +425,63 @@ def run_sequence(
     pump_profiles: Dict[str, Any],
     *,
     dry_run: bool = False,
+    sleep: Callable[[float], None] = time.sleep,
+    profiler: RunProfiler | None = None,
+    journal: RunJournal | None = None,
 ):
-    for step in config.get("run", []):
+    """Execute the ``run:`` steps of a parsed config.
+
+    ``sleep`` is used for every intentional wait so callers (e.g. the device
+    daemon) can substitute an interruptible implementation. With a
+    ``profiler`` every step, device call and sleep is timed. With a
+    ``journal`` the cursor and device state are checkpointed, and the run
+    starts at the journal's resume point.
+    """
+    if profiler is not None:
+        sleep = profiler.wrap_sleep(sleep)
+        pump = profiler.wrap_device(pump, "pump")
+        valve = profiler.wrap_device(valve, "valve")
+    if journal is not None:
+        pump = journal.wrap_device(pump, "pump")
+        valve = journal.wrap_device(valve, "valve")
+    try:
+        _run_steps(config, pump, valve, sleep, profiler, journal, dry_run=dry_run)
+    finally:
+        if profiler is not None:
+            profiler.end_step()
+
+
+def _block_resume_point(commands: List[dict], elapsed: float) -> tuple[int, float]:
+    """Command to resume a timed block at after `elapsed` seconds, and its scheduled start offset."""
+    segments = [float(c.get("duration", 0)) if c.get("action") in BLOCK_ACTIONS else 0.0 for c in commands]
+    cycle = sum(segments)
+    if cycle <= 0:
+        return 0, elapsed
+    start = elapsed - elapsed % cycle
+    for i, segment in enumerate(segments):
+        if start + segment > elapsed:
+            return i, start
+        start += segment
+    return 0, start
+
+
+def _run_steps(config: Dict[str, Any], pump, valve, sleep: Callable[[float], None],
+               profiler: RunProfiler | None, journal: RunJournal | None = None, *, dry_run: bool = False) -> None:
+    flow = None  # FlowController, built on the first flow_setpoint step
+    first_step = journal.start_step if journal is not None else 0
+    for index, step in enumerate(config.get("run", [])):
+        if index < first_step:
+            continue
+        # Time this step already ran before an interruption (resumed runs only)
+        resumed = journal.begin_step(index) if journal is not None else 0.0
+        if profiler is not None:
+            profiler.begin_step(index, step)
         if not isinstance(step, dict):
             print(f"[WARN] Step ignored (not a dict): {step}")
             continue
+        if pump and getattr(pump, "link_lost", False):
+            # The controller already retried connect() within its reconnect budget
+            sys.exit("Pump USB link lost and could not be re-established; aborting run.")
         # Pump ON (apply profile)
         if "pump_on" in step:
             if not pump:
@@ -302,10 +549,10 @@ def run_sequence(
             if not pump:
                 sys.exit("Pump requested but not initialized.")
             duration = float(step["pump_cycle"]) or 0.0
-            print(f"[ACTION] Pump cycle for {duration}s")
+            print(f"[ACTION] Pump cycle for {duration}s" + (f" (resumed after {resumed:.1f}s)" if resumed else ""))
             try:
                 pump.bartels_start()
-                time.sleep(duration)
+                sleep(max(0.0, duration - resumed))
                 pump.bartels_stop()
             except Exception as e:
                 print(f"[WARN] Pump cycle error: {e}")
@@ -373,39 +620,100 @@ def run_sequence(
             except Exception as e:
                 print(f"[WARN] Failed to pulse valve: {e}")
             continue
+        if "valve_mask" in step:
+            if not valve:
+                sys.exit("Valve requested but not initialized.")
+            mask = parse_valve_mask(step["valve_mask"])
+            print(f"[ACTION] Valve bank MASK {mask:04X}")
+            try:
+                valve.set_mask(mask)
+            except Exception as e:
+                print(f"[WARN] Failed to set valve mask: {e}")
+            continue
+        # Relay duty cycle timed by the Arduino (no host I/O until the next valve command)
+        if "valve_pwm" in step:
+            if not valve:
+                sys.exit("Valve requested but not initialized.")
+            try:
+                setting = parse_valve_pwm(step["valve_pwm"])
+            except ValueError as e:
+                print(f"[WARN] Step ignored: {e}")
+                continue
+            print("[ACTION] Valve PWM OFF" if setting is None
+                  else f"[ACTION] Valve PWM {setting[1]}% of {setting[0]} ms")
+            try:
+                resp = valve.pwm_off() if setting is None else valve.pwm(*setting)
+                if resp and not resp.startswith("OK"):
+                    print(f"[WARN] Valve PWM rejected: {resp}")
+            except Exception as e:
+                print(f"[WARN] Failed to set valve PWM: {e}")
+            continue
+        # Closed-loop flow: regulate pump output against the flow source for `duration`
+        if "flow_setpoint" in step:
+            if flow is None:
+                try:
+                    flow, model = build_flow_controller(config.get("flow control") or {}, pump, valve,
+                                                        dry_run=dry_run)
+                except FlowControlError as e:
+                    sys.exit(f"Flow control unavailable: {e}")
+                if model is not None:
+                    print("[INFO] Flow control against the simulated pump + fluid model")
+            target = float(step["flow_setpoint"])
+            duration = max(0.0, (float(step.get("duration", 0)) or 0.0) - resumed)
+            ramp = step.get("ramp")
+            print(f"[ACTION] Flow setpoint {target:g} for {duration}s" + (f" (ramp {ramp}/s)" if ramp else "")
+                  + (f" (resumed after {resumed:.1f}s)" if resumed else ""))
+            summary = flow.hold(target, duration, ramp_per_s=float(ramp) if ramp else None, sleep=sleep)
+            print(flow.format_summary(target, summary))
+            continue
         # Timed command block
         if "duration" in step and "commands" in step:
             total = float(step.get("duration", 0))
             commands: List[dict] = step.get("commands", [])
-            print(f"[BLOCK] {total}s repeating {len(commands)} commands")
-            block_start = time.time()
-            while (time.time() - block_start) < total:
-                for cmd in commands:
-                    remaining = total - (time.time() - block_start)
+            print(f"[BLOCK] {total}s repeating {len(commands)} commands"
+                  + (f" (resumed after {resumed:.1f}s)" if resumed else ""))
+            # Segments are scheduled on absolute deadlines so command latency
+            # and sleep overshoot do not accumulate over the block
+            block_start = time.perf_counter() - resumed
+            first, offset = _block_resume_point(commands, resumed) if resumed else (0, 0.0)
+            deadline = block_start + offset
+            while (time.perf_counter() - block_start) < total:
+                for cmd in commands[first:]:
+                    remaining = total - (time.perf_counter() - block_start)
                     if remaining <= 0:
                         break
                     action = cmd.get("action")
                     segment = float(cmd.get("duration", 0))
+                    if profiler is not None:
+                        profiler.block_command(segment)
                     if action == "valve_on":
                         if not valve:
                             sys.exit("Valve requested but not initialized.")
                         print(f"  [VALVE] ON for {segment}s")
                         valve.on()
-                        time.sleep(segment)
                     elif action == "valve_off":
                         if not valve:
                             sys.exit("Valve requested but not initialized.")
                         print(f"  [VALVE] OFF for {segment}s")
                         valve.off()
-                        time.sleep(segment)
+                    elif action == "valve_mask":
+                        if not valve:
+                            sys.exit("Valve requested but not initialized.")
+                        mask = parse_valve_mask(cmd.get("mask", 0))
+                        print(f"  [VALVE] MASK {mask:04X} for {segment}s")
+                        valve.set_mask(mask)
                     else:
                         print(f"  [WARN] Unknown action '{action}' in block")
+                        continue
+                    deadline += segment
+                    sleep(max(0.0, deadline - time.perf_counter()))
+                first = 0
             continue
         # Simple wait
         if list(step.keys()) == ["duration"]:
             wait_s = float(step["duration"]) or 0.0
-            print(f"[WAIT] {wait_s}s")
-            time.sleep(wait_s)
+            print(f"[WAIT] {wait_s}s" + (f" ({max(0.0, wait_s - resumed):.1f}s left after resume)" if resumed else ""))
+            sleep(max(0.0, wait_s - resumed))
             continue
         print(f"[WARN] Unrecognized step keys: {list(step.keys())}")
 
@@ -418,12 +726,108 @@ def build_arg_parser() -> argparse.ArgumentParser:
     p.add_argument(
         "--no-detect", action="store_true", help="Disable VID/PID auto-detection; rely only on env/default"
     )
+    p.add_argument(
+        "--init-timeout",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help="Per-device startup timeout (default: pump 5s, valve 6s)",
+    )
+    p.add_argument(
+        "--profile", action="store_true", help="Time every step and device call; print a breakdown at exit"
+    )
+    p.add_argument(
+        "--profile-json", metavar="FILE", help="Also save the --profile breakdown as JSON to FILE (implies --profile)"
+    )
+    p.add_argument("--record-trace", metavar="FILE", help="Record every device write/read with timestamps to FILE")
+    p.add_argument(
+        "--replay-trace", metavar="FILE", help="Replay devices from a recorded trace instead of opening hardware"
+    )
+    p.add_argument(
+        "--replay-speed", type=float, default=1.0, help="Latency scale for --replay-trace (0 = no waits)"
+    )
+    p.add_argument(
+        "--precise",
+        action="store_true",
+        help="Run steps on a dedicated timing thread with sleep+spin waits (sub-ms transitions, more CPU)",
+    )
+    p.add_argument(
+        "--realtime",
+        action="store_true",
+        help="Like --precise, plus SCHED_FIFO and mlockall where permitted (Linux; needs CAP_SYS_NICE)",
+    )
+    p.add_argument("--cpu", type=int, default=None, help="Pin the timing thread to this CPU (implies --precise)")
+    p.add_argument(
+        "--optimize",
+        action="store_true",
+        help="Drop run steps that repeat the current device state or are overridden before any wait",
+    )
+    p.add_argument(
+        "--store", action="store_true", help="Append steps, device calls and measurements to a SQLite run store"
+    )
+    p.add_argument(
+        "--store-db", metavar="DB", help="Run store database (implies --store; default RUN_STORE_DB or runs.sqlite)"
+    )
+    p.add_argument("--rig", default=None, help="Rig name stored with --store (default RIG_ID or hostname)")
+    p.add_argument(
+        "--save-frames",
+        metavar="DIR",
+        help="Save every microscope frame to DIR/run-<time>/ (compressed chunks, background processes)",
+    )
+    p.add_argument(
+        "--daemon",
+        action="store_true",
+        help="Submit the run to a running device daemon (daemon.py) instead of opening devices",
+    )
+    p.add_argument("--socket", metavar="SOCKET", help="Device daemon socket (implies --daemon)")
+    p.add_argument("--checkpoint", action="store_true", help="Journal the run position and device state")
+    p.add_argument(
+        "--resume",
+        action="store_true",
+        help="Restore device state from the checkpoint journal and continue the run where it stopped",
+    )
+    p.add_argument(
+        "--journal",
+        metavar="FILE",
+        help="Checkpoint journal for --checkpoint/--resume (implies --checkpoint; default <yaml>.checkpoint.json)",
+    )
     return p
 
 
+def write_profile(profiler: RunProfiler, path: Optional[str]) -> None:
+    """Print the profiling breakdown and, if `path` is given, save it as JSON."""
+    print(profiler.format_report())
+    if path:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(profiler.summary(top=10), f, indent=2)
+        print(f"[PROFILE] Written to {path}")
+
+
+def run_via_daemon(config: Dict[str, Any], socket_path: str | None = None) -> int:
+    """Send the parsed config to the device daemon and stream its output."""
+    from daemon import DaemonClient, DaemonError
+
+    client = DaemonClient(socket_path or None)
+    try:
+        elapsed = client.run(config)
+    except KeyboardInterrupt:
+        # Closing the connection makes the daemon stop the pump and close the valve.
+        print("\n[INTERRUPT] Caught Ctrl+C – run aborted by daemon.")
+        return 1
+    except DaemonError as e:
+        print(f"Daemon run failed: {e}")
+        return 1
+    print(f"Sequence complete ({elapsed:.3f}s in daemon).")
+    return 0
+
+
 def main(argv: list[str] | None = None) -> int:
     parser = build_arg_parser()
     args = parser.parse_args(argv)
+    # Path options imply their flag; the flags take no value so they never swallow yaml_file
+    args.profile = args.profile or args.profile_json is not None
+    args.store = args.store or args.store_db is not None
+    args.daemon = args.daemon or args.socket is not None
 
     config = load_yaml_config(args.yaml_file)
     required_hw = config.get("required hardware", {})
@@ -432,65 +836,178 @@ def main(argv: list[str] | None = None) -> int:
         return 1
 
     pump_enabled = bool(required_hw.get("pump", False))
-    valve_enabled = bool(required_hw.get("valve", False))
+    valve_bank = bool(required_hw.get("valve bank", False))
+    valve_enabled = bool(required_hw.get("valve", False)) or valve_bank
+    microscope_enabled = bool(required_hw.get("microscope", False))
     dry_run = args.dry_run
 
-    env_ports = resolve_ports_from_env(prefer_detection=not args.no_detect) if not dry_run else {}
-
     pump_profiles = config.get("pump settings", {}) if pump_enabled else {}
     if pump_enabled and not pump_profiles:
         print("Pump enabled but no 'pump settings' found in YAML file.")
         return 1
 
-    # Initialize devices (real or mock)
-    pump = None
-    if pump_enabled:
-        if dry_run:
-            pump = MockPump()
-        else:
-            first_profile = next(iter(pump_profiles.values()))
-            pump_cfg = {
-                "pump_port": env_ports["pump_port"],
-                "bartels_freq": first_profile.get("freq", 50),
-                "bartels_voltage": first_profile.get("voltage", 100),
-            }
-            print(
-                f"[INFO] Pump port resolved: {pump_cfg['pump_port']} "
-                f"(env={env_ports.get('pump_from_env')}, detected={env_ports.get('pump_detected')})"
+    try:
+        capture_triggers = parse_triggers(config.get("capture triggers")) if microscope_enabled else []
+    except ValueError as e:
+        print(f"Invalid 'capture triggers': {e}")
+        return 1
+
+    if args.daemon:
+        # The daemon runs the steps itself; these only act on a run executed in this process
+        local_only = [flag for flag, used in (
+            ("--checkpoint/--resume", args.checkpoint or args.resume or args.journal),
+            ("--profile", args.profile),
+            ("--store", args.store),
+            ("--precise/--realtime/--cpu", args.precise or args.realtime or args.cpu is not None),
+            ("--record-trace", args.record_trace),
+            ("--replay-trace", args.replay_trace),
+            ("--save-frames", args.save_frames),
+        ) if used]
+        if local_only:
+            print(f"{', '.join(local_only)} cannot be used with --daemon.")
+            return 1
+
+    if args.optimize:
+        from src.utils.run_optimizer import initial_pump_state, optimize_run
+
+        # The daemon's devices keep their state between runs, so nothing is assumed there
+        initial = initial_pump_state(pump_profiles) if pump_enabled and not args.daemon else None
+        optimized = optimize_run(config.get("run") or [], initial=initial)
+        config["run"] = optimized.steps
+        print(optimized.format_report(verbose=args.verbose))
+
+    journal_path = None
+    checkpoint = None
+    if args.checkpoint or args.resume or args.journal:
+        journal_path = args.journal or default_journal_path(args.yaml_file)
+    if args.resume:
+        try:
+            checkpoint = load_checkpoint(journal_path)
+        except CheckpointError as e:
+            print(e)
+            return 1
+        if checkpoint.run_hash != run_fingerprint(config.get("run") or []):
+            print(f"Checkpoint journal {journal_path} was written for different run steps.")
+            return 1
+        if checkpoint.status == "complete":
+            print(f"Run recorded in {journal_path} already completed; nothing to resume.")
+            return 0
+
+    if args.daemon:
+        return run_via_daemon(config, args.socket)
+
+    # Initialize devices (real or mock) concurrently; startup costs the slowest device
+    if args.replay_trace:
+        # Offline: serve the recorded device exchange instead of opening hardware
+        trace = load_trace(args.replay_trace)
+        factories = {}
+        if pump_enabled:
+            factories["pump"] = lambda: replay_pump(trace, speed=args.replay_speed)
+        if valve_enabled:
+            factories["valve"] = lambda: replay_valve(trace, speed=args.replay_speed, bank=valve_bank)
+    else:
+        factories = device_factories(
+            pump_profiles,
+            pump_enabled=pump_enabled,
+            valve_enabled=valve_enabled,
+            dry_run=dry_run,
+            prefer_detection=not args.no_detect,
+            valve_bank=valve_bank,
+            microscope_settings=(config.get("microscope settings") or {}) if microscope_enabled else None,
+        )
+    timeouts = {name: args.init_timeout or DEFAULT_INIT_TIMEOUTS.get(name, 10.0) for name in factories}
+    timings: Dict[str, float] = {}
+    try:
+        devices = start_devices(factories, timeouts=timeouts, timings=timings)
+    except DeviceInitError as e:
+        for name, msg in e.errors.items():
+            print(f"Failed to initialize {name}: {msg}")
+        return 1
+    if timings:
+        detail = ", ".join(f"{name} {t:.2f}s" for name, t in timings.items())
+        print(f"[INFO] Devices ready in {max(timings.values()):.2f}s ({detail})")
+    pump = devices.get("pump")
+    valve = devices.get("valve")
+    microscope = devices.get("microscope")
+    microscope_settings = config.get("microscope settings") or {}
+    # Everything opened after the devices is set up inside the try, so a failure
+    # (bad --save-frames dir, locked --store DB, ...) still closes the devices
+    frame_writer = sensor_stream = trace_writer = capture_sync = recorder = profiler = engine = journal = None
+    status = "ok"
+    try:
+        if microscope and args.save_frames:
+            from src.utils.frame_writer import FrameWriter
+
+            run_dir = os.path.join(args.save_frames, time.strftime("run-%Y%m%d-%H%M%S"))
+            frame_writer = FrameWriter(
+                run_dir,
+                microscope.ring.frames.shape[1:],
+                microscope.ring.frames.dtype,
+                workers=int(microscope_settings.get("writer_workers", 2)),
+                chunk_frames=int(microscope_settings.get("chunk_frames", 32)),
+                compression=microscope_settings.get("compression", "zlib"),
             )
-            try:
-                pump = BartelsPumpController(pump_cfg)
-            except Exception as e:  # pragma: no cover
-                print(f"Failed to initialize pump: {e}")
-                return 1
-            # Fail-fast if underlying serial handle missing
-            if getattr(pump, 'pump', None) is None:
-                print(
-                    "ERROR: Pump serial connection not established. "
-                    "Check wiring, drivers, or override with PUMP_PORT in .env."
-                )
-                return 1
-            # Allow device settle
-            time.sleep(0.3)
+            frame_writer.attach(microscope.ring)
+            print(f"[INFO] Saving microscope frames to {run_dir}")
+        if microscope and microscope_settings.get("continuous", True):
+            # Frames land in the microscope's preallocated ring on its own thread
+            microscope.start_capture()
 
-    valve = None
-    if valve_enabled:
-        if dry_run:
-            valve = MockValve()
-        else:
+        stream_settings = config.get("sensor stream")
+        if valve and stream_settings:
+            # Flow/pressure samples decoded on a reader thread into a preallocated ring
             try:
-                print(
-                    f"[INFO] Valve port resolved: {env_ports['valve_port']} "
-                    f"(env={env_ports.get('valve_from_env')}, detected={env_ports.get('valve_detected')})"
+                sensor_stream = valve.start_stream(
+                    int(stream_settings.get("rate_hz", 1000)),
+                    capacity=int(stream_settings.get("buffer_samples", 65536)),
+                    channels=stream_settings.get("channels"),
                 )
-                valve = ValveController(env_ports["valve_port"], env_ports["valve_baud"])
-            except Exception as e:  # pragma: no cover
-                print(f"Failed to initialize valve: {e}")
-                return 1
+                print(f"[INFO] Streaming sensors at {sensor_stream.rate_hz:.0f} Hz")
+            except Exception as e:
+                print(f"[WARN] Sensor streaming not started: {e}")
 
-    try:
-        run_sequence(config, pump, valve, pump_profiles, dry_run=dry_run)
+        if args.record_trace and not (dry_run or args.replay_trace):
+            trace_writer = TraceWriter(args.record_trace)
+            if pump:
+                record_pump(pump, trace_writer)
+            if valve:
+                record_valve(valve, trace_writer)
+            print(f"[INFO] Recording device I/O to {args.record_trace}")
+
+        if microscope and capture_triggers:
+            capture_sync = CaptureSync(microscope, capture_triggers)
+            pump = capture_sync.wrap_device(pump, "pump")
+            valve = capture_sync.wrap_device(valve, "valve")
+
+        if args.store:
+            recorder = RunRecorder(RunStore(args.store_db), rig=args.rig, protocol=args.yaml_file,
+                                   config=config)
+            for name, seconds in timings.items():
+                recorder.measure(f"init_s.{name}", seconds)
+            print(f"[INFO] Recording run {recorder.run_id} (rig {recorder.rig}) to {recorder.store.path}")
+
+        profiler = RunProfiler(listener=recorder) if (args.profile or recorder) else None
+        if args.precise or args.realtime or args.cpu is not None:
+            engine = TimingEngine(realtime=args.realtime, cpu=args.cpu)
+        if journal_path:
+            journal = RunJournal(journal_path, config.get("run") or [], source=args.yaml_file,
+                                 resume_from=checkpoint)
+            print(f"[INFO] Checkpointing run position to {journal_path}")
+        if checkpoint is not None:
+            print(f"[RESUME] Continuing at step {checkpoint.step + 1}/{len(config.get('run') or [])} "
+                  f"({checkpoint.elapsed_s:.1f}s into it; last checkpoint "
+                  f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(checkpoint.updated_at))})")
+            restored = journal.restore(pump, valve)
+            print(f"[RESUME] Restored {', '.join(restored) if restored else 'no recorded device state'}")
+        if engine:
+            engine.run(run_sequence, config, pump, valve, pump_profiles, dry_run=dry_run, profiler=profiler,
+                       journal=journal, sleep=engine.sleep)
+            print(f"[INFO] Precision timing: {', '.join(engine.applied)}; "
+                  f"max wake-up lateness {engine.max_late_ns / 1e6:.3f} ms")
+        else:
+            run_sequence(config, pump, valve, pump_profiles, dry_run=dry_run, profiler=profiler, journal=journal)
     except KeyboardInterrupt:
+        status = "interrupted"
         print("\n[INTERRUPT] Caught Ctrl+C – shutting down devices...")
         try:
             if pump:
@@ -502,17 +1019,70 @@ def main(argv: list[str] | None = None) -> int:
                 valve.off()
         except Exception:
             pass
+    except BaseException:
+        status = "error"
+        raise
     finally:
+        if journal:
+            journal.close("complete" if status == "ok" else status)
+            if status != "ok":
+                print(f"[INFO] Run position saved to {journal.path}; continue with --resume"
+                      + (f" --journal {journal.path}" if args.journal else ""))
+        recoveries = getattr(pump, "recoveries", None) if pump else None
+        if recoveries:
+            print(f"[INFO] Pump link recovered {len(recoveries)}x (worst {1e3 * max(recoveries):.0f} ms)")
+            if recorder:
+                for seconds in recoveries:
+                    recorder.measure("pump_recovery_s", seconds)
         if pump:
             try:
                 pump.close()
             except Exception:
                 pass
+        if sensor_stream:
+            try:
+                valve.stop_stream()
+            except Exception:
+                pass
+            print(sensor_stream.format_stats())
         if valve:
             try:
                 valve.close()
             except Exception:
                 pass
+        if capture_sync:
+            capture_sync.close()
+            print(capture_sync.format_report())
+        if microscope:
+            microscope.close()
+            st = microscope.stats()
+            print(f"[INFO] Microscope captured {st['frames']} frames ({st['fps']:.1f} fps, "
+                  f"max read {st['max_read_ms']:.1f} ms, ring {st['buffer_frames']} frames / {st['buffer_mb']:.1f} MB)")
+        if frame_writer:
+            frame_writer.close()
+            print(frame_writer.format_stats(frame_writer.stats()))
+        if trace_writer:
+            trace_writer.close()
+        if profiler and args.profile:
+            write_profile(profiler, args.profile_json)
+        if recorder:
+            if capture_sync:
+                for c in capture_sync.captures:
+                    recorder.measure("capture_offset_error_s", c.error_s, {"event": c.event}, t=c.frame_time)
+            if microscope:
+                recorder.measure("microscope_fps", microscope.stats()["fps"])
+            if frame_writer:
+                recorder.measure("frames_dropped", frame_writer.stats()["dropped"])
+            if sensor_stream:
+                st = sensor_stream.stats()
+                recorder.measure("sensor_rate_hz", st["achieved_hz"])
+                recorder.measure("sensor_packets_lost", st["lost_packets"])
+                if st["samples"]:
+                    _, values = sensor_stream.latest()
+                    for i, name in enumerate(sensor_stream.channels):
+                        recorder.measure(f"sensor_mean.{name}", float(values[:, i].mean()))
+            recorder.close(status)
+            recorder.store.close()
     print("Sequence complete.")
     return 0
 
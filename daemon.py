@@ -0,0 +1,362 @@
+"""Long-running device daemon that keeps the pump and valve connections open.
+
+Opening the devices is the slow part of every ``cli.py`` invocation (USB
+claim, Arduino auto-reset, settle delays). The daemon opens them once and
+serves run requests over a Unix domain socket, so back-to-back protocol runs
+start immediately.
+
+Usage examples (from project root):
+    python daemon.py                       # pump + valve, default socket
+    python daemon.py --no-valve            # pump only
+    python daemon.py --dry-run             # mock devices (no hardware)
+    python cli.py config_examples/continuous_switching.yaml --daemon
+
+Protocol (newline-delimited JSON, one request per connection):
+    {"op": "ping"}                           -> {"type": "done", "ok": true, ...}
+    {"op": "status"}                         -> {"type": "done", "ok": true, "status": {...}}
+    {"op": "run", "config": {...}}           -> {"type": "log", "line": ...}* then {"type": "done", ...}
+    {"op": "step", "step": {...}}            -> same as run with a single step
+    {"op": "shutdown"}                       -> {"type": "done", "ok": true}
+
+Closing the client connection during a run aborts it at the next step; the
+pump is stopped and the valve forced OFF, as on Ctrl+C in the CLI.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from typing import Any, Callable, Dict, Iterator, Optional
+
+from cli import DEFAULT_INIT_TIMEOUTS, MockPump, MockValve, apply_pump_profile, init_pump, init_valve, run_sequence
+from src.utils.device_startup import start_devices
+
+ENV_SOCKET = "DEVICE_DAEMON_SOCKET"
+
+
+def default_socket_path() -> str:
+    """Return the socket path from ``DEVICE_DAEMON_SOCKET`` or a per-user default."""
+    env = os.getenv(ENV_SOCKET)
+    if env:
+        return env
+    runtime_dir = os.getenv("XDG_RUNTIME_DIR") or tempfile.gettempdir()
+    uid = os.getuid() if hasattr(os, "getuid") else 0
+    return os.path.join(runtime_dir, f"micropump-{uid}.sock")
+
+
+class DaemonError(RuntimeError):
+    """Raised by the client when the daemon is unreachable or reports a failure."""
+
+
+class _ClientGone(BaseException):
+    """Aborts a run when the requesting client disconnects.
+
+    Derives from BaseException so the per-step ``except Exception`` handlers in
+    ``run_sequence`` do not swallow it.
+    """
+
+
+class _SocketLog:
+    """File-like object forwarding printed lines to the client as log messages."""
+
+    def __init__(self, conn: socket.socket, cancelled: threading.Event):
+        self._conn = conn
+        self._cancelled = cancelled
+        self._pending = ""
+
+    def write(self, text: str) -> int:
+        if self._cancelled.is_set():
+            raise _ClientGone()
+        self._pending += text
+        while "\n" in self._pending:
+            line, self._pending = self._pending.split("\n", 1)
+            try:
+                _send_message(self._conn, {"type": "log", "line": line})
+            except OSError as exc:
+                self._cancelled.set()
+                raise _ClientGone() from exc
+        return len(text)
+
+    def flush(self) -> None:
+        pass
+
+    def sleep(self, seconds: float) -> None:
+        """Interruptible replacement for ``time.sleep`` used by ``run_sequence``."""
+        if self._cancelled.wait(max(0.0, seconds)):
+            raise _ClientGone()
+
+
+def _send_message(conn: socket.socket, message: Dict[str, Any]) -> None:
+    conn.sendall((json.dumps(message) + "\n").encode("utf-8"))
+
+
+class DeviceDaemon:
+    """Owns the device instances and executes run requests one at a time."""
+
+    def __init__(self, *, pump_enabled: bool = True, valve_enabled: bool = True,
+                 dry_run: bool = False, prefer_detection: bool = True, valve_bank: bool = False):
+        self.dry_run = dry_run
+        self.pump = None
+        self.valve = None
+        self.started_at = time.time()
+        self.runs_completed = 0
+        self._lock = threading.Lock()
+
+        factories: Dict[str, Callable[[], Any]] = {}
+        if pump_enabled:
+            factories["pump"] = MockPump if dry_run else init_pump
+        if valve_enabled:
+            factories["valve"] = MockValve if dry_run else (lambda: init_valve(prefer_detection, bank=valve_bank))
+        timeouts = {name: DEFAULT_INIT_TIMEOUTS.get(name, 10.0) for name in factories}
+        devices = start_devices(factories, timeouts=timeouts)
+        self.pump = devices.get("pump")
+        self.valve = devices.get("valve")
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "pid": os.getpid(),
+            "dry_run": self.dry_run,
+            "pump": self.pump is not None,
+            "valve": self.valve is not None,
+            "busy": self._lock.locked(),
+            "uptime_s": round(time.time() - self.started_at, 3),
+            "runs_completed": self.runs_completed,
+        }
+
+    def run(self, config: Dict[str, Any], log: _SocketLog) -> None:
+        """Execute a parsed YAML config against the open devices."""
+        required_hw = config.get("required hardware", {})
+        if required_hw.get("pump") and self.pump is None:
+            raise DaemonError("Config requires a pump but the daemon was started without one")
+        if (required_hw.get("valve") or required_hw.get("valve bank")) and self.valve is None:
+            raise DaemonError("Config requires a valve but the daemon was started without one")
+        pump_profiles = config.get("pump settings", {}) if self.pump is not None else {}
+
+        with self._lock:
+            try:
+                with redirect_stdout(log):
+                    if self.pump is not None and pump_profiles:
+                        # Same semantics as the CLI: the first profile is the initial configuration.
+                        # Always sent, as earlier runs' pump_* steps or flow control may have changed the pump.
+                        apply_pump_profile(self.pump, next(iter(pump_profiles)), pump_profiles, start=False)
+                    run_sequence(config, self.pump, self.valve, pump_profiles,
+                                 dry_run=self.dry_run, sleep=log.sleep)
+            except _ClientGone:
+                logging.warning("Client disconnected mid-run")
+                self._safe_state()
+                raise
+            except BaseException as exc:
+                # Config errors (SystemExit from run_sequence) and device failures leave the
+                # devices wherever the run stopped; make them safe before reporting.
+                logging.warning("Run aborted: %s", exc or type(exc).__name__)
+                self._safe_state()
+                raise
+            self.runs_completed += 1
+
+    def _safe_state(self) -> None:
+        logging.info("Stopping pump and closing valve")
+        try:
+            if self.pump:
+                self.pump.bartels_stop()
+        except Exception:
+            pass
+        try:
+            if self.valve:
+                self.valve.off()
+        except Exception:
+            pass
+
+    def close(self) -> None:
+        self._safe_state()
+        for device in (self.pump, self.valve):
+            if device is not None:
+                try:
+                    device.close()
+                except Exception:
+                    pass
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    server: "_DaemonServer"
+
+    def handle(self) -> None:
+        conn: socket.socket = self.request
+        reader = conn.makefile("r", encoding="utf-8")
+        try:
+            request = json.loads(reader.readline() or "{}")
+        except json.JSONDecodeError as exc:
+            _send_message(conn, {"type": "done", "ok": False, "error": f"Bad request: {exc}"})
+            return
+        op = request.get("op")
+        daemon = self.server.daemon_state
+        try:
+            if op == "ping":
+                _send_message(conn, {"type": "done", "ok": True, "pid": os.getpid()})
+            elif op == "status":
+                _send_message(conn, {"type": "done", "ok": True, "status": daemon.status()})
+            elif op in ("run", "step"):
+                config = request.get("config") or {}
+                if op == "step":
+                    config = dict(config, run=[request.get("step")])
+                cancelled = threading.Event()
+                watcher = threading.Thread(target=self._watch_disconnect, args=(conn, cancelled), daemon=True)
+                watcher.start()
+                start = time.perf_counter()
+                daemon.run(config, _SocketLog(conn, cancelled))
+                _send_message(conn, {"type": "done", "ok": True,
+                                     "elapsed_s": round(time.perf_counter() - start, 6)})
+            elif op == "shutdown":
+                _send_message(conn, {"type": "done", "ok": True})
+                threading.Thread(target=self.server.shutdown, daemon=True).start()
+            else:
+                _send_message(conn, {"type": "done", "ok": False, "error": f"Unknown op: {op!r}"})
+        except _ClientGone:
+            pass
+        except (DaemonError, SystemExit) as exc:
+            # run_sequence uses sys.exit() for config errors; report them instead of exiting.
+            _send_message(conn, {"type": "done", "ok": False, "error": str(exc)})
+        except Exception as exc:
+            logging.exception("Request %r failed", op)
+            _send_message(conn, {"type": "done", "ok": False, "error": f"{type(exc).__name__}: {exc}"})
+
+    @staticmethod
+    def _watch_disconnect(conn: socket.socket, cancelled: threading.Event) -> None:
+        """Flag the run as cancelled once the client closes its end of the socket."""
+        try:
+            while not cancelled.is_set():
+                if not conn.recv(1024):
+                    break
+        except OSError:
+            pass
+        cancelled.set()
+
+
+class _DaemonServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, path: str, daemon_state: DeviceDaemon):
+        self.daemon_state = daemon_state
+        super().__init__(path, _RequestHandler)
+
+
+class DaemonClient:
+    """Thin client submitting steps or whole configs to a running daemon."""
+
+    def __init__(self, socket_path: Optional[str] = None, *, timeout: float = 5.0):
+        self.socket_path = socket_path or default_socket_path()
+        self.timeout = timeout
+
+    def _request(self, payload: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        try:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.settimeout(self.timeout)
+            conn.connect(self.socket_path)
+        except OSError as exc:
+            raise DaemonError(f"Device daemon not reachable at {self.socket_path}: {exc}") from exc
+        with conn:
+            conn.settimeout(None)  # runs can take as long as the protocol
+            _send_message(conn, payload)
+            for raw in conn.makefile("r", encoding="utf-8"):
+                message = json.loads(raw)
+                yield message
+                if message.get("type") == "done":
+                    return
+        raise DaemonError("Daemon closed the connection without a result")
+
+    def _result(self, payload: Dict[str, Any], echo: bool) -> Dict[str, Any]:
+        for message in self._request(payload):
+            if message["type"] == "log":
+                if echo:
+                    print(message["line"])
+            elif not message.get("ok"):
+                raise DaemonError(message.get("error", "unknown daemon error"))
+            else:
+                return message
+        raise DaemonError("No result from daemon")  # pragma: no cover
+
+    def ping(self) -> bool:
+        try:
+            return bool(self._result({"op": "ping"}, echo=False).get("ok"))
+        except DaemonError:
+            return False
+
+    def status(self) -> Dict[str, Any]:
+        return self._result({"op": "status"}, echo=False)["status"]
+
+    def run(self, config: Dict[str, Any], *, echo: bool = True) -> float:
+        """Run a full parsed YAML config; returns the daemon-side elapsed seconds."""
+        return self._result({"op": "run", "config": config}, echo)["elapsed_s"]
+
+    def step(self, step: Dict[str, Any], *, pump_settings: Optional[Dict[str, Any]] = None,
+             echo: bool = True) -> float:
+        """Run a single ``run:`` step, e.g. ``{"valve_on": 0}``."""
+        config = {"pump settings": pump_settings} if pump_settings else {}
+        return self._result({"op": "step", "config": config, "step": step}, echo)["elapsed_s"]
+
+    def shutdown(self) -> None:
+        self._result({"op": "shutdown"}, echo=False)
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Keep pump/valve connections open and serve run requests.")
+    p.add_argument("--socket", default=None, help=f"Unix socket path (default: ${ENV_SOCKET} or per-user temp path)")
+    p.add_argument("--no-pump", action="store_true", help="Do not open the pump")
+    p.add_argument("--no-valve", action="store_true", help="Do not open the valve")
+    p.add_argument("--valve-bank", action="store_true", help="The valve port drives a multi-valve manifold")
+    p.add_argument("--dry-run", action="store_true", help="Use mock devices instead of hardware")
+    p.add_argument(
+        "--no-detect", action="store_true", help="Disable VID/PID auto-detection; rely only on env/default"
+    )
+    return p
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s [daemon] %(message)s")
+    socket_path = args.socket or default_socket_path()
+
+    if os.path.exists(socket_path):
+        if DaemonClient(socket_path, timeout=0.5).ping():
+            print(f"A device daemon is already running on {socket_path}")
+            return 1
+        os.unlink(socket_path)  # stale socket from a crashed daemon
+
+    try:
+        state = DeviceDaemon(
+            pump_enabled=not args.no_pump,
+            valve_enabled=not args.no_valve,
+            dry_run=args.dry_run,
+            prefer_detection=not args.no_detect,
+            valve_bank=args.valve_bank,
+        )
+    except Exception as e:
+        print(f"Failed to initialize devices: {e}")
+        return 1
+
+    server = _DaemonServer(socket_path, state)
+    logging.info("Serving on %s (pump=%s, valve=%s)", socket_path, state.pump is not None, state.valve is not None)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        print()
+    finally:
+        server.server_close()
+        state.close()
+        try:
+            os.unlink(socket_path)
+        except OSError:
+            pass
+        logging.info("Daemon stopped")
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
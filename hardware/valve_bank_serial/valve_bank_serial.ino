@@ -0,0 +1,153 @@
+// valve_bank_serial.ino
+// Arduino sketch for driving a manifold of up to 16 relays (valves) via serial commands.
+//
+// Commands (send over Serial Monitor or from Python, see src/controllers/valve_bank_control.py):
+//   MASK <hex>     -> set every valve at once; bit i = valve i (e.g. MASK 00A5)
+//   SET <i> ON     -> open a single valve (i = 0..N-1)
+//   SET <i> OFF    -> close a single valve
+//   MASK?          -> print current mask as "MASK <hex>"
+//   COUNT?         -> print number of valves as "COUNT <n>"
+//   ON / OFF       -> open / close all valves
+//   TOGGLE         -> invert all valves
+//   STATE?         -> print current mask as "STATE <hex>"
+//
+// Replies to state-changing commands: "OK MASK <hex>" with the applied mask.
+//
+// All outputs of a MASK update are written with interrupts disabled, one
+// port register write per AVR port, so the whole manifold switches within a
+// few CPU cycles instead of one digitalWrite() per valve.
+//
+// Pins: valve i is driven by VALVE_PINS[i]. D13 is left out on purpose: the
+// Uno bootloader blinks the LED on D13 on every reset (and the port resets on
+// each host connect), which would pulse a valve wired there. Valve 11 is on A4.
+//
+// Baud rate: 115200
+
+const uint8_t VALVE_PINS[] = {2, 3, 4, 5, 6, 7, 8, 9, 10, 11, 12, A4, A0, A1, A2, A3};
+const uint8_t NUM_VALVES = sizeof(VALVE_PINS) / sizeof(VALVE_PINS[0]);
+const bool RELAY_ACTIVE_HIGH = true;   // NOTE: set to false for active-LOW relay boards
+
+uint16_t valveMask = 0;                // bit i set = valve i ON
+
+#if defined(__AVR__)
+// Output register and bit of every valve pin, resolved once in setup()
+volatile uint8_t* pinRegister[NUM_VALVES];
+uint8_t pinBit[NUM_VALVES];
+#endif
+
+uint16_t allValvesMask() {
+  return (NUM_VALVES >= 16) ? 0xFFFF : (uint16_t)((1u << NUM_VALVES) - 1);
+}
+
+void applyMask(uint16_t mask) {
+  mask &= allValvesMask();
+  uint16_t level = RELAY_ACTIVE_HIGH ? mask : (uint16_t)~mask;
+#if defined(__AVR__)
+  // Collect the bits to set/clear per distinct port register (Uno: PORTB/C/D)
+  volatile uint8_t* regs[NUM_VALVES];
+  uint8_t setBits[NUM_VALVES] = {0};
+  uint8_t clearBits[NUM_VALVES] = {0};
+  uint8_t numRegs = 0;
+  for (uint8_t i = 0; i < NUM_VALVES; i++) {
+    uint8_t r = 0;
+    while (r < numRegs && regs[r] != pinRegister[i]) r++;
+    if (r == numRegs) {
+      regs[numRegs++] = pinRegister[i];
+    }
+    if (level & (1u << i)) setBits[r] |= pinBit[i];
+    else clearBits[r] |= pinBit[i];
+  }
+  noInterrupts();
+  for (uint8_t r = 0; r < numRegs; r++) {
+    *regs[r] = (*regs[r] & ~clearBits[r]) | setBits[r];
+  }
+  interrupts();
+#else
+  for (uint8_t i = 0; i < NUM_VALVES; i++) {
+    digitalWrite(VALVE_PINS[i], (level & (1u << i)) ? HIGH : LOW);
+  }
+#endif
+  valveMask = mask;
+}
+
+void printMask(const char* prefix) {
+  char buf[24];
+  snprintf(buf, sizeof(buf), "%s%04X", prefix, valveMask);
+  Serial.println(buf);
+}
+
+void setup() {
+  for (uint8_t i = 0; i < NUM_VALVES; i++) {
+    pinMode(VALVE_PINS[i], OUTPUT);
+#if defined(__AVR__)
+    pinRegister[i] = portOutputRegister(digitalPinToPort(VALVE_PINS[i]));
+    pinBit[i] = digitalPinToBitMask(VALVE_PINS[i]);
+#endif
+  }
+  applyMask(0);                        // start with every valve OFF
+  Serial.begin(115200);
+  Serial.print("Valve controller ready. Bank of ");
+  Serial.print(NUM_VALVES);
+  Serial.println(" valves. Send MASK <hex> / SET <i> ON|OFF / MASK? / COUNT?");
+}
+
+void loop() {
+  if (Serial.available()) {
+    String cmd = Serial.readStringUntil('\n');
+    cmd.trim();   // remove whitespace/newlines
+    cmd.toUpperCase();
+
+    if (cmd.startsWith("MASK ")) {
+      String arg = cmd.substring(5);
+      arg.trim();
+      char* end;
+      unsigned long value = strtoul(arg.c_str(), &end, 16);
+      if (arg.length() == 0 || *end != '\0' || value > allValvesMask()) {
+        Serial.println("ERR Bad mask");
+      } else {
+        applyMask((uint16_t)value);
+        printMask("OK MASK ");
+      }
+    }
+    else if (cmd.startsWith("SET ")) {
+      int space = cmd.indexOf(' ', 4);
+      long index = cmd.substring(4, space).toInt();
+      String state = (space > 0) ? cmd.substring(space + 1) : "";
+      state.trim();
+      if (space < 0 || index < 0 || index >= NUM_VALVES || (state != "ON" && state != "OFF")) {
+        Serial.println("ERR Usage: SET <i> ON|OFF");
+      } else if (state == "ON") {
+        applyMask(valveMask | (1u << index));
+        printMask("OK MASK ");
+      } else {
+        applyMask(valveMask & ~(1u << index));
+        printMask("OK MASK ");
+      }
+    }
+    else if (cmd == "MASK?") {
+      printMask("MASK ");
+    }
+    else if (cmd == "COUNT?") {
+      Serial.print("COUNT ");
+      Serial.println(NUM_VALVES);
+    }
+    else if (cmd == "ON") {
+      applyMask(allValvesMask());
+      printMask("OK MASK ");
+    }
+    else if (cmd == "OFF") {
+      applyMask(0);
+      printMask("OK MASK ");
+    }
+    else if (cmd == "TOGGLE") {
+      applyMask(~valveMask);
+      printMask("OK MASK ");
+    }
+    else if (cmd == "STATE?" || cmd == "STATE") {
+      printMask("STATE ");
+    }
+    else {
+      Serial.println("ERR Unknown command");
+    }
+  }
+}
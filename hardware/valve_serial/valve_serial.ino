@@ -5,46 +5,272 @@
 //   ON        -> energize relay (valve ON)
 //   OFF       -> de-energize relay (valve OFF)
 //   TOGGLE    -> switch state
-//   STATE?    -> print current state
+//   STATE?    -> print current state ("STATE ON", "STATE OFF" or "STATE PWM <period_ms> <duty>")
+//   PWM <period_ms> <duty> -> cycle the relay on the board: ON for <duty>% of every
+//                 <period_ms> (20-60000 ms, duty 0-100, ON/OFF phases >= 10 ms)
+//   PWM OFF   -> stop cycling, relay OFF (ON / OFF / TOGGLE also stop it)
+//   STREAM <hz> -> sample the sensor pins at <hz> (200-4000) and stream binary packets
+//   STREAM OFF  -> stop streaming
 //
 // Baud rate: 115200
+//
+// Sensor streaming: A0 (flow) and A1 (pressure) are sampled on a micros()
+// schedule. Every 8 samples are sent as one 57-byte little-endian packet:
+//
+//   0xA5 0x5A            sync
+//   uint8   seq          packet counter (gaps = packets dropped by the firmware)
+//   uint8   channels     number of ADC channels per sample (2)
+//   uint32  t0_us        micros() of the first sample
+//   8 x { uint16 dt_us; uint16 adc[2]; }   sample time relative to t0_us, raw ADC
+//   uint8   check        XOR of all bytes after the sync
+//
+// PWM: the relay edges are scheduled on millis() from the previous edge, so
+// the cycle does not drift and needs no host I/O while it runs. A duty of 0
+// or 100 simply holds the relay OFF or ON.
+//
+// Text replies ("OK ON", ...) are still sent as lines between packets, so
+// commands keep working while streaming. Packets are written only as fast as
+// the serial TX buffer drains, so sampling never blocks; if the link cannot
+// keep up (about 1.6 kHz at 115200 baud) whole packets are dropped and the
+// seq gap tells the host.
 
 const int RELAY_PIN = 7;      // Pin driving the relay module
 bool relayState = false;      // Track ON/OFF state
 
+const uint8_t SENSOR_PINS[] = {A0, A1};  // flow, pressure
+const uint8_t N_CHANNELS = 2;
+const uint8_t SAMPLES_PER_PACKET = 8;
+
+struct __attribute__((packed)) Sample {
+  uint16_t dt_us;
+  uint16_t adc[N_CHANNELS];
+};
+
+struct __attribute__((packed)) Packet {
+  uint8_t sync[2];
+  uint8_t seq;
+  uint8_t channels;
+  uint32_t t0_us;
+  Sample samples[SAMPLES_PER_PACKET];
+  uint8_t check;
+};
+
+bool streaming = false;
+unsigned long periodUs = 1000;
+unsigned long nextSampleUs = 0;
+uint8_t packetSeq = 0;
+Packet packets[2];            // one being filled, one being sent
+uint8_t fillIndex = 0;
+uint8_t filled = 0;           // samples in packets[fillIndex]
+int sendIndex = -1;           // packet being sent, -1 = none
+uint8_t sendPos = 0;
+
+bool pwmActive = false;
+unsigned long pwmPeriodMs = 0;
+unsigned long pwmOnMs = 0;
+unsigned long pwmNextEdgeMs = 0;
+long pwmDuty = 0;             // percent, for STATE?
+
+const unsigned long PWM_MIN_PERIOD_MS = 20;
+const unsigned long PWM_MAX_PERIOD_MS = 60000;
+const unsigned long PWM_MIN_PHASE_MS = 10;   // shortest ON or OFF phase the relay follows
+
+String line;                  // command being received (non-blocking)
+
+void reply(const char *text) {
+  Serial.println(text);
+}
+
+void setRelay(bool on) {
+  relayState = on;
+  digitalWrite(RELAY_PIN, on ? HIGH : LOW);   // NOTE: if relay is active-LOW, swap HIGH/LOW
+}
+
+void updatePwm() {
+  unsigned long now = millis();
+  if ((long)(now - pwmNextEdgeMs) < 0) {
+    return;
+  }
+  // Next edge counts from this edge's deadline, not from `now`, so late loops do not accumulate
+  if (relayState) {
+    setRelay(false);
+    pwmNextEdgeMs += pwmPeriodMs - pwmOnMs;
+  } else {
+    setRelay(true);
+    pwmNextEdgeMs += pwmOnMs;
+  }
+}
+
+void handlePwm(String args) {
+  int space = args.indexOf(' ');
+  long period = space > 0 ? args.substring(0, space).toInt() : 0;
+  long duty = space > 0 ? args.substring(space + 1).toInt() : -1;
+  if (period < (long)PWM_MIN_PERIOD_MS || period > (long)PWM_MAX_PERIOD_MS || duty < 0 || duty > 100) {
+    reply("ERR PWM needs <period_ms 20-60000> <duty 0-100>");
+    return;
+  }
+  unsigned long onMs = (unsigned long)period * (unsigned long)duty / 100UL;
+  if (duty > 0 && duty < 100 && (onMs < PWM_MIN_PHASE_MS || period - onMs < PWM_MIN_PHASE_MS)) {
+    reply("ERR PWM ON and OFF phases must be >= 10 ms");
+    return;
+  }
+  pwmPeriodMs = period;
+  pwmOnMs = onMs;
+  pwmDuty = duty;
+  // 0% and 100% are steady states; anything else starts a cycle with the ON phase
+  pwmActive = duty > 0 && duty < 100;
+  setRelay(duty > 0);
+  pwmNextEdgeMs = millis() + onMs;
+  reply(("OK PWM " + String(period) + " " + String(duty)).c_str());
+}
+
+void startStreaming(long hz) {
+  periodUs = 1000000UL / (unsigned long)hz;
+  filled = 0;
+  sendIndex = -1;
+  nextSampleUs = micros();
+  streaming = true;
+}
+
+void sampleSensors() {
+  unsigned long now = micros();
+  if ((long)(now - nextSampleUs) < 0) {
+    return;
+  }
+  nextSampleUs += periodUs;
+  Packet &p = packets[fillIndex];
+  if (filled == 0) {
+    p.t0_us = now;
+  }
+  Sample &s = p.samples[filled];
+  s.dt_us = (uint16_t)(now - p.t0_us);
+  for (uint8_t c = 0; c < N_CHANNELS; c++) {
+    s.adc[c] = analogRead(SENSOR_PINS[c]);
+  }
+  if (++filled < SAMPLES_PER_PACKET) {
+    return;
+  }
+  // Packet complete: seal it and hand it to the sender if the sender is idle
+  p.sync[0] = 0xA5;
+  p.sync[1] = 0x5A;
+  p.seq = packetSeq++;
+  p.channels = N_CHANNELS;
+  uint8_t check = 0;
+  const uint8_t *bytes = (const uint8_t *)&p;
+  for (uint8_t i = 2; i < sizeof(Packet) - 1; i++) {
+    check ^= bytes[i];
+  }
+  p.check = check;
+  filled = 0;
+  if (sendIndex < 0) {
+    sendIndex = fillIndex;
+    sendPos = 0;
+    fillIndex ^= 1;
+  }
+  // else: link too slow, this packet is dropped (seq already advanced)
+}
+
+void sendPending() {
+  if (sendIndex < 0) {
+    return;
+  }
+  int room = Serial.availableForWrite();
+  if (room <= 0) {
+    return;
+  }
+  const uint8_t *bytes = (const uint8_t *)&packets[sendIndex];
+  uint8_t n = min((int)(sizeof(Packet) - sendPos), room);
+  Serial.write(bytes + sendPos, n);
+  sendPos += n;
+  if (sendPos >= sizeof(Packet)) {
+    sendIndex = -1;
+  }
+}
+
+void handleCommand(String cmd) {
+  cmd.trim();   // remove whitespace/newlines
+  cmd.toUpperCase();
+
+  if (cmd == "ON") {
+    pwmActive = false;
+    setRelay(true);
+    reply("OK ON");
+  }
+  else if (cmd == "OFF") {
+    pwmActive = false;
+    setRelay(false);
+    reply("OK OFF");
+  }
+  else if (cmd == "TOGGLE") {
+    pwmActive = false;
+    setRelay(!relayState);
+    reply(relayState ? "OK ON" : "OK OFF");
+  }
+  else if (cmd == "STATE?" || cmd == "STATE") {
+    if (pwmActive) {
+      reply(("STATE PWM " + String(pwmPeriodMs) + " " + String(pwmDuty)).c_str());
+    } else {
+      reply(relayState ? "STATE ON" : "STATE OFF");
+    }
+  }
+  else if (cmd == "PWM OFF") {
+    pwmActive = false;
+    setRelay(false);
+    reply("OK PWM OFF");
+  }
+  else if (cmd.startsWith("PWM ")) {
+    handlePwm(cmd.substring(4));
+  }
+  else if (cmd == "STREAM OFF") {
+    streaming = false;
+    while (sendIndex >= 0) {
+      sendPending();   // finish the packet in flight so the reply is not spliced into it
+    }
+    reply("OK STREAM OFF");
+  }
+  else if (cmd.startsWith("STREAM ")) {
+    long hz = cmd.substring(7).toInt();
+    if (hz < 200 || hz > 4000) {
+      reply("ERR STREAM rate must be 200-4000 Hz");
+    } else {
+      while (sendIndex >= 0) {
+        sendPending();
+      }
+      reply(("OK STREAM " + String(hz)).c_str());
+      startStreaming(hz);
+    }
+  }
+  else {
+    reply("ERR Unknown command");
+  }
+}
+
 void setup() {
   pinMode(RELAY_PIN, OUTPUT);
   digitalWrite(RELAY_PIN, LOW);  // start OFF
   Serial.begin(115200);
-  Serial.println("Valve controller ready. Send ON / OFF / TOGGLE / STATE?");
+  line.reserve(32);
+  Serial.println("Valve controller ready. Send ON / OFF / TOGGLE / STATE? / PWM");
 }
 
 void loop() {
-  if (Serial.available()) {
-    String cmd = Serial.readStringUntil('\n');
-    cmd.trim();   // remove whitespace/newlines
-    cmd.toUpperCase();
-
-    if (cmd == "ON") {
-      relayState = true;
-      digitalWrite(RELAY_PIN, HIGH);   // NOTE: if relay is active-LOW, change to LOW
-      Serial.println("OK ON");
-    }
-    else if (cmd == "OFF") {
-      relayState = false;
-      digitalWrite(RELAY_PIN, LOW);    // NOTE: if relay is active-LOW, change to HIGH
-      Serial.println("OK OFF");
-    }
-    else if (cmd == "TOGGLE") {
-      relayState = !relayState;
-      digitalWrite(RELAY_PIN, relayState ? HIGH : LOW);
-      Serial.println(relayState ? "OK ON" : "OK OFF");
-    }
-    else if (cmd == "STATE?" || cmd == "STATE") {
-      Serial.println(relayState ? "STATE ON" : "STATE OFF");
-    }
-    else {
-      Serial.println("ERR Unknown command");
+  if (pwmActive) {
+    updatePwm();
+  }
+  if (streaming) {
+    sampleSensors();
+  }
+  // Replies are only written between packets so they are never spliced into one
+  while (Serial.available() && sendIndex < 0) {
+    char c = Serial.read();
+    if (c == '\n') {
+      handleCommand(line);
+      line = "";
+    } else if (line.length() < 32) {
+      line += c;
     }
   }
+  if (streaming) {
+    sendPending();
+  }
 }
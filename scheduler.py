@@ -0,0 +1,388 @@
+"""Batch scheduler that runs queued protocol YAMLs across a pool of rigs.
+
+Each rig is one set of devices (pump, valve or valve bank, microscope)
+described in an inventory file. Jobs are protocol YAMLs; their
+``required hardware`` section decides which rigs can run them. Every job
+runs as its own ``cli.py`` process with the rig's devices selected through
+the environment (``PUMP_SERIAL``, ``VALVE_SERIAL_PORT``, ``RIG_ID``), so
+rigs work in parallel and a crashing protocol cannot take down the others.
+
+Inventory (``rigs.yaml``):
+
+    rigs:
+      rig1:
+        pump_serial: BP7-00123     # USB serial number of the pump
+        valve_port: /dev/ttyACM0   # or COM5
+        valve_bank: false
+        microscope: false
+      rig2:
+        pump_serial: BP7-00456
+        valve_port: /dev/ttyACM1
+
+Scheduling:
+- Jobs are ordered round-robin across owners (``owner:`` key in the YAML,
+  else ``--owner``, else the YAML's directory), first-in-first-out per
+  owner, so one person's batch cannot monopolise the lab.
+- A job that no free rig can serve waits. Each time a job with easier
+  requirements (more capable rigs) takes a rig it could have used counts
+  as a skip; after ``--max-skips`` skips it
+  reserves every capable rig, so jobs with easier requirements cannot take
+  them and the first one to become free goes to it.
+- Each rig is locked with a lock file (``--lock-dir``) while a job runs,
+  so several scheduler instances can share one inventory.
+
+Usage examples (from project root):
+    python scheduler.py --rigs rigs.yaml config_examples/*.yaml
+    python scheduler.py --rigs rigs.yaml --watch queue/          # also run YAMLs dropped into queue/
+    python scheduler.py --rigs rigs.yaml --dry-run config_examples/pump_on_10s.yaml -- --store
+"""
+
+from __future__ import annotations
+
+import argparse
+import itertools
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import OrderedDict, deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, Optional
+
+import yaml
+
+PROJECT_ROOT = os.path.abspath(os.path.dirname(__file__))
+CAPABILITIES = ("pump", "valve", "valve bank", "microscope")
+
+
+class SchedulerError(RuntimeError):
+    """Raised for an invalid inventory or job file."""
+
+
+class Rig:
+    """One set of devices that can run a job at a time."""
+
+    def __init__(self, name: str, spec: Dict[str, Any]):
+        self.name = name
+        self.spec = spec or {}
+        self.capabilities = {
+            "pump": bool(self.spec.get("pump", "pump_serial" in self.spec)),
+            "valve": bool(self.spec.get("valve", "valve_port" in self.spec)),
+            "valve bank": bool(self.spec.get("valve_bank", False)),
+            "microscope": bool(self.spec.get("microscope", False)),
+        }
+
+    def can_run(self, job: "Job") -> bool:
+        return all(self.capabilities.get(c, False) for c in job.needs)
+
+    def env(self) -> Dict[str, str]:
+        env = {"RIG_ID": self.name}
+        if self.spec.get("pump_serial"):
+            env["PUMP_SERIAL"] = str(self.spec["pump_serial"])
+        if self.spec.get("valve_port"):
+            env["VALVE_SERIAL_PORT"] = str(self.spec["valve_port"])
+        for key, value in (self.spec.get("env") or {}).items():
+            env[str(key)] = str(value)
+        return env
+
+
+class RigLock:
+    """Cross-process lock: an exclusively created file holding the owner's PID."""
+
+    def __init__(self, lock_dir: str, rig: str):
+        self.path = os.path.join(lock_dir, f"{rig}.lock")
+
+    def _stale(self) -> bool:
+        try:
+            with open(self.path, "r", encoding="utf-8") as f:
+                pid = int(f.read().strip() or 0)
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return True
+        except (OSError, ValueError):
+            return False
+        return False
+
+    def acquire(self) -> bool:
+        for _ in range(2):
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if not self._stale():
+                    return False
+                try:
+                    os.unlink(self.path)  # left behind by a crashed scheduler
+                except FileNotFoundError:
+                    pass
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(str(os.getpid()))
+            return True
+        return False
+
+    def release(self) -> None:
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, path: str, owner: Optional[str] = None):
+        self.id = next(self._ids)
+        self.path = os.path.abspath(path)  # cli.py runs with cwd=PROJECT_ROOT, not ours
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                config = yaml.safe_load(f) or {}
+        except (OSError, yaml.YAMLError) as exc:
+            raise SchedulerError(f"Cannot read job {path}: {exc}") from exc
+        hardware = config.get("required hardware") or {}
+        if not hardware:
+            raise SchedulerError(f"Job {path} has no 'required hardware' section")
+        self.needs = [c for c in CAPABILITIES if hardware.get(c)]
+        self.owner = str(config.get("owner") or owner or Path(path).resolve().parent.name)
+        self.submitted = time.time()
+        self.started: Optional[float] = None
+        self.finished: Optional[float] = None
+        self.rig: Optional[str] = None
+        self.returncode: Optional[int] = None
+        self.skips = 0
+        self.log_path: Optional[str] = None
+
+    def __repr__(self) -> str:
+        return f"Job({self.id}, {os.path.basename(self.path)}, owner={self.owner}, needs={self.needs})"
+
+
+class JobScheduler:
+    """Dispatches queued jobs to free, capable rigs (one job per rig at a time)."""
+
+    def __init__(self, rigs: List[Rig], *, lock_dir: str, log_dir: str, cli_args: Optional[List[str]] = None,
+                 max_skips: int = 3, python: str = sys.executable):
+        if not rigs:
+            raise SchedulerError("Inventory has no rigs")
+        self.rigs = OrderedDict((rig.name, rig) for rig in rigs)
+        self.lock_dir = lock_dir
+        self.log_dir = log_dir
+        self.cli_args = list(cli_args or [])
+        self.max_skips = max_skips
+        self.python = python
+        os.makedirs(lock_dir, exist_ok=True)
+        os.makedirs(log_dir, exist_ok=True)
+        self._queues: "OrderedDict[str, Deque[Job]]" = OrderedDict()
+        self._busy: Dict[str, Job] = {}
+        self._reserved: Dict[str, Job] = {}  # rig name -> starving job it is held for
+        self._locks: Dict[str, RigLock] = {}
+        self._cond = threading.Condition()
+        self.finished: List[Job] = []
+        self._threads: List[threading.Thread] = []
+
+    # Queue ------------------------------------------------------------------------
+    def submit(self, job: Job) -> Job:
+        if not any(rig.can_run(job) for rig in self.rigs.values()):
+            raise SchedulerError(f"No rig in the inventory provides {job.needs} for {job.path}")
+        with self._cond:
+            self._queues.setdefault(job.owner, deque()).append(job)
+            self._cond.notify_all()
+        return job
+
+    @property
+    def pending(self) -> int:
+        with self._cond:
+            return sum(len(q) for q in self._queues.values())
+
+    def _fair_order(self) -> List[Job]:
+        """Round-robin across owners, FIFO within each owner."""
+        queues = [list(q) for q in self._queues.values()]
+        ordered = []
+        for layer in itertools.zip_longest(*queues):
+            ordered.extend(job for job in layer if job is not None)
+        return ordered
+
+    def _capable(self, job: Job) -> set:
+        return {name for name, rig in self.rigs.items() if rig.can_run(job)}
+
+    def _assign(self) -> List[tuple]:
+        """Pick (job, rig) pairs for this round; caller holds the condition."""
+        free = [r for name, r in self.rigs.items() if name not in self._busy]
+        assignments = []
+        for job in self._fair_order():
+            rig = next((r for r in free if r.can_run(job) and self._reserved.get(r.name, job) is job), None)
+            if rig is None:
+                continue
+            free.remove(rig)
+            lock = RigLock(self.lock_dir, rig.name)
+            if not lock.acquire():
+                continue  # in use by another scheduler instance
+            self._queues[job.owner].remove(job)
+            self._locks[rig.name] = lock
+            self._busy[rig.name] = job
+            self._reserved = {name: held for name, held in self._reserved.items() if held is not job}
+            assignments.append((job, rig))
+        # A waiting job is passed over when a job with easier requirements took a rig it could have used
+        for job in self._fair_order():
+            capable = self._capable(job)
+            if not any(rig.name in capable and self._capable(other) > capable for other, rig in assignments):
+                continue
+            job.skips += 1
+            if job.skips > self.max_skips and job not in self._reserved.values():
+                # Starving job: hold every capable rig not yet held for an earlier one until it gets one
+                for rig in self.rigs.values():
+                    if rig.can_run(job):
+                        self._reserved.setdefault(rig.name, job)
+        for owner in [o for o, q in self._queues.items() if not q]:
+            del self._queues[owner]
+        # Rotate owners so the next round starts with the next owner
+        if self._queues:
+            self._queues.move_to_end(next(iter(self._queues)))
+        return assignments
+
+    # Execution --------------------------------------------------------------------
+    def _run(self, job: Job, rig: Rig) -> None:
+        job.rig = rig.name
+        job.started = time.time()
+        job.log_path = os.path.join(self.log_dir, f"job{job.id:04d}-{Path(job.path).stem}-{rig.name}.log")
+        env = {**os.environ, **rig.env()}
+        cmd = [self.python, os.path.join(PROJECT_ROOT, "cli.py"), job.path] + self.cli_args
+        print(f"[SCHED] job {job.id} {job.path} -> {rig.name} (waited {job.started - job.submitted:.1f}s)")
+        try:
+            with open(job.log_path, "w", encoding="utf-8") as log:
+                job.returncode = subprocess.call(cmd, env=env, stdout=log, stderr=subprocess.STDOUT,
+                                                 cwd=PROJECT_ROOT)
+        except OSError as exc:
+            job.returncode = -1
+            print(f"[SCHED] job {job.id} failed to start: {exc}")
+        job.finished = time.time()
+        status = "ok" if job.returncode == 0 else f"exit {job.returncode}"
+        print(f"[SCHED] job {job.id} on {rig.name} finished: {status} ({job.finished - job.started:.1f}s)")
+        with self._cond:
+            del self._busy[rig.name]
+            self._locks.pop(rig.name).release()
+            self.finished.append(job)
+            self._cond.notify_all()
+
+    def dispatch(self) -> int:
+        """Start every job that can run now; returns how many were started."""
+        with self._cond:
+            assignments = self._assign()
+        for job, rig in assignments:
+            thread = threading.Thread(target=self._run, args=(job, rig), name=f"job-{job.id}", daemon=True)
+            self._threads.append(thread)
+            thread.start()
+        return len(assignments)
+
+    def run(self, watch: Optional["QueueWatcher"] = None, poll_s: float = 1.0) -> None:
+        """Dispatch until the queue is empty and all rigs are idle (forever with a watcher)."""
+        while True:
+            if watch is not None:
+                for job in watch.poll():
+                    self.submit(job)
+            self.dispatch()
+            with self._cond:
+                if not self._queues and not self._busy and watch is None:
+                    return
+                self._cond.wait(poll_s)
+
+    def release_all(self) -> None:
+        with self._cond:
+            for lock in self._locks.values():
+                lock.release()
+            self._locks.clear()
+
+    def report(self) -> str:
+        lines = ["[SCHED] job summary", "    id  rig          status    wait(s)   run(s)  protocol"]
+        for job in sorted(self.finished, key=lambda j: j.id):
+            status = "ok" if job.returncode == 0 else f"exit {job.returncode}"
+            lines.append(f"  {job.id:>4}  {job.rig:<12} {status:<8} {job.started - job.submitted:8.1f} "
+                         f"{job.finished - job.started:8.1f}  {job.path}")
+        if self.finished:
+            span = max(j.finished for j in self.finished) - min(j.submitted for j in self.finished)
+            busy = sum(j.finished - j.started for j in self.finished)
+            lines.append(f"  {len(self.finished)} jobs in {span:.1f}s on {len(self.rigs)} rigs "
+                         f"(rig utilisation {100 * busy / (span * len(self.rigs)) if span else 0:.0f}%)")
+        return "\n".join(lines)
+
+
+class QueueWatcher:
+    """Turns YAML files appearing in a spool directory into jobs (each file once)."""
+
+    def __init__(self, directory: str, owner: Optional[str] = None):
+        self.directory = os.path.abspath(directory)
+        self.owner = owner
+        self._seen: set = set()
+
+    def poll(self) -> List[Job]:
+        jobs = []
+        for path in sorted(Path(self.directory).glob("*.y*ml"), key=lambda p: p.stat().st_mtime):
+            if str(path) in self._seen:
+                continue
+            self._seen.add(str(path))
+            try:
+                jobs.append(Job(str(path), self.owner))
+            except SchedulerError as exc:
+                print(f"[SCHED] skipped {path}: {exc}")
+        return jobs
+
+
+def load_inventory(path: str, *, dry_run: bool = False) -> List[Rig]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            data = yaml.safe_load(f) or {}
+    except (OSError, yaml.YAMLError) as exc:
+        raise SchedulerError(f"Cannot read inventory {path}: {exc}") from exc
+    rigs = [Rig(str(name), spec) for name, spec in (data.get("rigs") or {}).items()]
+    if dry_run:
+        for rig in rigs:  # mock devices can satisfy any requirement
+            rig.capabilities = {c: True for c in CAPABILITIES}
+    return rigs
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Run queued protocol YAMLs in parallel across rigs.")
+    p.add_argument("jobs", nargs="*", help="Protocol YAML files to queue (in submission order)")
+    p.add_argument("--rigs", required=True, help="Rig inventory YAML")
+    p.add_argument("--watch", metavar="DIR", help="Keep running and queue YAMLs that appear in DIR")
+    p.add_argument("--owner", default=None, help="Owner for fair ordering when the YAML has no 'owner:'")
+    p.add_argument("--max-skips", type=int, default=3,
+                   help="Times a job may be passed over before it reserves the capable rigs (default 3)")
+    p.add_argument("--lock-dir", default=os.path.join(tempfile.gettempdir(), "micropump-rigs"),
+                   help="Directory for per-rig lock files (share it between scheduler instances)")
+    p.add_argument("--log-dir", default=os.path.join(PROJECT_ROOT, "logs", "jobs"), help="Per-job output logs")
+    p.add_argument("--dry-run", action="store_true", help="Run jobs with cli.py --dry-run (mock devices)")
+    p.add_argument("cli_args", nargs=argparse.REMAINDER,
+                   help="Extra arguments for every cli.py run, after '--' (e.g. -- --store --profile)")
+    return p
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    cli_args = [a for a in args.cli_args if a != "--"]
+    if args.dry_run:
+        cli_args.insert(0, "--dry-run")
+    try:
+        scheduler = JobScheduler(load_inventory(args.rigs, dry_run=args.dry_run), lock_dir=args.lock_dir,
+                                 log_dir=args.log_dir, cli_args=cli_args, max_skips=args.max_skips)
+        for path in args.jobs:
+            scheduler.submit(Job(path, args.owner))
+    except SchedulerError as exc:
+        print(f"[SCHED] {exc}")
+        return 1
+    watcher = QueueWatcher(args.watch, args.owner) if args.watch else None
+    print(f"[SCHED] {scheduler.pending} jobs queued on {len(scheduler.rigs)} rigs: {', '.join(scheduler.rigs)}")
+    try:
+        scheduler.run(watcher)
+    except KeyboardInterrupt:
+        print("\n[SCHED] Interrupted; waiting for running jobs to stop...")
+    finally:
+        for thread in scheduler._threads:
+            thread.join()
+        scheduler.release_all()
+    print(scheduler.report())
+    return 0 if all(j.returncode == 0 for j in scheduler.finished) else 1
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
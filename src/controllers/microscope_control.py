@@ -1,16 +1,318 @@
 """
-MicroscopeControl (Placeholder)
---------------------------------
+MicroscopeControl
+-----------------
 
-This module will provide a class for controlling the microscope.
+Frame acquisition for the microscope camera.
 
+- FrameSource: pluggable camera interface; a source fills a caller-provided
+  array (``read_into``) instead of returning a new one.
+- SyntheticCamera: deterministic moving-gradient source paced to a frame
+  rate, for tests and dry runs.
+- OpenCVCamera: any camera OpenCV can open (optional ``opencv-python``).
+- FrameRing: preallocated NumPy ring buffer. Frames are written in place and
+  handed out as read-only views, so continuous capture allocates no pixel
+  memory after start-up and memory use is fixed at ``capacity`` frames.
+- MicroscopeControl: owns a source and a ring, and captures on a background
+  thread so the pump/valve timeline is never blocked by the camera.
+
+A view stays valid until the producer laps it (``capacity - 1`` frames
+later). Consumers that hold on to a frame check ``ring.is_valid(number)``
+after using it, or copy it if they need to keep it.
+
+Example:
+    scope = MicroscopeControl({"camera": "synthetic", "width": 640, "height": 480, "fps": 100})
+    scope.start_capture()
+    number, frame, t = scope.wait_frame()
+    scope.stop_capture()
+    print(scope.stats())
 """
 
-class MicroscopeControl:
-    """Placeholder class for microscope control."""
-    def __init__(self):
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+try:
+    import cv2
+except ImportError:  # pragma: no cover - optional dependency
+    cv2 = None
+
+logger = logging.getLogger(__name__)
+
+
+class CameraError(RuntimeError):
+    """Raised when the camera cannot be opened or stops delivering frames."""
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise CameraError("Microscope acquisition requires numpy (pip install numpy)")
+
+
+class FrameSource:
+    """Camera interface: fill `out` with the next frame and return its perf_counter timestamp."""
+
+    shape: Tuple[int, ...] = ()
+    dtype: str = "uint8"
+
+    def open(self) -> None:
         pass
 
-    def capture_image(self):
-        """Placeholder method for capturing an image."""
+    def read_into(self, out) -> float:
+        raise NotImplementedError
+
+    def close(self) -> None:
         pass
+
+
+class SyntheticCamera(FrameSource):
+    """Moving-gradient test pattern delivered at `fps` (0 = as fast as possible).
+
+    Pixel (0, 0) holds the frame counter so consumers can verify ordering.
+    """
+
+    def __init__(self, width: int = 640, height: int = 480, fps: float = 30.0, dtype: str = "uint16"):
+        _require_numpy()
+        self.shape = (int(height), int(width))
+        self.dtype = dtype
+        self.fps = float(fps)
+        self._ramp = (np.arange(width, dtype=dtype)[None, :] + np.arange(height, dtype=dtype)[:, None])
+        self._max = int(np.iinfo(dtype).max)
+        self._frame = 0
+        self._next_due: Optional[float] = None
+
+    def open(self) -> None:
+        self._next_due = time.perf_counter()
+
+    def read_into(self, out) -> float:
+        if self.fps > 0:
+            if self._next_due is None:
+                self._next_due = time.perf_counter()
+            delay = self._next_due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_due += 1.0 / self.fps
+        timestamp = time.perf_counter()
+        np.add(self._ramp, self._frame % (self._max + 1), out=out, casting="unsafe")
+        out[0, 0] = self._frame % (self._max + 1)
+        self._frame += 1
+        return timestamp
+
+
+class OpenCVCamera(FrameSource):
+    """Camera opened through ``cv2.VideoCapture`` (device index or URL)."""
+
+    def __init__(self, device: Any = 0, width: Optional[int] = None, height: Optional[int] = None,
+                 fps: Optional[float] = None):
+        _require_numpy()
+        if cv2 is None:
+            raise CameraError("OpenCV camera requires opencv-python (pip install opencv-python)")
+        self.device = device
+        self._requested = (width, height, fps)
+        self._cap = None
+        self.dtype = "uint8"
+        self.shape = ()
+
+    def open(self) -> None:
+        cap = cv2.VideoCapture(self.device)
+        if not cap.isOpened():
+            raise CameraError(f"Could not open camera {self.device!r}")
+        width, height, fps = self._requested
+        if width:
+            cap.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+        if height:
+            cap.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+        if fps:
+            cap.set(cv2.CAP_PROP_FPS, fps)
+        ok, frame = cap.read()
+        if not ok:
+            cap.release()
+            raise CameraError(f"Camera {self.device!r} returned no frame")
+        self.shape = frame.shape
+        self._cap = cap
+
+    def read_into(self, out) -> float:
+        timestamp = time.perf_counter()
+        ok, frame = self._cap.read(out)  # decodes into `out` when shape/dtype match
+        if not ok:
+            raise CameraError(f"Camera {self.device!r} stopped delivering frames")
+        if frame is not out:
+            np.copyto(out, frame)
+        return timestamp
+
+    def close(self) -> None:
+        if self._cap is not None:
+            self._cap.release()
+            self._cap = None
+
+
+def make_source(settings: Dict[str, Any]) -> FrameSource:
+    """Build a source from the ``microscope settings`` mapping (``camera: synthetic | opencv``)."""
+    kind = str(settings.get("camera", "synthetic")).lower()
+    if kind == "synthetic":
+        return SyntheticCamera(int(settings.get("width", 640)), int(settings.get("height", 480)),
+                               float(settings.get("fps", 30.0)), settings.get("dtype", "uint16"))
+    if kind == "opencv":
+        return OpenCVCamera(settings.get("device", 0), settings.get("width"), settings.get("height"),
+                            settings.get("fps"))
+    raise CameraError(f"Unknown camera type {kind!r}; use 'synthetic' or 'opencv'")
+
+
+class FrameRing:
+    """Single-producer ring of preallocated frames with view-based access.
+
+    Frame numbers count up from 0. The producer writes frame ``n`` into slot
+    ``n % capacity``, so frames ``count - capacity + 1 .. count - 1`` are
+    readable while frame ``count`` is being written.
+    """
+
+    def __init__(self, capacity: int, shape: Tuple[int, ...], dtype: str):
+        _require_numpy()
+        if capacity < 2:
+            raise ValueError("FrameRing needs at least 2 slots")
+        self.capacity = int(capacity)
+        # zeros() so every page is touched up front rather than on first capture
+        self.frames = np.zeros((self.capacity,) + tuple(shape), dtype=dtype)
+        self.timestamps = np.zeros(self.capacity, dtype=np.float64)
+        self.count = 0
+        self._cond = threading.Condition()
+
+    @property
+    def nbytes(self) -> int:
+        return self.frames.nbytes + self.timestamps.nbytes
+
+    # Producer -------------------------------------------------------------------
+    def next_slot(self):
+        """Writable view of the slot for the next frame."""
+        return self.frames[self.count % self.capacity]
+
+    def commit(self, timestamp: float) -> int:
+        """Publish the frame written into ``next_slot()``; returns its number."""
+        number = self.count
+        self.timestamps[number % self.capacity] = timestamp
+        with self._cond:
+            self.count = number + 1
+            self._cond.notify_all()
+        return number
+
+    # Consumers ------------------------------------------------------------------
+    def is_valid(self, number: int) -> bool:
+        """True while frame `number` has not been (or started to be) overwritten."""
+        return self.count - self.capacity < number < self.count
+
+    def get(self, number: int):
+        """``(frame_view, timestamp)`` for frame `number`, or None if not (or no longer) available."""
+        if not self.is_valid(number):
+            return None
+        view = self.frames[number % self.capacity]
+        view.flags.writeable = False
+        return view, float(self.timestamps[number % self.capacity])
+
+    def latest(self) -> Optional[Tuple[int, Any, float]]:
+        number = self.count - 1
+        item = self.get(number)
+        return None if item is None else (number, item[0], item[1])
+
+    def wait_frame(self, after: int = -1, timeout: Optional[float] = None) -> Optional[Tuple[int, Any, float]]:
+        """Block until a frame newer than `after` exists; return the newest ``(number, view, t)``."""
+        with self._cond:
+            if not self._cond.wait_for(lambda: self.count - 1 > after, timeout):
+                return None
+        return self.latest()
+
+
+class MicroscopeControl:
+    """Microscope camera with background capture into a FrameRing.
+
+    Settings (YAML ``microscope settings:``): ``camera`` (``synthetic`` or
+    ``opencv``), ``width``, ``height``, ``fps``, ``buffer_frames`` (ring
+    capacity, default 64) and ``device`` for OpenCV.
+    """
+
+    def __init__(self, settings: Optional[Dict[str, Any]] = None, *, source: Optional[FrameSource] = None):
+        _require_numpy()
+        self.settings = dict(settings or {})
+        self.source = source or make_source(self.settings)
+        self.source.open()
+        self.ring = FrameRing(int(self.settings.get("buffer_frames", 64)), self.source.shape, self.source.dtype)
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.error: Optional[BaseException] = None
+        self._capture_start: Optional[float] = None
+        self._capture_end: Optional[float] = None
+        self._first_frame = 0
+        self.max_read_s = 0.0
+        logger.info(f"Microscope ready: {self.source.shape} {self.source.dtype}, "
+                    f"ring {self.ring.capacity} frames ({self.ring.nbytes / 1e6:.1f} MB)")
+
+    @property
+    def capturing(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def _grab(self) -> int:
+        start = time.perf_counter()
+        timestamp = self.source.read_into(self.ring.next_slot())
+        self.max_read_s = max(self.max_read_s, time.perf_counter() - start)
+        return self.ring.commit(timestamp)
+
+    def _capture_loop(self) -> None:
+        try:
+            while not self._stop.is_set():
+                self._grab()
+        except BaseException as exc:
+            self.error = exc
+            logger.error(f"Capture stopped: {exc}")
+        finally:
+            self._capture_end = time.perf_counter()
+
+    def start_capture(self) -> None:
+        """Capture continuously on a background thread until ``stop_capture``."""
+        if self.capturing:
+            return
+        self._stop.clear()
+        self.error = None
+        self._first_frame = self.ring.count
+        self._capture_start = time.perf_counter()
+        self._capture_end = None
+        self._thread = threading.Thread(target=self._capture_loop, name="microscope-capture", daemon=True)
+        self._thread.start()
+
+    def stop_capture(self, timeout: float = 2.0) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def capture_image(self):
+        """Return a read-only view of the newest frame (grabbing one if not capturing)."""
+        if not self.capturing:
+            self._grab()
+        latest = self.ring.latest()
+        return None if latest is None else latest[1]
+
+    def wait_frame(self, after: int = -1, timeout: Optional[float] = 1.0):
+        """Newest ``(number, view, timestamp)`` once a frame newer than `after` arrives."""
+        return self.ring.wait_frame(after, timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        frames = self.ring.count - self._first_frame
+        end = self._capture_end or time.perf_counter()
+        elapsed = (end - self._capture_start) if self._capture_start is not None else 0.0
+        return {
+            "frames": frames,
+            "fps": frames / elapsed if elapsed > 0 else 0.0,
+            "max_read_ms": 1e3 * self.max_read_s,
+            "buffer_frames": self.ring.capacity,
+            "buffer_mb": self.ring.nbytes / 1e6,
+        }
+
+    def close(self) -> None:
+        self.stop_capture()
+        self.source.close()
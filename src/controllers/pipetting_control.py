@@ -1,15 +1,21 @@
 # Adjusted imports to reflect the new structure
 import yaml
 import logging
+import math
 import time
+from functools import partial
 from threading import Event
 
+from src.utils.well_pipeline import WellPipeline
+from src.utils.well_routing import move_time, optimize_route, plate_from_config, route_cost
+
 class Robot:
     def __init__(self, config_path):
         # Load configuration file
         self.stop = Event()
         self.config_path = config_path
         self.config = self.load_config()
+        self.layout = plate_from_config(self.config.get('plate', 96))
         self.start_stage()
         time.sleep(1)
         # Initialize internal state
@@ -17,7 +23,8 @@ class Robot:
         self.command = None
 
     def start_stage(self):
-        self.stage = Stage(self.config)
+        stage_cfg = self.config.get('stage') or {}
+        self.stage = SimulatedStage(self.config) if stage_cfg.get('simulated') else Stage(self.config)
 
     def close_stage(self):
         try:
@@ -51,8 +58,59 @@ class Robot:
         self.command = command
         logging.info(f'Set command to {command}')
 
+    def move_to_well(self, well):
+        self.stage.move_to(self.layout.position(well))
+        self.set_well(well)
+
+    def _travel_cost(self):
+        """Stage move time if the stage exposes its motion limits, else distance."""
+        speed = getattr(self.stage, 'speed', None)
+        accel = getattr(self.stage, 'acceleration', None)
+        if speed:
+            return partial(move_time, speed=speed, accel=accel or 0.0)
+        return None
+
+    def plan_route(self, wells, optimize=True):
+        """Order wells to minimise stage travel from the current position."""
+        wells = list(wells)
+        if not optimize:
+            return wells
+        start = getattr(self.stage, 'position', None)
+        cost = self._travel_cost() or math.dist
+        route = optimize_route(wells, self.layout, start=start, cost=cost)
+        before = route_cost([self.layout.position(w) for w in wells], cost, start)
+        after = route_cost([self.layout.position(w) for w in route], cost, start)
+        logging.info(f'Route for {len(route)} wells: travel {before:.2f} -> {after:.2f}')
+        return route
+
+    def visit_wells(self, wells, action=None, optimize=True):
+        """Move to each well in travel-optimised order, calling ``action(well)`` there."""
+        route = self.plan_route(wells, optimize=optimize)
+        for well in route:
+            if self.stop.is_set():
+                logging.info('Stop requested; aborting well visits.')
+                break
+            self.move_to_well(well)
+            if action is not None:
+                action(well)
+        return route
+
+    def process_wells(self, wells, pump=None, valve=None, dispense_s=0.5, post_wait_s=1.0,
+                      pipelined=True, optimize=True):
+        """Dispense into each well, moving to the next well during the post-dispense wait.
+
+        See ``src.utils.well_pipeline`` for the scheduling and interlock rules.
+        Returns the pipeline report (per-well timings and totals).
+        """
+        pipeline = WellPipeline(self, pump, valve, dispense_s=dispense_s, post_wait_s=post_wait_s,
+                                pipelined=pipelined)
+        report = pipeline.run(wells, optimize=optimize)
+        logging.info(WellPipeline.format_report(report))
+        return report
+
     def pause(self, sleep_time):
-        time.sleep(int(sleep_time))
+        # Interruptible: returns early when stop is set
+        self.stop.wait(float(sleep_time))
         logging.info('Paused for ' + str(sleep_time))
 
 # Placeholder for the Stage class
@@ -61,5 +119,38 @@ class Stage:
         self.config = config
         logging.info('Stage initialized.')
 
+    def move_to(self, position):
+        logging.info(f'Stage move to {position} (no hardware attached).')
+
     def close(self):
         logging.info('Stage connection closed.')
+
+
+class SimulatedStage(Stage):
+    """XY stage model with configurable speed and acceleration.
+
+    Config (under ``stage:``): ``simulated: true``, ``speed`` (mm/s),
+    ``acceleration`` (mm/s^2), ``home: [x, y]`` and ``realtime`` (sleep for
+    the modelled move time). Travel time, distance and move count are
+    accumulated so route savings can be measured.
+    """
+    def __init__(self, config):
+        super().__init__(config)
+        stage_cfg = config.get('stage') or {}
+        self.speed = float(stage_cfg.get('speed', 50.0))
+        self.acceleration = float(stage_cfg.get('acceleration', 500.0))
+        self.realtime = bool(stage_cfg.get('realtime', False))
+        self.position = tuple(stage_cfg.get('home', (0.0, 0.0)))
+        self.travel_time = 0.0
+        self.distance = 0.0
+        self.moves = 0
+
+    def move_to(self, position):
+        duration = move_time(self.position, position, self.speed, self.acceleration)
+        if self.realtime:
+            time.sleep(duration)
+        self.distance += ((position[0] - self.position[0]) ** 2 + (position[1] - self.position[1]) ** 2) ** 0.5
+        self.travel_time += duration
+        self.moves += 1
+        self.position = tuple(position)
+        return duration
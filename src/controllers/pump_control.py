@@ -1,18 +1,39 @@
-"""USB pump control using the usbx library."""
+"""USB pump control using the usbx library (through ``UsbBulkTransport``).
+
+If the USB link drops mid-run (FTDI reset, loose cable) the controller
+reconnects through ``connect()`` with bounded exponential backoff and
+re-applies the last acknowledged waveform, amplitude, frequency and run
+state before retrying the failed command. ``reconnect_timeout_s`` bounds
+the reconnect attempts; ``recoveries`` records how long each took. Only
+link failures (no device, broken pipe) trigger this; an ack timeout is
+reported as PumpCommunicationError.
+
+Command pacing (pause around each command, ack timeout) comes from the
+pump's calibrated profile when one is stored for its USB serial number
+(``calibrate.py``, ``src/utils/pacing.py``), else the conservative
+defaults.
+"""
 
 from __future__ import annotations
 
+import errno
 import time
 import warnings
 from pathlib import Path
-from typing import Optional
+from typing import Any, Callable, Dict, List, Optional, Union
 
-from usbx import Device, TransferDirection, TransferType, USBError, usb
+from src.utils.pacing import DEFAULT_PACING, PacingProfile, lookup, pump_device_id
+from src.utils.transport import TransportError, UsbBulkTransport
 
 DEFAULT_VID = 0x0403
 DEFAULT_PID = 0xB4C0
 ENV_PATH = Path(__file__).resolve().parents[1] / ".env"
-_CMD_DELAY_S = 0.12  # controller needs ~100 ms between commands
+_CMD_DELAY_S = DEFAULT_PACING["pump"].command_delay_s  # uncalibrated: controller needs ~100 ms between commands
+_RECONNECT_BACKOFF_S = (0.02, 0.2)  # first retry delay, maximum delay
+# Transport failures meaning the link is gone (unplugged, FTDI reset), as opposed to a slow or missing reply
+_LINK_ERRNOS = frozenset({errno.ENODEV, errno.ENXIO, errno.EPIPE, errno.ESHUTDOWN})
+# Fallback for USB errors without an errno (libusb LIBUSB_ERROR_NO_DEVICE text); whole phrases only
+_LINK_PHRASES = ("no such device", "broken pipe", "device has been disconnected")
 
 # Waveform commands documented for the Bartels mp-x controller
 _WAVEFORM_COMMANDS = {
@@ -32,6 +53,10 @@ class PumpCommunicationError(RuntimeError):
     """Raised when communicating with the pump fails."""
 
 
+class PumpLinkError(PumpCommunicationError):
+    """Raised when the USB link itself is down (as opposed to a rejected command)."""
+
+
 def _load_device_ids() -> tuple[int, int]:
     """Return VID/PID from the project .env file or defaults."""
     vid = DEFAULT_VID
@@ -54,38 +79,37 @@ def _load_device_ids() -> tuple[int, int]:
     return vid, pid
 
 
-def _select_interface(device: Device) -> int:
-    """Pick the first interface exposing a bulk/interrupt OUT endpoint."""
-    for intf in device.configuration.interfaces:
-        alt = intf.current_alternate
-        for endpoint in alt.endpoints:
-            if endpoint.transfer_type in (TransferType.BULK, TransferType.INTERRUPT) and \
-                    endpoint.direction == TransferDirection.OUT:
-                return intf.number
-    raise PumpCommunicationError("Pump has no bulk/interrupt OUT endpoint")
-
-
-def _find_endpoint(device: Device, interface_number: int, direction: TransferDirection) -> Optional[int]:
-    interface = device.get_interface(interface_number)
-    if interface is None:
-        return None
-    for endpoint in interface.current_alternate.endpoints:
-        if endpoint.direction == direction and endpoint.transfer_type in (TransferType.BULK, TransferType.INTERRUPT):
-            return endpoint.number
-    return None
-
-
 def _format_value(value: int, *, name: str, minimum: int, maximum: int) -> str:
     if not minimum <= value <= maximum:
         raise PumpCommunicationError(f"{name} must be between {minimum} and {maximum} (got {value})")
     return f"{value:03d}"
 
 
+def _link_failure(exc: BaseException, transport) -> bool:
+    """Whether a TransportError means the USB link is down.
+
+    Exception types and errno anywhere in the cause chain decide first; only
+    if none says so are the messages checked for a known link-loss phrase.
+    """
+    if not transport.is_open:
+        return True
+    chain: List[BaseException] = []
+    cause: Optional[BaseException] = exc
+    while cause is not None and cause not in chain:
+        chain.append(cause)
+        cause = cause.__cause__
+    if any(isinstance(c, ConnectionError) or getattr(c, "errno", None) in _LINK_ERRNOS for c in chain):
+        return True
+    return any(phrase in str(c).lower() for c in chain for phrase in _LINK_PHRASES)
+
+
 class UsbPumpController:
     """High-level controller for the Bartels USB micropump."""
 
     def __init__(self, port: Optional[str] = None, *, vid: Optional[int] = None,
-                 pid: Optional[int] = None, auto_connect: bool = True):
+                 pid: Optional[int] = None, serial: Optional[str] = None, auto_connect: bool = True,
+                 auto_reconnect: bool = True,
+                 reconnect_timeout_s: float = 0.4, pacing: Union[bool, PacingProfile] = True):
         if port is not None:
             warnings.warn(
                 "Serial port argument is ignored; the pump now uses direct USB access.",
@@ -97,11 +121,22 @@ class UsbPumpController:
             self.vid = vid
         if pid is not None:
             self.pid = pid
-        self._device: Optional[Device] = None
-        self._interface_number: Optional[int] = None
-        self._out_endpoint: Optional[int] = None
-        self._in_endpoint: Optional[int] = None
-        self._claimed: bool = False
+        self.serial = serial  # USB serial number; selects one of several identical pumps
+        self.transport: Optional[UsbBulkTransport] = None
+        # True: use the stored profile once the device (and its serial number) is known
+        self._use_stored_pacing = pacing is True
+        self.pacing: Optional[PacingProfile] = pacing if isinstance(pacing, PacingProfile) else None
+        self.command_delay_s = _CMD_DELAY_S
+        self.ack_timeout_s = DEFAULT_PACING["pump"].ack_timeout_s
+        if self.pacing is not None:
+            self._apply_pacing(self.pacing)
+        self.auto_reconnect = auto_reconnect
+        self.reconnect_timeout_s = reconnect_timeout_s
+        # Last acknowledged settings, re-applied after a reconnect
+        self.state: Dict[str, Any] = {"waveform": None, "amplitude": None, "frequency": None, "running": False}
+        self.recoveries: List[float] = []
+        self.link_lost = False
+        self._recovering = False
         if auto_connect:
             self.connect()
 
@@ -117,57 +152,64 @@ class UsbPumpController:
     # Connection management ---------------------------------------------------
     @property
     def connected(self) -> bool:
-        return self._device is not None and self._claimed
+        return self.transport is not None and self.transport.is_open
 
     def connect(self) -> None:
         if self.connected:
             return
-        device = usb.find_device(vid=self.vid, pid=self.pid)
-        if device is None:
-            raise PumpCommunicationError(
-                f"Pump with VID=0x{self.vid:04x} PID=0x{self.pid:04x} not found"
-            )
-        interface_number = _select_interface(device)
-        out_endpoint = _find_endpoint(device, interface_number, TransferDirection.OUT)
-        if out_endpoint is None:
-            raise PumpCommunicationError("Unable to determine OUT endpoint for pump")
-        in_endpoint = _find_endpoint(device, interface_number, TransferDirection.IN)
-
         try:
-            device.open()
-            device.claim_interface(interface_number)
-        except USBError as exc:
-            try:
-                device.close()
-            except USBError:
-                pass
-            raise PumpCommunicationError("Failed to open/claim the pump interface") from exc
+            transport = UsbBulkTransport.open(self.vid, self.pid, self.serial)
+        except TransportError as exc:
+            raise PumpCommunicationError(f"Pump: {exc}") from exc
+        self._attach(transport)
+
+    def _attach(self, transport) -> None:
+        """Adopt an open transport (also used by trace replay)."""
+        self.transport = transport
+        if self._use_stored_pacing and self.pacing is None:
+            profile = lookup(self.device_id)
+            if profile is not None:
+                self._apply_pacing(profile)
 
-        self._device = device
-        self._interface_number = interface_number
-        self._out_endpoint = out_endpoint
-        self._in_endpoint = in_endpoint
-        self._claimed = True
+    @property
+    def device_id(self) -> str:
+        """Pacing-profile key: USB serial number if known, else VID/PID."""
+        serial = self.serial or getattr(self.transport, "serial_number", None)
+        return pump_device_id(serial, self.vid, self.pid)
+
+    def _apply_pacing(self, profile: PacingProfile) -> None:
+        self.pacing = profile
+        self.command_delay_s = profile.command_delay_s
+        self.ack_timeout_s = profile.ack_timeout_s
+
+    def pacing_probe(self, delay_s: float, timeout_s: float) -> Optional[float]:
+        """One ``boff`` with the given pacing; ack latency or None (for ``pacing.calibrate``).
+
+        Stops the pump: calibrate with the pump idle. Any non-error reply
+        counts, and the FTDI bridge sends modem-status bytes on every read, so
+        this measures the link latency only; it cannot show that the pump
+        accepted the command.
+        """
+        self._ensure_ready()
+        transport = self.transport
+        try:
+            transport.write(transport.encode("boff", b"\r"))
+            time.sleep(delay_s)
+            start = time.perf_counter()
+            response = bytes(transport.read_chunk(timeout_s))
+            latency = time.perf_counter() - start
+        except TransportError:
+            return None
+        time.sleep(delay_s)
+        if not response.strip() or response.strip().upper().startswith(b"ERR"):
+            return None
+        return latency
 
     def disconnect(self) -> None:
-        if self._device is None:
+        if self.transport is None:
             return
-        try:
-            if self._claimed and self._interface_number is not None:
-                self._device.release_interface(self._interface_number)
-        except USBError:
-            pass
-        finally:
-            self._claimed = False
-        try:
-            self._device.close()
-        except USBError:
-            pass
-        finally:
-            self._device = None
-            self._interface_number = None
-            self._out_endpoint = None
-            self._in_endpoint = None
+        transport, self.transport = self.transport, None
+        transport.close()
 
     def close(self) -> None:
         """Compatibility wrapper for legacy code."""
@@ -175,30 +217,103 @@ class UsbPumpController:
 
     # Command helpers ---------------------------------------------------------
     def _ensure_ready(self) -> None:
-        if not self.connected or self._device is None or self._out_endpoint is None:
-            raise PumpCommunicationError("Pump is not connected")
+        if not self.connected:
+            raise PumpLinkError("Pump is not connected")
+
+    def send_command(self, command: str | bytes, *, expect_response: bool = True,
+                     timeout: Optional[float] = None, settle: bool = True) -> bytes:
+        """Send a raw command to the pump and return the response bytes.
 
-    def send_command(self, command: str | bytes, *, expect_response: bool = True, timeout: float = 1.0) -> bytes:
-        """Send a raw command to the pump and return the response bytes."""
+        ``timeout`` defaults to the pacing ack timeout. ``settle=False`` skips
+        the pause after the response; the pause after the write already
+        spaces consecutive commands by ``command_delay_s``.
+        """
         self._ensure_ready()
-        payload = command.encode("ascii") if isinstance(command, str) else command
-        if not payload.endswith(b"\r"):
-            payload += b"\r"
+        transport = self.transport
+        if isinstance(command, str):
+            payload = transport.encode(command, b"\r")
+        else:
+            payload = command if command.endswith(b"\r") else command + b"\r"
         try:
-            self._device.transfer_out(self._out_endpoint, payload)
-        except USBError as exc:
-            raise PumpCommunicationError(f"Failed to send command {command!r}") from exc
-        time.sleep(_CMD_DELAY_S)
+            transport.write(payload)
+        except TransportError as exc:
+            error = PumpLinkError if _link_failure(exc, transport) else PumpCommunicationError
+            raise error(f"Failed to send command {command!r}") from exc
+        time.sleep(self.command_delay_s)
 
-        if not expect_response or self._in_endpoint is None:
+        if not expect_response or not transport.readable:
             return b""
         try:
-            response = self._device.transfer_in(self._in_endpoint, timeout=timeout)
-        except USBError as exc:
-            raise PumpCommunicationError(f"No response for command {command!r}") from exc
-        time.sleep(_CMD_DELAY_S)
+            response = bytes(transport.read_chunk(self.ack_timeout_s if timeout is None else timeout))
+        except TransportError as exc:
+            # A timed-out ack is a command failure; only a dead link is worth a reconnect
+            error = PumpLinkError if _link_failure(exc, transport) else PumpCommunicationError
+            raise error(f"No response for command {command!r}") from exc
+        if settle:
+            time.sleep(self.command_delay_s)
         return response
 
+    # Link recovery -----------------------------------------------------------
+    def reconnect(self) -> float:
+        """Re-open the link and restore the cached state; returns the recovery time.
+
+        Connection attempts back off from 20 ms up to 200 ms and stop after
+        ``reconnect_timeout_s``, raising PumpLinkError.
+        """
+        start = time.perf_counter()
+        deadline = start + self.reconnect_timeout_s
+        delay = _RECONNECT_BACKOFF_S[0]
+        self.disconnect()
+        while True:
+            try:
+                self.connect()
+                break
+            except PumpCommunicationError as exc:
+                if time.perf_counter() + delay > deadline:
+                    self.link_lost = True
+                    raise PumpLinkError(
+                        f"Pump did not reconnect within {self.reconnect_timeout_s:.2f}s"
+                    ) from exc
+                time.sleep(delay)
+                delay = min(delay * 2, _RECONNECT_BACKOFF_S[1])
+        self._restore_state()
+        elapsed = time.perf_counter() - start
+        self.recoveries.append(elapsed)
+        self.link_lost = False
+        warnings.warn(f"Pump link recovered in {1e3 * elapsed:.0f} ms; settings re-applied", RuntimeWarning,
+                      stacklevel=2)
+        return elapsed
+
+    def _restore_state(self) -> None:
+        """Re-send the cached settings (safety order: waveform, amplitude, frequency, start)."""
+        state = self.state
+        commands = []
+        if state["waveform"] is not None:
+            commands.append((state["waveform"], "restore waveform"))
+        if state["amplitude"] is not None:
+            commands.append((f"A{state['amplitude']:03d}", "restore amplitude"))
+        if state["frequency"] is not None:
+            commands.append((f"F{state['frequency']:03d}", "restore frequency"))
+        commands.append(("bon" if state["running"] else "boff", "restore run state"))
+        for command, action in commands:
+            self._check_ack(self.send_command(command, settle=False), action)
+
+    def _call(self, command: str, action: str, **update: Any) -> None:
+        """Send `command`, recovering the link once on PumpLinkError; cache `update` on success."""
+        try:
+            self._check_ack(self.send_command(command), action)
+        except PumpLinkError:
+            if not self.auto_reconnect or self._recovering:
+                self.link_lost = True
+                raise
+            self._recovering = True
+            try:
+                self.reconnect()
+            finally:
+                self._recovering = False
+            self._check_ack(self.send_command(command), action)
+        self.state.update(update)
+
     @staticmethod
     def _check_ack(response: bytes, action: str) -> None:
         stripped = response.strip()
@@ -208,13 +323,11 @@ class UsbPumpController:
     # High-level operations ---------------------------------------------------
     def set_frequency(self, frequency_hz: int) -> None:
         value = _format_value(int(frequency_hz), name="Frequency", minimum=1, maximum=300)
-        response = self.send_command(f"F{value}")
-        self._check_ack(response, "set frequency")
+        self._call(f"F{value}", "set frequency", frequency=int(frequency_hz))
 
     def set_amplitude(self, amplitude: int) -> None:
         value = _format_value(int(amplitude), name="Amplitude", minimum=1, maximum=250)
-        response = self.send_command(f"A{value}")
-        self._check_ack(response, "set amplitude")
+        self._call(f"A{value}", "set amplitude", amplitude=int(amplitude))
 
     def set_waveform(self, waveform: str) -> None:
         key = waveform.strip().upper()
@@ -223,19 +336,18 @@ class UsbPumpController:
             raise PumpCommunicationError(
                 f"Unknown waveform '{waveform}'. Expected one of {sorted(set(_WAVEFORM_COMMANDS) - {'MR','MS','MC'})}"
             )
-        response = self.send_command(command)
-        self._check_ack(response, "set waveform")
+        self._call(command, "set waveform", waveform=command)
 
     def start(self) -> None:
-        response = self.send_command("bon")
-        self._check_ack(response, "start the pump")
+        self._call("bon", "start the pump", running=True)
 
     def stop(self) -> None:
-        response = self.send_command("boff")
-        self._check_ack(response, "stop the pump")
+        self._call("boff", "stop the pump", running=False)
 
     def pulse(self, duration_s: float, *, frequency_hz: Optional[int] = None,
-              amplitude: Optional[int] = None, waveform: Optional[str] = None) -> None:
+              amplitude: Optional[int] = None, waveform: Optional[str] = None,
+              sleep: Callable[[float], None] = time.sleep) -> None:
+        """Run the pump for `duration_s`; pass a precision ``sleep`` (e.g. TimingEngine.sleep) for tighter timing."""
         if frequency_hz is not None:
             self.set_frequency(frequency_hz)
         if amplitude is not None:
@@ -244,11 +356,28 @@ class UsbPumpController:
             self.set_waveform(waveform)
         self.start()
         try:
-            time.sleep(duration_s)
+            sleep(duration_s)
         finally:
             self.stop()
 
+    # Legacy aliases used by the YAML runner (cli.run_sequence) ---------------
+    def bartels_set_waveform(self, waveform: str) -> None:
+        self.set_waveform(waveform)
+
+    def bartels_set_voltage(self, voltage: int) -> None:
+        """Set the drive voltage in Vpp (the controller's amplitude command)."""
+        self.set_amplitude(voltage)
+
+    def bartels_set_freq(self, frequency_hz: int) -> None:
+        self.set_frequency(frequency_hz)
+
+    def bartels_start(self) -> None:
+        self.start()
+
+    def bartels_stop(self) -> None:
+        self.stop()
+
 
 BartelsPump = UsbPumpController
 
-__all__ = ["UsbPumpController", "PumpCommunicationError", "BartelsPump"]
+__all__ = ["UsbPumpController", "PumpCommunicationError", "PumpLinkError", "BartelsPump"]
@@ -0,0 +1,389 @@
+"""
+SensorStream
+------------
+
+Flow/pressure samples streamed by ``valve_serial.ino`` (``STREAM <hz>``).
+
+The firmware sends fixed-size 57-byte packets with 8 timestamped samples
+each (layout in the sketch header and ``PACKET_DTYPE``), interleaved with
+ordinary text replies. Decoding is done in bulk on whatever bytes are
+available:
+
+- PacketParser: finds sync words with NumPy, checks all candidate packets'
+  checksums at once, views the good ones through a structured dtype and
+  returns sample times and raw ADC values as arrays. Bytes outside packets
+  are returned as text lines (command replies). No Python object is
+  created per sample.
+- SampleRing: preallocated ring of device timestamps (µs, unwrapped past
+  the 32-bit ``micros()`` rollover) and raw ADC values.
+- SensorStream: reader thread that owns the transport's input while the
+  firmware is streaming; ``ValveController`` routes its command replies
+  through it. Reads are zero-copy views of the transport's buffer.
+- SimulatedSensorTransport: transport that produces the same packets (sine
+  flow, ramp pressure) for dry runs and benchmarks.
+
+Example:
+    valve.start_stream(1000, channels={"flow": {"scale": 0.05, "unit": "uL/min"}})
+    ...
+    t_us, flow = valve.stream.latest(2000, channel="flow")
+    valve.stop_stream()
+"""
+
+from __future__ import annotations
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from src.utils.transport import Transport
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+logger = logging.getLogger(__name__)
+
+SYNC = b"\xa5\x5a"
+SAMPLES_PER_PACKET = 8
+CHANNELS = 2
+DEFAULT_CHANNELS = ("flow", "pressure")
+_READ_TIMEOUT_S = 0.05
+
+if np is not None:
+    PACKET_DTYPE = np.dtype([
+        ("sync", "<u2"),
+        ("seq", "u1"),
+        ("channels", "u1"),
+        ("t0_us", "<u4"),
+        ("samples", [("dt_us", "<u2"), ("adc", "<u2", (CHANNELS,))], (SAMPLES_PER_PACKET,)),
+        ("check", "u1"),
+    ])
+    PACKET_SIZE = PACKET_DTYPE.itemsize  # 57
+else:  # pragma: no cover
+    PACKET_DTYPE = None
+    PACKET_SIZE = 57
+
+
+class SensorStreamError(RuntimeError):
+    """Raised when streaming cannot be started or the stream reader fails."""
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise SensorStreamError("Sensor streaming requires numpy (pip install numpy)")
+
+
+def encode_packets(t_us, adc, seq0: int = 0) -> bytes:
+    """Firmware packet encoding (for simulation and tests); len(t_us) must be a multiple of 8."""
+    _require_numpy()
+    t_us = np.asarray(t_us, dtype=np.int64).reshape(-1, SAMPLES_PER_PACKET)
+    adc = np.asarray(adc, dtype=np.uint16).reshape(len(t_us), SAMPLES_PER_PACKET, CHANNELS)
+    packets = np.zeros(len(t_us), dtype=PACKET_DTYPE)
+    packets["sync"] = 0x5AA5
+    packets["seq"] = (seq0 + np.arange(len(t_us))) & 0xFF
+    packets["channels"] = CHANNELS
+    packets["t0_us"] = t_us[:, 0] & 0xFFFFFFFF
+    packets["samples"]["dt_us"] = t_us - t_us[:, :1]
+    packets["samples"]["adc"] = adc
+    raw = packets.view(np.uint8).reshape(len(t_us), PACKET_SIZE)
+    raw[:, -1] = np.bitwise_xor.reduce(raw[:, 2:-1], axis=1)
+    return raw.tobytes()
+
+
+class PacketParser:
+    """Incremental decoder for the firmware's mixed binary/text output."""
+
+    def __init__(self):
+        _require_numpy()
+        self._pending = b""
+        self._text = bytearray()
+        self._offsets = np.arange(PACKET_SIZE)
+        self._last_seq: Optional[int] = None
+        self._last_t0: Optional[int] = None
+        self._wrap = 0  # accumulated 2**32 µs rollovers
+        self.packets = 0
+        self.lost_packets = 0   # seq gaps: dropped by the firmware or lost on the link
+        self.bad_packets = 0    # sync found but checksum wrong
+
+    def feed(self, data) -> Tuple[Any, Any, List[str]]:
+        """Decode `data`; returns ``(t_us int64[n], adc uint16[n, channels], text_lines)``.
+
+        `data` may be a memoryview of a reused buffer: it is not referenced after the call.
+        """
+        buf = self._pending + data if self._pending else data
+        arr = np.frombuffer(buf, dtype=np.uint8)
+        n = len(arr)
+        cand = np.flatnonzero((arr[:-1] == 0xA5) & (arr[1:] == 0x5A)) if n > 1 else np.empty(0, np.intp)
+        complete = cand[cand + PACKET_SIZE <= n]
+        rows = arr[complete[:, None] + self._offsets]
+        good = np.bitwise_xor.reduce(rows[:, 2:-1], axis=1) == rows[:, -1]
+        starts, rows = complete[good], rows[good]
+        if len(starts) > 1 and (np.diff(starts) < PACKET_SIZE).any():
+            # A sync pattern inside a packet that happened to pass the checksum: keep the first
+            keep, end = [], -1
+            for i, s in enumerate(starts.tolist()):
+                if s >= end:
+                    keep.append(i)
+                    end = s + PACKET_SIZE
+            starts, rows = starts[keep], rows[keep]
+        covered = self._cover(starts, n)
+        # Text never contains 0xA5, so a sync outside a good packet starts a corrupt one:
+        # drop its bytes rather than passing them on as text
+        bad = complete[~good & ~covered[complete]]
+        self.bad_packets += len(bad)
+        if len(bad):
+            covered |= self._cover(bad, n)
+
+        # Keep an unfinished packet (or a lone first sync byte) for the next call
+        incomplete = cand[(cand + PACKET_SIZE > n) & ~covered[cand]] if len(cand) else cand
+        tail = int(incomplete[0]) if len(incomplete) else n
+        if tail == n and n and arr[-1] == 0xA5:
+            tail = n - 1
+        self._pending = bytes(buf[tail:])
+
+        lines: List[str] = []
+        text = arr[:tail][~covered[:tail]]
+        if len(text):
+            self._text += text.tobytes()
+            *complete_lines, rest = self._text.split(b"\n")
+            lines = [ln.decode("ascii").strip() for ln in complete_lines if ln.strip()]
+            self._text = bytearray(rest[-256:])
+
+        if not len(rows):
+            return np.empty(0, np.int64), np.empty((0, CHANNELS), np.uint16), lines
+        packets = np.ascontiguousarray(rows).view(PACKET_DTYPE)[:, 0]
+        seq = packets["seq"].astype(np.int64)
+        t0 = packets["t0_us"].astype(np.int64)
+        prev_seq = seq[0] - 1 if self._last_seq is None else self._last_seq
+        prev_t0 = t0[0] if self._last_t0 is None else self._last_t0
+        self.lost_packets += int(((np.diff(seq, prepend=prev_seq) - 1) & 0xFF).sum())
+        # micros() wraps every ~71.6 min: count backward steps between consecutive packets
+        wraps = self._wrap + np.cumsum(np.diff(t0, prepend=prev_t0) < 0)
+        self._last_seq, self._last_t0, self._wrap = int(seq[-1]), int(t0[-1]), int(wraps[-1])
+        self.packets += len(packets)
+        base = t0 + (wraps << 32)
+        t_us = (base[:, None] + packets["samples"]["dt_us"]).reshape(-1)
+        adc = packets["samples"]["adc"].reshape(-1, CHANNELS)
+        return t_us, adc, lines
+
+
+    @staticmethod
+    def _cover(starts, n: int):
+        """Boolean mask of the bytes inside packets starting at `starts`."""
+        edges = np.zeros(n + PACKET_SIZE + 1, dtype=np.int32)
+        np.add.at(edges, starts, 1)
+        np.add.at(edges, starts + PACKET_SIZE, -1)
+        return np.cumsum(edges[:n]) > 0
+
+
+class SampleRing:
+    """Preallocated ring of ``(t_us, adc[channels])`` samples; writes are bulk copies."""
+
+    def __init__(self, capacity: int, channels: int = CHANNELS):
+        _require_numpy()
+        self.capacity = int(capacity)
+        self.t_us = np.zeros(self.capacity, dtype=np.int64)
+        self.adc = np.zeros((self.capacity, channels), dtype=np.uint16)
+        self.count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def nbytes(self) -> int:
+        return self.t_us.nbytes + self.adc.nbytes
+
+    def extend(self, t_us, adc) -> None:
+        k = len(t_us)
+        if not k:
+            return
+        if k > self.capacity:
+            t_us, adc = t_us[-self.capacity:], adc[-self.capacity:]
+            skipped, k = k - self.capacity, self.capacity
+        else:
+            skipped = 0
+        with self._lock:
+            start = (self.count + skipped) % self.capacity
+            first = min(k, self.capacity - start)
+            self.t_us[start:start + first] = t_us[:first]
+            self.adc[start:start + first] = adc[:first]
+            if first < k:
+                self.t_us[:k - first] = t_us[first:]
+                self.adc[:k - first] = adc[first:]
+            self.count += skipped + k
+
+    def latest(self, n: Optional[int] = None) -> Tuple[Any, Any]:
+        """Copies of the newest `n` samples (all retained samples by default), oldest first."""
+        with self._lock:
+            available = min(self.count, self.capacity)
+            n = available if n is None else min(int(n), available)
+            idx = (np.arange(self.count - n, self.count) % self.capacity)
+            return self.t_us[idx], self.adc[idx]
+
+
+def simulated_packets(first: int, last: int, rate_hz: float) -> bytes:
+    """Packets for samples ``first..last`` of a simulated sensor (sine flow, sawtooth pressure)."""
+    i = np.arange(first, last)
+    t_us = (i * 1e6 / rate_hz).astype(np.int64)
+    flow = 512 + 300 * np.sin(2 * np.pi * t_us / 1e6)
+    pressure = (i * 7) % 1024
+    return encode_packets(t_us, np.stack([flow, pressure], axis=1), seq0=first // SAMPLES_PER_PACKET)
+
+
+class SimulatedSensorTransport(Transport):
+    """Transport emitting firmware packets in real time; commands written to it are ignored."""
+
+    kind = "simulated"
+
+    def __init__(self, rate_hz: float = 1000.0):
+        _require_numpy()
+        super().__init__()
+        self.rate_hz = float(rate_hz)
+        self._start = time.perf_counter()
+        self._sent = 0  # samples emitted so far
+        self._closed = False
+
+    def _write(self, data) -> None:
+        pass
+
+    def _read_into(self, view: memoryview, timeout: Optional[float]) -> int:
+        time.sleep(min(timeout or _READ_TIMEOUT_S, _READ_TIMEOUT_S))
+        due = int((time.perf_counter() - self._start) * self.rate_hz)
+        due = min(due, self._sent + len(view) // PACKET_SIZE * SAMPLES_PER_PACKET)
+        due -= due % SAMPLES_PER_PACKET
+        if due <= self._sent or self._closed:
+            return 0
+        data = simulated_packets(self._sent, due, self.rate_hz)
+        self._sent = due
+        view[:len(data)] = data
+        return len(data)
+
+    @property
+    def is_open(self) -> bool:
+        return not self._closed
+
+    def close(self) -> None:
+        self._closed = True
+
+
+class SensorStream:
+    """Decodes streamed samples from `transport` on a background thread into a SampleRing.
+
+    `channels` maps channel names (in firmware order) to optional
+    ``scale``/``offset``/``unit`` used by ``latest(..., physical=True)``.
+    """
+
+    def __init__(self, transport: Transport, *, rate_hz: float, capacity: int = 65536,
+                 channels: Optional[Dict[str, Dict[str, Any]]] = None):
+        _require_numpy()
+        self.transport = transport
+        self.rate_hz = float(rate_hz)
+        if channels is None:
+            channels = {name: {} for name in DEFAULT_CHANNELS}
+        if len(channels) > CHANNELS:
+            raise SensorStreamError(f"Firmware streams {CHANNELS} channels, got {len(channels)}")
+        self.channels = {name: dict(spec or {}) for name, spec in channels.items()}
+        self.ring = SampleRing(capacity)
+        self.parser = PacketParser()
+        self.replies: "queue.Queue[str]" = queue.Queue()
+        self.error: Optional[BaseException] = None
+        # Device µs -> perf_counter: smallest (arrival - sample time) seen, i.e. least-delayed chunk
+        self._offset_s: Optional[float] = None
+        self._started = time.perf_counter()
+        self._stopped: Optional[float] = None
+        self._stop = threading.Event()
+        # Reads are short so stop() is prompt; command replies still get the transport's timeout
+        self.reply_timeout = transport.timeout or 2.0
+        self._thread = threading.Thread(target=self._reader, name="sensor-stream", daemon=True)
+        self._thread.start()
+
+    def _reader(self) -> None:
+        try:
+            while not self._stop.is_set():
+                data = self.transport.read_chunk(_READ_TIMEOUT_S)
+                if not data:
+                    continue
+                arrived = time.perf_counter()
+                t_us, adc, lines = self.parser.feed(data)
+                if len(t_us):
+                    self.ring.extend(t_us, adc)
+                    offset = arrived - t_us[-1] / 1e6
+                    if self._offset_s is None or offset < self._offset_s:
+                        self._offset_s = offset
+                for line in lines:
+                    self.replies.put(line)
+        except Exception as exc:  # reported via stats()/error; the run continues without samples
+            self.error = exc
+            logger.warning(f"Sensor stream reader stopped: {exc}")
+
+    def clear_replies(self) -> None:
+        """Discard unsolicited lines so the next reply() answers the next command."""
+        while True:
+            try:
+                self.replies.get_nowait()
+            except queue.Empty:
+                return
+
+    def reply(self, timeout: Optional[float]) -> str:
+        """Next text line from the firmware ('' on timeout)."""
+        try:
+            return self.replies.get(timeout=timeout)
+        except queue.Empty:
+            return ""
+
+    def stop(self, timeout: float = 1.0) -> None:
+        self._stop.set()
+        self._thread.join(timeout)
+        self._stopped = time.perf_counter()
+
+    # Consumers ------------------------------------------------------------------
+    def to_host_time(self, t_us):
+        """Device timestamps (µs) on the ``time.perf_counter`` timeline (None before any sample)."""
+        return None if self._offset_s is None else np.asarray(t_us) / 1e6 + self._offset_s
+
+    def latest(self, n: Optional[int] = None, *, channel: Optional[str] = None, physical: bool = True):
+        """``(t_us, values)`` for the newest `n` samples; one channel or all (``values[:, i]``)."""
+        t_us, adc = self.ring.latest(n)
+        names = list(self.channels)
+        if channel is not None:
+            index = names.index(channel)
+            adc, names = adc[:, index], [channel]
+        if not physical:
+            return t_us, adc
+        scale = np.array([self.channels[c].get("scale", 1.0) for c in names], dtype=np.float64)
+        offset = np.array([self.channels[c].get("offset", 0.0) for c in names], dtype=np.float64)
+        if channel is not None:
+            scale, offset = scale[0], offset[0]
+        return t_us, adc * scale + offset
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = (self._stopped or time.perf_counter()) - self._started
+        samples = self.ring.count
+        return {
+            "samples": samples,
+            "rate_hz": self.rate_hz,
+            "achieved_hz": samples / elapsed if elapsed > 0 else 0.0,
+            "packets": self.parser.packets,
+            "lost_packets": self.parser.lost_packets,
+            "bad_packets": self.parser.bad_packets,
+            "buffer_samples": self.ring.capacity,
+            "buffer_kb": self.ring.nbytes / 1024,
+            "error": None if self.error is None else str(self.error),
+        }
+
+    def format_stats(self) -> str:
+        st = self.stats()
+        line = (f"[SENSORS] {st['samples']} samples ({st['achieved_hz']:.0f} Hz of {st['rate_hz']:.0f}), "
+                f"{st['lost_packets']} packets lost, {st['bad_packets']} corrupt, "
+                f"ring {st['buffer_samples']} samples / {st['buffer_kb']:.0f} KB")
+        if st["error"]:
+            line += f", reader error: {st['error']}"
+        lines = [line]
+        if st["samples"]:
+            _, values = self.latest()
+            for i, (name, spec) in enumerate(self.channels.items()):
+                col = values[:, i]
+                unit = f" {spec['unit']}" if spec.get("unit") else ""
+                lines.append(f"  {name}: mean {col.mean():.3g}{unit}, min {col.min():.3g}, max {col.max():.3g}")
+        return "\n".join(lines)
@@ -0,0 +1,474 @@
+"""Simulated pump and valve for benchmarks and offline runs.
+
+Unlike the ``--dry-run`` mocks in ``cli.py`` these are silent, model a
+per-command latency, and record every state change on the
+``time.perf_counter`` timeline so achieved timing can be compared with the
+intended schedule.
+
+``ValveFirmwareSimulator`` works one level lower: it speaks the
+``valve_serial.ino`` byte protocol on a file descriptor, so a real
+``ValveController`` can run against it (``sim://valve`` port, see
+``src/utils/transport.py``). ``SerialBridgeSimulator`` serves it over TCP
+like a serial-to-Ethernet bridge, with configurable network delay.
+``SimulatedPumpLink`` is a transport behaving like the pump's USB link
+(commands sent too quickly are lost), for pacing calibration without
+hardware.
+"""
+
+from __future__ import annotations
+
+import math
+import os
+import queue
+import random
+import select
+import socket
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, List, NamedTuple, Optional, Tuple
+
+from src.utils.transport import Transport, TransportError
+
+
+class SimEvent(NamedTuple):
+    t: float          # perf_counter() when the command completed
+    device: str
+    action: str
+    value: object = None
+
+
+class _SimDevice:
+    def __init__(self, name: str, latency_s: float, events: Optional[List[SimEvent]]):
+        self.name = name
+        self.latency_s = latency_s
+        self.events: List[SimEvent] = events if events is not None else []
+        self.commands = 0
+
+    def _command(self, action: str, value: object = None) -> None:
+        if self.latency_s > 0:
+            time.sleep(self.latency_s)
+        self.commands += 1
+        self.events.append(SimEvent(time.perf_counter(), self.name, action, value))
+
+    def close(self) -> None:
+        pass
+
+
+class SimulatedPump(_SimDevice):
+    """Pump exposing the runner's ``bartels_*`` API.
+
+    The default latency matches ``UsbPumpController.send_command`` (two
+    ``_CMD_DELAY_S`` waits per acknowledged command).
+    """
+
+    def __init__(self, name: str = "pump", *, latency_s: float = 0.24,
+                 events: Optional[List[SimEvent]] = None):
+        super().__init__(name, latency_s, events)
+        self.running = False
+        self.waveform: Optional[str] = None
+        self.voltage: Optional[int] = None
+        self.freq: Optional[int] = None
+
+    def bartels_set_waveform(self, wf):
+        self.waveform = wf
+        self._command("waveform", wf)
+
+    def bartels_set_voltage(self, v):
+        self.voltage = int(v)
+        self._command("voltage", self.voltage)
+
+    def bartels_set_freq(self, f):
+        self.freq = int(f)
+        self._command("freq", self.freq)
+
+    def bartels_start(self):
+        self.running = True
+        self._command("start")
+
+    def bartels_stop(self):
+        self.running = False
+        self._command("stop")
+
+
+class SimulatedValve(_SimDevice):
+    """Valve with the ``ValveController`` API; default latency ~ one serial round trip."""
+
+    def __init__(self, name: str = "valve", *, latency_s: float = 0.002,
+                 events: Optional[List[SimEvent]] = None):
+        super().__init__(name, latency_s, events)
+        self.state_val = False
+
+    def on(self):
+        self.state_val = True
+        self._command("on")
+
+    def off(self):
+        self.state_val = False
+        self._command("off")
+
+    def toggle(self):
+        self.state_val = not self.state_val
+        self._command("on" if self.state_val else "off")
+        return "OK ON" if self.state_val else "OK OFF"
+
+    def state(self):
+        self._command("state")
+        return "STATE ON" if self.state_val else "STATE OFF"
+
+    def set_mask(self, mask: int):
+        """Valve-bank style update; any open valve counts as ``on``."""
+        self.state_val = bool(mask)
+        self._command("on" if self.state_val else "off", int(mask))
+        return int(mask)
+
+    def pulse(self, ms: int):
+        self._command("pulse", int(ms))
+        return f"OK PULSE {int(ms)}"
+
+    def pwm(self, period_ms: int, duty: int):
+        """Firmware duty cycle: one command, after which the relay cycles without host I/O."""
+        self.state_val = int(duty) > 0
+        self._command("pwm", (int(period_ms), int(duty)))
+        return f"OK PWM {int(period_ms)} {int(duty)}"
+
+    def pwm_off(self):
+        self.state_val = False
+        self._command("off")
+        return "OK PWM OFF"
+
+
+class SimulatedFluidPump(SimulatedPump):
+    """SimulatedPump driving a first-order fluid model; also a flow source (``read()``).
+
+    Steady-state flow is ``gain * voltage/250 * freq / (1 + freq/rolloff_hz)``
+    divided by the fluid's relative viscosity, which drifts by
+    ``viscosity_drift`` per second (tubing wear, temperature). The flow
+    follows that target with time constant `tau_s`; `noise` is the standard
+    deviation of the measurement noise. Flow units are µL/min.
+    """
+
+    def __init__(self, name: str = "pump", *, latency_s: float = 0.24, gain: float = 0.5,
+                 rolloff_hz: float = 150.0, tau_s: float = 0.4, viscosity_drift: float = 0.01,
+                 noise: float = 0.05, voltage: int = 100, freq: int = 50, seed: Optional[int] = 0,
+                 events: Optional[List[SimEvent]] = None):
+        super().__init__(name, latency_s=latency_s, events=events)
+        self.voltage = voltage
+        self.freq = freq
+        self.gain = gain
+        self.rolloff_hz = rolloff_hz
+        self.tau_s = tau_s
+        self.viscosity_drift = viscosity_drift
+        self.noise = noise
+        self._random = random.Random(seed)
+        self._start = time.perf_counter()
+        self._t = self._start
+        self.flow = 0.0
+
+    def viscosity(self, t: float) -> float:
+        return 1.0 + self.viscosity_drift * (t - self._start)
+
+    def steady_flow(self, t: Optional[float] = None) -> float:
+        if not self.running or not self.freq or not self.voltage:
+            return 0.0
+        t = time.perf_counter() if t is None else t
+        drive = self.gain * self.voltage / 250.0 * self.freq / (1.0 + self.freq / self.rolloff_hz)
+        return drive / self.viscosity(t)
+
+    def _advance(self) -> None:
+        now = time.perf_counter()
+        dt = now - self._t
+        if dt > 0:
+            target = self.steady_flow(now)
+            self.flow = target + (self.flow - target) * math.exp(-dt / self.tau_s)
+            self._t = now
+
+    # Integrate the model up to each change before applying it
+    def bartels_set_voltage(self, v):
+        self._advance()
+        super().bartels_set_voltage(v)
+
+    def bartels_set_freq(self, f):
+        self._advance()
+        super().bartels_set_freq(f)
+
+    def bartels_start(self):
+        self._advance()
+        super().bartels_start()
+
+    def bartels_stop(self):
+        self._advance()
+        super().bartels_stop()
+
+    def read(self) -> float:
+        self._advance()
+        return self.flow + self._random.gauss(0.0, self.noise)
+
+
+class ValveFirmwareSimulator:
+    """Byte-level stand-in for ``valve_serial.ino`` served on a file descriptor.
+
+    Prints the ready banner, answers ON/OFF/TOGGLE/STATE?, runs the relay
+    duty cycle after ``PWM <period_ms> <duty>`` (``relay_now()`` gives its
+    phase) and streams sensor packets after ``STREAM <hz>`` (needs numpy).
+    `latency_s` delays every reply, modelling the firmware and link round
+    trip.
+    """
+
+    def __init__(self, *, latency_s: float = 0.0, banner: bool = True):
+        self.latency_s = latency_s
+        self.banner = banner
+        self.relay = False
+        self.pwm: Optional[Tuple[int, int]] = None  # (period_ms, duty %) while cycling
+        self._pwm_start = 0.0
+        self.commands = 0
+        self.stream_hz: Optional[int] = None
+        self._stream_start = 0.0
+        self._stream_sent = 0
+
+    def handle(self, command: str) -> str:
+        """Reply line for one command (as the firmware would print it)."""
+        self.commands += 1
+        cmd = command.strip().upper()
+        if cmd in ("ON", "OFF", "TOGGLE", "PWM OFF"):
+            relay = self.relay_now()
+            self.pwm = None
+            self.relay = cmd == "ON" or (cmd == "TOGGLE" and not relay)
+            return "OK PWM OFF" if cmd == "PWM OFF" else ("OK ON" if self.relay else "OK OFF")
+        if cmd in ("STATE?", "STATE"):
+            if self.pwm is not None:
+                return f"STATE PWM {self.pwm[0]} {self.pwm[1]}"
+            return "STATE ON" if self.relay else "STATE OFF"
+        if cmd.startswith("PWM "):
+            from src.controllers.valve_control import parse_valve_pwm
+
+            try:
+                period, duty = parse_valve_pwm(cmd[4:]) or (0, 0)
+            except ValueError as exc:
+                return f"ERR {exc}"
+            # 0 % and 100 % hold the relay; anything else cycles, starting with the ON phase
+            self.pwm = (period, duty) if 0 < duty < 100 else None
+            self.relay = duty > 0
+            self._pwm_start = time.perf_counter()
+            return f"OK PWM {period} {duty}"
+        if cmd == "STREAM OFF":
+            self.stream_hz = None
+            return "OK STREAM OFF"
+        if cmd.startswith("STREAM "):
+            try:
+                hz = int(cmd[7:])
+            except ValueError:
+                hz = 0
+            if not 200 <= hz <= 4000:
+                return "ERR STREAM rate must be 200-4000 Hz"
+            try:
+                import numpy  # noqa: F401
+            except ImportError:
+                return "ERR STREAM needs numpy in the simulator"
+            self.stream_hz = hz
+            self._stream_start = time.perf_counter()
+            self._stream_sent = 0
+            return f"OK STREAM {hz}"
+        return "ERR Unknown command"
+
+    def relay_now(self, t: Optional[float] = None) -> bool:
+        """Relay state at perf_counter time `t` (now by default), following the PWM cycle."""
+        if self.pwm is None:
+            return self.relay
+        period, duty = self.pwm
+        phase_ms = (((time.perf_counter() if t is None else t) - self._pwm_start) * 1e3) % period
+        return phase_ms < period * duty // 100
+
+    def _packets_due(self) -> bytes:
+        from src.controllers.sensor_stream import SAMPLES_PER_PACKET, simulated_packets
+
+        due = int((time.perf_counter() - self._stream_start) * self.stream_hz)
+        due -= due % SAMPLES_PER_PACKET
+        if due <= self._stream_sent:
+            return b""
+        data = simulated_packets(self._stream_sent, due, self.stream_hz)
+        self._stream_sent = due
+        return data
+
+    def serve(self, fd: int, stop: threading.Event) -> None:
+        """Serve the protocol on `fd` until `stop` is set or the other end closes."""
+
+        def send(data: bytes) -> None:
+            view = memoryview(data)
+            while view:
+                view = view[os.write(fd, view):]
+
+        try:
+            if self.banner:
+                send(b"Valve controller ready. Send ON / OFF / TOGGLE / STATE? / PWM\r\n")
+            pending = b""
+            while not stop.is_set():
+                ready, _, _ = select.select([fd], [], [], 0.005 if self.stream_hz else 0.05)
+                if ready:
+                    data = os.read(fd, 4096)
+                    if not data:
+                        return
+                    *lines, pending = (pending + data).split(b"\n")
+                    for line in lines:
+                        reply = self.handle(line.decode("ascii", "ignore"))
+                        if self.latency_s > 0:
+                            time.sleep(self.latency_s)
+                        send(reply.encode("ascii") + b"\r\n")
+                if self.stream_hz:
+                    send(self._packets_due())
+        except OSError:
+            return  # other end closed
+
+
+def _delayed_copy(src: socket.socket, dst: socket.socket, delay_s: float) -> None:
+    """Copy `src` to `dst`, delivering each chunk `delay_s` after it was received; half-closes `dst` at EOF."""
+    chunks: "queue.Queue[Tuple[float, bytes]]" = queue.Queue()
+
+    def deliver() -> None:
+        while True:
+            due, data = chunks.get()
+            if not data:
+                break
+            wait = due - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                dst.sendall(data)
+            except OSError:
+                break
+        try:
+            dst.shutdown(socket.SHUT_WR)
+        except OSError:
+            pass
+
+    writer = threading.Thread(target=deliver, daemon=True)
+    writer.start()
+    try:
+        while True:
+            data = src.recv(4096)
+            chunks.put((time.perf_counter() + delay_s, data))
+            if not data:
+                break
+    except OSError:
+        chunks.put((0.0, b""))
+    writer.join()
+
+
+class SerialBridgeSimulator:
+    """Loopback stand-in for a raw-TCP serial-to-Ethernet bridge with a device behind it.
+
+    Listens on `host`:`port` (port 0 picks a free one; see ``url``) and relays
+    each connection to `device` (a ValveFirmwareSimulator by default, shared
+    by all connections like the one Arduino behind a real bridge). Every chunk
+    is delayed by `one_way_delay_s` in each direction on its own timeline,
+    so pipelined commands overlap the way they do on a real network.
+
+    Example::
+
+        with SerialBridgeSimulator(one_way_delay_s=0.0025) as bridge:
+            valve = ValveController(bridge.url)
+    """
+
+    def __init__(self, device: Any = None, *, host: str = "127.0.0.1", port: int = 0,
+                 one_way_delay_s: float = 0.0):
+        self.device = device if device is not None else ValveFirmwareSimulator(banner=False)
+        self.one_way_delay_s = one_way_delay_s
+        self.connections = 0
+        self._server = socket.create_server((host, port))
+        self._server.settimeout(0.1)
+        self.host, self.port = self._server.getsockname()[:2]
+        self._stop = threading.Event()
+        self._sockets: List[socket.socket] = []
+        self._thread = threading.Thread(target=self._accept, name="bridge-sim", daemon=True)
+        self._thread.start()
+
+    @property
+    def url(self) -> str:
+        return f"tcp://{self.host}:{self.port}"
+
+    def _accept(self) -> None:
+        while not self._stop.is_set():
+            try:
+                conn, _ = self._server.accept()
+            except socket.timeout:
+                continue
+            except OSError:
+                return
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.connections += 1
+            threading.Thread(target=self._relay, args=(conn,), daemon=True).start()
+
+    def _relay(self, conn: socket.socket) -> None:
+        device_end, bridge_end = socket.socketpair()
+        self._sockets += [conn, device_end, bridge_end]
+        stop = threading.Event()
+        serve = threading.Thread(target=self.device.serve, args=(device_end.fileno(), stop), daemon=True)
+        serve.start()
+        down = threading.Thread(target=_delayed_copy, args=(bridge_end, conn, self.one_way_delay_s), daemon=True)
+        down.start()
+        _delayed_copy(conn, bridge_end, self.one_way_delay_s)  # returns when the client disconnects
+        serve.join(1.0)  # the device sees EOF
+        stop.set()
+        device_end.close()
+        down.join(1.0)
+        for sock in (conn, bridge_end):
+            sock.close()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._server.close()
+        for sock in self._sockets:
+            try:
+                sock.close()
+            except OSError:
+                pass
+        self._thread.join(1.0)
+
+    def __enter__(self) -> "SerialBridgeSimulator":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+
+class SimulatedPumpLink(Transport):
+    """Bartels USB link stand-in: acks after `ack_latency_s`; a command written
+    less than `min_gap_s` after the previous accepted one is lost (no ack, the
+    read times out like a USB transfer)."""
+
+    kind = "usb"
+
+    def __init__(self, *, min_gap_s: float = 0.04, ack_latency_s: float = 0.006, serial: str = "SIM-PUMP"):
+        super().__init__(timeout=1.0, buffer_size=512)
+        self.min_gap_s = min_gap_s
+        self.ack_latency_s = ack_latency_s
+        self.serial_number = serial
+        self.dropped = 0
+        self._replies: Deque[Tuple[float, bytes]] = deque()
+        self._busy_until = 0.0
+
+    def _write(self, data) -> None:
+        now = time.perf_counter()
+        if now < self._busy_until:
+            self.dropped += 1
+            return
+        self._busy_until = now + self.min_gap_s
+        self._replies.append((now + self.ack_latency_s, b"\x01\x60OK\r"))
+
+    def _read_into(self, view: memoryview, timeout: Optional[float]) -> int:
+        timeout = self.timeout if timeout is None else timeout
+        wait = self._replies[0][0] - time.perf_counter() if self._replies else None
+        if wait is None or wait > timeout:
+            time.sleep(timeout)
+            raise TransportError("USB read timed out")
+        if wait > 0:
+            time.sleep(wait)
+        _, data = self._replies.popleft()
+        view[:len(data)] = data
+        return len(data)
+
+    def _discard_input(self) -> None:
+        self._replies.clear()
+
+    def describe(self):
+        return {"transport": self.kind, "serial": self.serial_number, "simulated": True}
@@ -0,0 +1,142 @@
+"""
+ValveBank: manifold of up to 16 valves on one Arduino
+(``hardware/valve_bank_serial/valve_bank_serial.ino``).
+
+The whole manifold is described by a bitmask (bit i = valve i open) and set
+with a single ``MASK <hex>`` command, which the firmware applies to all
+relay outputs at once. Switching any combination of valves therefore costs
+one serial round trip instead of one per valve.
+"""
+
+from __future__ import annotations
+
+from typing import Iterable, Mapping, Optional, Union
+
+from src.controllers.valve_control import ValveController
+
+MAX_VALVES = 16
+
+MaskLike = Union[int, str, Iterable[int]]
+
+
+class ValveBankError(RuntimeError):
+    """Raised when the valve bank rejects a command or replies unexpectedly."""
+
+
+def parse_valve_mask(value: MaskLike) -> int:
+    """Convert a YAML-style mask to an int.
+
+    Accepts an int (``5``), a string in any Python integer literal form
+    (``"0x0F"``, ``"0b0101"``, ``"12"``) or a list of open valve indices
+    (``[0, 2]``).
+    """
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid valve mask: {value!r}")
+    if isinstance(value, int):
+        mask = value
+    elif isinstance(value, str):
+        try:
+            mask = int(value.strip(), 0)
+        except ValueError as exc:
+            raise ValueError(f"Invalid valve mask: {value!r}") from exc
+    else:
+        mask = 0
+        for index in value:
+            if not 0 <= int(index) < MAX_VALVES:
+                raise ValueError(f"Valve index out of range: {index}")
+            mask |= 1 << int(index)
+    if not 0 <= mask < (1 << MAX_VALVES):
+        raise ValueError(f"Valve mask out of range: {value!r}")
+    return mask
+
+
+class ValveBank(ValveController):
+    """Controller for a multi-valve manifold driven by one Arduino.
+
+    ``on()``/``off()`` open/close every valve. The last mask acknowledged by
+    the firmware is cached in ``mask`` so partial updates (``open_valves``,
+    ``close_valves``, ``set_valves``) still go out as one command.
+    """
+
+    def __init__(self, port: str, baudrate: int = 115200, *, reset_on_open: bool = True,
+                 ready_timeout: Optional[float] = None, transport=None, pipeline_depth: Optional[int] = None,
+                 pacing=True):
+        self.mask: Optional[int] = None
+        self._count: Optional[int] = None
+        super().__init__(port, baudrate, reset_on_open=reset_on_open, ready_timeout=ready_timeout,
+                         transport=transport, pipeline_depth=pipeline_depth, pacing=pacing)
+
+    @classmethod
+    def from_transport(cls, transport, port: str = "", baudrate: int = 115200, *,
+                       pipeline_depth: int = 1) -> "ValveBank":
+        self = super().from_transport(transport, port, baudrate, pipeline_depth=pipeline_depth)
+        self.mask = None
+        self._count = None
+        return self
+
+    # Protocol helpers -----------------------------------------------------------
+    def _mask_command(self, command: str) -> int:
+        """Send a state-changing command and return the mask the firmware applied."""
+        resp = self._send(command)
+        if not resp.startswith("OK MASK "):
+            raise ValveBankError(f"Valve bank rejected {command!r}: {resp!r}")
+        self.mask = int(resp[8:], 16)
+        return self.mask
+
+    @property
+    def count(self) -> int:
+        """Number of valves on the manifold (queried once)."""
+        if self._count is None:
+            resp = self._send("COUNT?")
+            if not resp.startswith("COUNT "):
+                raise ValveBankError(f"Unexpected reply to COUNT?: {resp!r}")
+            self._count = int(resp[6:])
+        return self._count
+
+    # Bank operations ----------------------------------------------------------
+    def set_mask(self, mask: MaskLike) -> int:
+        """Set every valve in one command; returns the applied mask."""
+        return self._mask_command(f"MASK {parse_valve_mask(mask):04X}")
+
+    def get_mask(self) -> int:
+        resp = self._send("MASK?")
+        if not resp.startswith("MASK "):
+            raise ValveBankError(f"Unexpected reply to MASK?: {resp!r}")
+        self.mask = int(resp[5:], 16)
+        return self.mask
+
+    def _current_mask(self) -> int:
+        return self.mask if self.mask is not None else self.get_mask()
+
+    def set_valves(self, states: Mapping[int, bool]) -> int:
+        """Apply ``{index: open}`` on top of the current mask in one command."""
+        mask = self._current_mask()
+        for index, is_open in states.items():
+            bit = parse_valve_mask([index])
+            mask = (mask | bit) if is_open else (mask & ~bit)
+        return self.set_mask(mask)
+
+    def open_valves(self, *indices: int) -> int:
+        return self.set_mask(self._current_mask() | parse_valve_mask(indices))
+
+    def close_valves(self, *indices: int) -> int:
+        return self.set_mask(self._current_mask() & ~parse_valve_mask(indices))
+
+    def set_valve(self, index: int, is_open: bool) -> int:
+        """Switch one valve (firmware-side merge, safe even if the cached mask is stale)."""
+        parse_valve_mask([index])
+        return self._mask_command(f"SET {int(index)} {'ON' if is_open else 'OFF'}")
+
+    def is_open(self, index: int) -> bool:
+        return bool(self._current_mask() & (1 << int(index)))
+
+    # DeviceController interface -------------------------------------------------
+    def on(self):
+        self._mask_command("ON")
+
+    def off(self):
+        self._mask_command("OFF")
+
+    def toggle(self):
+        self._mask_command("TOGGLE")
+        return f"OK MASK {self.mask:04X}"
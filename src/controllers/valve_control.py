@@ -1,42 +1,279 @@
-import serial
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Sequence, Tuple, Union
+
+from src.controllers.sensor_stream import SensorStream, SensorStreamError
 from src.utils.base import DeviceController
+from src.utils.pacing import DEFAULT_PACING, PacingProfile, lookup, valve_device_id
+from src.utils.serial_manager import READY_BANNER
+from src.utils.transport import SerialTransport, Transport, TransportError, open_transport
+
+_BANNER = READY_BANNER.encode("ascii")
+_NETWORK_PIPELINE_DEPTH = 4  # default for tcp:// valves
+
+# Firmware PWM limits (valve_serial.ino): period, and shortest ON/OFF phase the relay follows
+PWM_PERIOD_MS = (20, 60000)
+PWM_MIN_PHASE_MS = 10
+
+
+def parse_valve_pwm(value: Any) -> Optional[Tuple[int, int]]:
+    """Convert a YAML ``valve_pwm`` value to ``(period_ms, duty_percent)``, or None for off.
+
+    Accepts ``{period_ms: 1000, duty: 25}``, ``[1000, 25]``, ``"1000 25"`` and
+    ``off``/``false`` (stop cycling).
+    """
+    if value is None or value is False or (isinstance(value, str) and value.strip().lower() in ("off", "")):
+        return None
+    try:
+        if isinstance(value, dict):
+            period, duty = value["period_ms"], value["duty"]
+        elif isinstance(value, str):
+            period, duty = value.split()
+        else:
+            period, duty = value
+        period, duty = int(period), int(round(float(duty)))
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Invalid valve PWM {value!r}; use {{period_ms: N, duty: 0-100}}") from None
+    if not PWM_PERIOD_MS[0] <= period <= PWM_PERIOD_MS[1] or not 0 <= duty <= 100:
+        raise ValueError(f"Valve PWM period must be {PWM_PERIOD_MS[0]}-{PWM_PERIOD_MS[1]} ms "
+                         f"and duty 0-100 %, got {value!r}")
+    on_ms = period * duty // 100
+    if 0 < duty < 100 and min(on_ms, period - on_ms) < PWM_MIN_PHASE_MS:
+        raise ValueError(f"Valve PWM ON and OFF phases must be >= {PWM_MIN_PHASE_MS} ms, got {value!r}")
+    return period, duty
+
 
 class ValveController(DeviceController):
-    """Controller for a solenoid valve via Arduino + relay."""
+    """Controller for a solenoid valve via Arduino + relay.
+
+    By default opening the port resets the Arduino; the constructor then waits
+    for the firmware ready banner (up to ``ready_timeout`` seconds) so no
+    command is lost while the board boots. With ``reset_on_open=False`` the
+    reset is suppressed and readiness is confirmed with a ``STATE?`` probe.
+
+    `port` is anything ``open_transport`` accepts: a serial port name,
+    ``tcp://host:port`` or ``sim://valve``; or pass an open `transport`.
+
+    With ``pipeline_depth`` > 1 (the default over TCP) ``on``/``off`` are
+    pipelined: the command is written and the call returns without waiting
+    for the reply, so a timed run does not pay the network round trip per
+    switch. Up to ``pipeline_depth`` replies may be outstanding; they are
+    checked as they arrive (failures go to ``pipeline_errors`` and the log),
+    and any command that needs its reply waits for them first. Replies lost
+    to a reconnect or a timeout fail their commands instead of being matched
+    to later ones.
+
+    Pacing (ack timeout, minimum gap between commands, boot time after a
+    reset) comes from the valve's calibrated profile when one is stored
+    (``calibrate.py``); an explicit `ready_timeout` still wins.
 
-    def __init__(self, port: str, baudrate: int = 115200):
+    ``pwm`` hands a relay duty cycle to the firmware (``PWM <period_ms>
+    <duty>``), replacing host-timed on/off toggling.
+
+    ``start_stream`` switches the firmware to sensor streaming; while it runs
+    a SensorStream reader owns the port's input and commands keep working
+    (their replies are picked out of the stream).
+    """
+
+    def __init__(self, port: str, baudrate: int = 115200, *, reset_on_open: bool = True,
+                 ready_timeout: Optional[float] = None, transport: Optional[Transport] = None,
+                 pipeline_depth: Optional[int] = None, pacing: Union[bool, PacingProfile] = True):
         super().__init__(port, baudrate)
+        self.ready = False
+        self.stream = None
+        self._init_pipeline(1 if pipeline_depth is None else pipeline_depth)
+        if pacing is True:
+            pacing = lookup(valve_device_id(port)) or False
+        self._init_pacing(pacing or None)
+        if ready_timeout is None:
+            ready_timeout = self.pacing_profile.ready_timeout_s or DEFAULT_PACING["valve"].ready_timeout_s
+        if transport is None:
+            try:
+                transport = open_transport(self.port, self.baudrate, reset=reset_on_open,
+                                           timeout=self.pacing_profile.ack_timeout_s)
+            except TransportError as exc:
+                logging.warning(f"Valve on {self.port} not available: {exc}")
+                return
+        self.transport = transport
+        if pipeline_depth is None and transport.kind == "tcp":
+            self.pipeline_depth = _NETWORK_PIPELINE_DEPTH
+        if transport.resets_on_open:
+            self.ready = transport.wait_for_line(_BANNER, ready_timeout)
+        else:
+            self.ready = self._probe_ready(ready_timeout)
+        if not self.ready:
+            logging.warning(f"Valve on {self.port} did not report ready within {ready_timeout}s")
+
+    @classmethod
+    def from_transport(cls, transport: Transport, port: str = "", baudrate: int = 115200, *,
+                       pipeline_depth: int = 1) -> "ValveController":
+        """Wrap an open transport (e.g. a trace replay) without a readiness handshake."""
+        self = cls.__new__(cls)
+        DeviceController.__init__(self, port, baudrate)
+        self.transport = transport
+        self.ready = True
+        self.stream = None
+        self._init_pipeline(pipeline_depth)
+        self._init_pacing(None)
+        return self
+
+    def _init_pacing(self, profile: Optional[PacingProfile]) -> None:
+        self.pacing = profile  # calibrated profile in use, if any
+        self.pacing_profile = profile or DEFAULT_PACING["valve"]
+        self.command_delay_s = self.pacing_profile.command_delay_s
+        self._next_command_at = 0.0
+
+    def _pace(self) -> None:
+        """Keep the calibrated minimum gap between commands."""
+        if self.command_delay_s > 0:
+            wait = self._next_command_at - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            self._next_command_at = time.perf_counter() + self.command_delay_s
+
+    def pacing_probe(self, delay_s: float, timeout_s: float) -> Optional[float]:
+        """One ``STATE?`` after `delay_s`; reply latency or None (for ``pacing.calibrate``)."""
+        time.sleep(delay_s)
         try:
-            self.ser = serial.Serial(port=self.port, baudrate=self.baudrate, timeout=2)
-        except serial.SerialException:
-            self.ser = None
+            self.flush()
+            self.transport.reset_input()
+            start = time.perf_counter()
+            resp = str(self.transport.exchange("STATE?", timeout=timeout_s), "ascii", "ignore").strip()
+        except TransportError:
+            return None
+        latency = time.perf_counter() - start
+        return latency if resp.startswith("STATE") else None
+
+    def _init_pipeline(self, depth: int) -> None:
+        self.pipeline_depth = max(1, int(depth))
+        self._in_flight: Deque[str] = deque()
+        self.pipeline_errors: List[Tuple[str, str]] = []
+        self._reconnects = getattr(self.transport, "reconnects", 0)
+
+    @classmethod
+    def from_serial(cls, ser, port: str = "", baudrate: int = 115200) -> "ValveController":
+        """Wrap an already-open pyserial-like object without opening a port."""
+        return cls.from_transport(SerialTransport(port, baudrate, ser=ser), port, baudrate)
+
+    def _probe_ready(self, timeout: float) -> bool:
+        """Confirm a non-reset board answers; fall back to the banner if it rebooted anyway."""
+        resp = self._send("STATE?")
+        if resp.startswith("STATE"):
+            return True
+        if resp.startswith(READY_BANNER):
+            return True
+        return self.transport.wait_for_line(_BANNER, timeout)
 
     def close(self):
-        if self.ser is not None:
+        if self.stream is not None:
             try:
-                self.ser.close()
+                self.stop_stream()
             except Exception:
                 pass
+        if self.transport is not None:
+            try:
+                self.flush()
+            except Exception:
+                pass
+            self.transport.close()
+
+    # Pipelining -----------------------------------------------------------------
+    def _check_reply(self, command: str, resp: str) -> None:
+        if not resp.startswith("OK"):
+            self.pipeline_errors.append((command, resp))
+            logging.warning(f"Valve on {self.port}: pipelined {command!r} got {resp!r}")
+
+    def _fail_in_flight(self, reason: str) -> None:
+        for command in self._in_flight:
+            self._check_reply(command, reason)
+        self._in_flight.clear()
+
+    def _check_link(self) -> None:
+        """Fail in-flight commands whose replies went down with a dropped connection."""
+        reconnects = getattr(self.transport, "reconnects", 0)
+        if reconnects != self._reconnects:
+            self._reconnects = reconnects
+            self._fail_in_flight("Reply lost: connection re-established")
+
+    def _collect(self, block: bool, keep: int = 0) -> None:
+        """Match arrived replies to in-flight commands; with `block`, wait until at most `keep` are left."""
+        self._check_link()
+        while len(self._in_flight) > keep:
+            if block:
+                line = self.transport.read_line()
+                if not line:
+                    # Timed out: a late reply would be matched to the wrong command, so drop them all
+                    self._fail_in_flight("No reply (timeout)")
+                    self.transport.reset_input()
+                    return
+            else:
+                line = self.transport.poll_line()
+                if line is None:
+                    return
+            self._check_reply(self._in_flight.popleft(), str(line, "ascii", "ignore").strip())
+
+    def flush(self) -> None:
+        """Wait for the replies of all pipelined commands."""
+        if self._in_flight and self.transport is not None:
+            self._collect(block=True)
+
+    def _post(self, command: str) -> None:
+        """Send a command whose reply only needs checking, pipelined when enabled."""
+        if self.pipeline_depth <= 1 or self.stream is not None or self.transport is None:
+            self._send(command)
+            return
+        try:
+            self._collect(block=False)
+            self._collect(block=True, keep=self.pipeline_depth - 1)
+        except TransportError as e:
+            # The link dropped with replies outstanding; they are lost, but the write below may reconnect
+            self._fail_in_flight(f"Serial error: {e}")
+        try:
+            self._pace()
+            self.transport.send_line(command)
+            self._check_link()  # the write may have reconnected: earlier replies are gone
+            self._in_flight.append(command)
+        except TransportError as e:
+            self._fail_in_flight(f"Serial error: {e}")
+            self.pipeline_errors.append((command, f"Serial error: {e}"))
+            logging.warning(f"Valve on {self.port}: {command!r} failed: {e}")
+
+    def send_many(self, commands: Sequence[str]) -> List[str]:
+        """Send several commands in one write and return their replies (one round trip)."""
+        if self.transport is None:
+            return ["Serial not initialized"] * len(commands)
+        if self.stream is not None or self.command_delay_s > 0:
+            return [self._send(command) for command in commands]
+        try:
+            self.flush()
+            self.transport.reset_input()
+            self._pace()
+            return [str(line, "ascii", "ignore").strip() for line in self.transport.exchange_many(commands)]
+        except Exception as e:
+            return [f"Serial error: {e}"] * len(commands)
 
     def _send(self, command: str) -> str:
-        if self.ser is None:
+        if self.transport is None:
             return "Serial not initialized"
         try:
-            self.ser.reset_input_buffer()
-            self.ser.reset_output_buffer()
-            line = (command.strip() + "\n").encode("ascii", errors="ignore")
-            self.ser.write(line)
-            self.ser.flush()
-            resp = self.ser.readline().decode("ascii", errors="ignore").strip()
-            return resp
+            self.flush()
+            self._pace()
+            if self.stream is not None:
+                # The input carries sensor packets: the stream reader hands us the reply line
+                self.stream.clear_replies()
+                self.transport.send_line(command)
+                return self.stream.reply(self.stream.reply_timeout)
+            self.transport.reset_input()
+            return str(self.transport.exchange(command), "ascii", "ignore").strip()
         except Exception as e:
             return f"Serial error: {e}"
 
     def on(self):
-        self._send("ON")
+        self._post("ON")
 
     def off(self):
-        self._send("OFF")
+        self._post("OFF")
 
     def toggle(self):
         return self._send("TOGGLE")
@@ -46,3 +283,48 @@ class ValveController(DeviceController):
 
     def pulse(self, ms: int):
         return self._send(f"PULSE {ms}")
+
+    def pwm(self, period_ms: int, duty: int):
+        """Cycle the relay on the Arduino: ON for `duty` % of every `period_ms`.
+
+        The firmware times the edges itself, so the cycle costs no host I/O
+        and keeps MCU timing; ``on``/``off``/``toggle`` or ``pwm_off`` end it.
+        """
+        period_ms, duty = parse_valve_pwm((period_ms, duty))
+        return self._send(f"PWM {period_ms} {duty}")
+
+    def pwm_off(self):
+        return self._send("PWM OFF")
+
+    # Sensor streaming -----------------------------------------------------------
+    def start_stream(self, rate_hz: int = 1000, *, capacity: int = 65536,
+                     channels: Optional[Dict[str, Dict[str, Any]]] = None):
+        """Start firmware sensor streaming (``STREAM <hz>``) into a SensorStream ring."""
+        if self.stream is not None:
+            raise SensorStreamError("Sensor stream already running")
+        if self.transport is None:
+            raise SensorStreamError("Serial not initialized")
+        self.flush()
+        self.transport.reset_input()
+        # Reader first, so the reply and the first packets go through the same parser
+        self.stream = SensorStream(self.transport, rate_hz=rate_hz, capacity=capacity, channels=channels)
+        resp = self._send(f"STREAM {int(rate_hz)}")
+        if not resp.startswith("OK STREAM"):
+            self.stream.stop()
+            self.stream = None
+            raise SensorStreamError(f"Valve firmware did not start streaming: {resp!r}")
+        return self.stream
+
+    def stop_stream(self):
+        """Stop streaming; the samples stay readable through the returned SensorStream."""
+        stream = self.stream
+        if stream is None:
+            return None
+        try:
+            resp = self._send("STREAM OFF")
+            if not resp.startswith("OK STREAM OFF"):
+                logging.warning(f"Valve on {self.port} did not confirm STREAM OFF: {resp!r}")
+        finally:
+            stream.stop()
+            self.stream = None
+        return stream
@@ -1,11 +1,19 @@
 from abc import ABC, abstractmethod
+from typing import Optional
+
+from src.utils.transport import Transport
 
 class DeviceController(ABC):
-    """Abstract base class for all device controllers."""
+    """Abstract base class for all device controllers.
+
+    Controllers talk to their device through ``transport`` (see
+    ``src/utils/transport.py``); it stays None until a link is open.
+    """
 
     def __init__(self, port: str, baudrate: int = 115200):
         self.port = port
         self.baudrate = baudrate
+        self.transport: Optional[Transport] = None
 
     @abstractmethod
     def on(self):
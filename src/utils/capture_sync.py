@@ -0,0 +1,249 @@
+"""
+Microscope captures timed relative to pump/valve events.
+
+Triggers are declared in the YAML (``capture triggers:``); each fires a
+capture a fixed offset after every matching device event:
+
+    capture triggers:
+      - event: valve_on     # valve_on, valve_off, valve_toggle, valve_mask, valve_pulse, valve_pwm,
+        offset_ms: 200      # pump_start, pump_stop, pump_voltage, pump_freq, pump_waveform
+        frames: 3           # optional, default 1
+        interval_ms: 50     # optional spacing between the frames
+
+Events and frames share the ``time.perf_counter`` timeline. A device event
+is stamped when the controller call returns (the command has been
+acknowledged). A dedicated thread waits for each capture deadline (sleep,
+then a short spin) and then either
+
+- picks the ring-buffer frame whose timestamp is closest to the target when
+  the microscope is capturing continuously, or
+- grabs a frame on demand (software trigger) when it is not.
+
+Every captured frame is stamped with its measured offset from the
+triggering event; ``report()`` summarises the error against the requested
+offsets per trigger.
+"""
+
+from __future__ import annotations
+
+import heapq
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Controller method -> event name, per device
+_EVENT_NAMES = {
+    "valve": {"on": "valve_on", "off": "valve_off", "toggle": "valve_toggle",
+              "set_mask": "valve_mask", "pulse": "valve_pulse", "pwm": "valve_pwm", "pwm_off": "valve_off"},
+    "pump": {"bartels_start": "pump_start", "bartels_stop": "pump_stop",
+             "bartels_set_voltage": "pump_voltage", "bartels_set_freq": "pump_freq",
+             "bartels_set_waveform": "pump_waveform"},
+}
+EVENTS = frozenset(name for names in _EVENT_NAMES.values() for name in names.values())
+
+_SPIN_S = 0.001  # busy-wait the last millisecond before a deadline
+
+
+class CaptureTrigger(NamedTuple):
+    event: str
+    offset_s: float
+    frames: int = 1
+    interval_s: float = 0.0
+
+
+class CapturedFrame(NamedTuple):
+    trigger: int           # index into CaptureSync.triggers
+    event: str
+    event_time: float      # perf_counter of the device event
+    target_offset_s: float
+    frame_number: int
+    frame_time: float      # perf_counter timestamp of the frame
+    image: Any             # copy of the frame (None if keep_images=False)
+
+    @property
+    def offset_s(self) -> float:
+        return self.frame_time - self.event_time
+
+    @property
+    def error_s(self) -> float:
+        return self.offset_s - self.target_offset_s
+
+
+def parse_triggers(items: Iterable[Dict[str, Any]]) -> List[CaptureTrigger]:
+    """Validate the ``capture triggers:`` list from a YAML config."""
+    triggers = []
+    for item in items or []:
+        event = str(item.get("event", "")).strip()
+        if event not in EVENTS:
+            raise ValueError(f"Unknown capture trigger event {event!r}; use one of {sorted(EVENTS)}")
+        offset = float(item.get("offset_ms", 0)) / 1e3
+        frames = int(item.get("frames", 1))
+        interval = float(item.get("interval_ms", 0)) / 1e3
+        if offset < 0 or frames < 1 or interval < 0:
+            raise ValueError(f"Invalid capture trigger: {item!r}")
+        triggers.append(CaptureTrigger(event, offset, frames, interval))
+    return triggers
+
+
+class _SyncedDevice:
+    """Proxy reporting event-producing controller calls to a CaptureSync."""
+
+    def __init__(self, device: Any, events: Dict[str, str], sync: "CaptureSync"):
+        self._device = device
+        self._events = events
+        self._sync = sync
+
+    def __getattr__(self, attr: str):
+        value = getattr(self._device, attr)
+        event = self._events.get(attr)
+        if event is None or not callable(value):
+            return value
+
+        def synced(*args, **kwargs):
+            result = value(*args, **kwargs)
+            self._sync.event(event)
+            return result
+
+        return synced
+
+    def __bool__(self) -> bool:
+        return bool(self._device)
+
+
+class CaptureSync:
+    """Schedules microscope captures at offsets after device events."""
+
+    def __init__(self, microscope, triggers: List[CaptureTrigger], *, keep_images: bool = True,
+                 clock: Callable[[], float] = time.perf_counter):
+        self.microscope = microscope
+        self.triggers = list(triggers)
+        self.keep_images = keep_images
+        self._clock = clock
+        self.events: List[Tuple[str, float]] = []
+        self.captures: List[CapturedFrame] = []
+        self.missed = 0
+        self._queue: List[Tuple[float, int, int, str, float]] = []  # (target, seq, trigger, event, t)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._closing = False
+        self._thread = threading.Thread(target=self._worker, name="capture-sync", daemon=True)
+        self._thread.start()
+
+    def wrap_device(self, device: Any, name: str) -> Any:
+        if device is None or name not in _EVENT_NAMES:
+            return device
+        return _SyncedDevice(device, _EVENT_NAMES[name], self)
+
+    def event(self, name: str, t: Optional[float] = None) -> None:
+        """Record a device event and schedule the captures it triggers."""
+        t = self._clock() if t is None else t
+        self.events.append((name, t))
+        with self._cond:
+            for index, trig in enumerate(self.triggers):
+                if trig.event != name:
+                    continue
+                for k in range(trig.frames):
+                    offset = trig.offset_s + k * trig.interval_s
+                    heapq.heappush(self._queue, (t + offset, self._seq, index, name, t))
+                    self._seq += 1
+            self._cond.notify()
+
+    # Capture thread -------------------------------------------------------------
+    def _wait_until(self, target: float) -> None:
+        while True:
+            remaining = target - self._clock()
+            if remaining <= 0:
+                return
+            if remaining > _SPIN_S:
+                time.sleep(remaining - _SPIN_S)
+            else:
+                time.sleep(0)
+
+    def _worker(self) -> None:
+        while True:
+            with self._cond:
+                while not self._queue and not self._closing:
+                    self._cond.wait()
+                if not self._queue:
+                    return
+                target = self._queue[0][0]
+                remaining = target - self._clock()
+                if remaining > _SPIN_S:
+                    # Re-check after waking: an earlier capture may have been queued
+                    self._cond.wait(remaining - _SPIN_S)
+                    continue
+                target, _, index, name, t_event = heapq.heappop(self._queue)
+            self._wait_until(target)
+            try:
+                self._capture(index, name, t_event, target)
+            except Exception as exc:
+                self.missed += 1
+                logger.warning(f"Triggered capture failed: {exc}")
+
+    def _capture(self, index: int, name: str, t_event: float, target: float) -> None:
+        scope = self.microscope
+        if scope.capturing:
+            number, _, _ = self._nearest_frame(target)
+        else:
+            scope.capture_image()
+            number = scope.ring.count - 1
+        item = scope.ring.get(number)
+        if item is None:
+            self.missed += 1
+            return
+        view, frame_time = item
+        image = view.copy() if self.keep_images else None
+        self.captures.append(CapturedFrame(index, name, t_event, target - t_event, number, frame_time, image))
+
+    def _nearest_frame(self, target: float):
+        """Ring frame closest to `target`; waits for the first frame at/after it."""
+        ring = self.microscope.ring
+        latest = ring.latest()
+        while latest is None or latest[2] < target:
+            latest = ring.wait_frame(latest[0] if latest else -1, timeout=1.0)
+            if latest is None:
+                raise RuntimeError("No frame from the microscope within 1 s")
+        number, _, frame_time = latest
+        previous = ring.get(number - 1)
+        if previous is not None and target - previous[1] < frame_time - target:
+            return number - 1, previous[0], previous[1]
+        return latest
+
+    def close(self, timeout: float = 5.0) -> None:
+        """Finish queued captures (up to `timeout`) and stop the thread."""
+        with self._cond:
+            self._closing = True
+            self._cond.notify()
+        self._thread.join(timeout)
+
+    # Reporting ------------------------------------------------------------------
+    def report(self) -> Dict[str, Any]:
+        per_trigger = []
+        for index, trig in enumerate(self.triggers):
+            errors = [c.error_s for c in self.captures if c.trigger == index]
+            row = {"event": trig.event, "offset_ms": 1e3 * trig.offset_s, "frames": len(errors)}
+            if errors:
+                mean = sum(errors) / len(errors)
+                row.update({
+                    "mean_error_ms": 1e3 * mean,
+                    "max_abs_error_ms": 1e3 * max(abs(e) for e in errors),
+                    "std_error_ms": 1e3 * (sum((e - mean) ** 2 for e in errors) / len(errors)) ** 0.5,
+                })
+            per_trigger.append(row)
+        return {"events": len(self.events), "captures": len(self.captures), "missed": self.missed,
+                "triggers": per_trigger}
+
+    def format_report(self) -> str:
+        r = self.report()
+        lines = [f"[CAPTURE] {r['captures']} triggered frames from {r['events']} device events"
+                 + (f", {r['missed']} missed" if r["missed"] else "")]
+        for row in r["triggers"]:
+            line = f"  {row['event']} +{row['offset_ms']:.0f} ms: {row['frames']} frames"
+            if row["frames"]:
+                line += (f", offset error mean {row['mean_error_ms']:+.2f} ms, "
+                         f"max |err| {row['max_abs_error_ms']:.2f} ms, std {row['std_error_ms']:.2f} ms")
+            lines.append(line)
+        return "\n".join(lines)
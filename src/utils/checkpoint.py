@@ -0,0 +1,238 @@
+"""
+Checkpoint journal for long ``run:`` sequences, so an interrupted run can
+continue where it stopped instead of at step 0.
+
+While a run executes, RunJournal keeps the execution cursor (the step in
+progress and the time already spent in it) and the device state left by the
+commands sent so far (pump running, waveform, voltage, frequency; valve
+on/off, bank mask or firmware PWM cycle). A background thread writes it to
+a small JSON file right after the cursor moves and every `interval_s`
+during long steps, so journaling adds no I/O to the timing path. Writes go
+to a temporary file that is synced and renamed over the journal, so a
+crash or power loss leaves the previous checkpoint intact.
+
+On resume the recorded device state is restored and the interrupted step
+continues: timed blocks pick up at their elapsed time and phase, waits,
+``pump_cycle`` and ``flow_setpoint`` only run for their remaining time.
+Every other step is a single command setting absolute state and is simply
+sent again. A journal only resumes the ``run:`` steps it was written for
+(their hash is stored with it).
+
+Example:
+    checkpoint = load_checkpoint(path)
+    journal = RunJournal(path, config["run"], resume_from=checkpoint)
+    journal.restore(pump, valve)
+    run_sequence(config, pump, valve, profiles, journal=journal)
+    journal.close("complete")
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, NamedTuple, Optional, Union
+
+logger = logging.getLogger(__name__)
+
+_MIN_WRITE_GAP_S = 0.2  # coalesce bursts of cursor moves into one write
+
+# Controller calls that change device state, per device
+_TRACKED = {
+    "pump": ("bartels_start", "bartels_stop", "bartels_set_voltage", "bartels_set_freq", "bartels_set_waveform"),
+    "valve": ("on", "off", "toggle", "set_mask", "pwm", "pwm_off"),
+}
+
+
+class CheckpointError(RuntimeError):
+    """Raised when a journal cannot be read or does not match the run."""
+
+
+class Checkpoint(NamedTuple):
+    run_hash: str                       # run_fingerprint() of the journaled steps
+    step: int                           # index of the step in progress (all earlier ones completed)
+    elapsed_s: float                    # time already spent in that step
+    devices: Dict[str, Dict[str, Any]]  # device name -> recorded state
+    status: str                         # running | interrupted | error | complete
+    updated_at: float                   # time.time() of the write
+    source: Optional[str] = None        # protocol file, for messages only
+
+
+def run_fingerprint(steps: List[Any]) -> str:
+    """Short hash identifying a ``run:`` list."""
+    blob = json.dumps(steps, sort_keys=True, default=str).encode("utf-8")
+    return hashlib.sha256(blob).hexdigest()[:16]
+
+
+def default_journal_path(protocol: str) -> str:
+    return f"{os.path.splitext(protocol)[0]}.checkpoint.json"
+
+
+def load_checkpoint(path: Union[str, Path]) -> Checkpoint:
+    try:
+        data = json.loads(Path(path).read_text(encoding="utf-8"))
+        return Checkpoint(**{k: data[k] for k in Checkpoint._fields if k in data})
+    except FileNotFoundError:
+        raise CheckpointError(f"No checkpoint journal at {path}") from None
+    except (OSError, ValueError, TypeError) as exc:
+        raise CheckpointError(f"Cannot read checkpoint journal {path}: {exc}") from exc
+
+
+def _device_update(name: str, method: str, args: tuple, state: Dict[str, Any]) -> Dict[str, Any]:
+    """State of device `name` after ``method(*args)`` succeeded."""
+    if name == "pump":
+        if method in ("bartels_start", "bartels_stop"):
+            return {**state, "running": method == "bartels_start"}
+        return {**state, method[len("bartels_set_"):]: args[0]}
+    if method in ("on", "off", "pwm_off"):
+        return {"on": method == "on"}
+    if method == "pwm":
+        period, duty = int(args[0]), int(args[1])
+        return {"pwm": [period, duty]} if 0 < duty < 100 else {"on": duty > 0}
+    if method == "set_mask":
+        from src.controllers.valve_bank_control import parse_valve_mask
+
+        return {"mask": parse_valve_mask(args[0])}
+    # toggle: only known if the state before it was
+    return {"on": not state["on"]} if "on" in state else {}
+
+
+class _JournaledDevice:
+    """Proxy recording state-changing controller calls in a RunJournal."""
+
+    def __init__(self, device: Any, name: str, journal: "RunJournal"):
+        self._device = device
+        self._name = name
+        self._journal = journal
+
+    def __getattr__(self, attr: str):
+        value = getattr(self._device, attr)
+        if attr not in _TRACKED[self._name] or not callable(value):
+            return value
+
+        def journaled(*args, **kwargs):
+            result = value(*args, **kwargs)
+            self._journal.device_call(self._name, attr, args)
+            return result
+
+        return journaled
+
+    def __bool__(self) -> bool:
+        return bool(self._device)
+
+
+class RunJournal:
+    """Execution cursor and device state of one run, written in the background."""
+
+    def __init__(self, path: Union[str, Path], steps: List[Any], *, source: Optional[str] = None,
+                 resume_from: Optional[Checkpoint] = None, interval_s: float = 2.0):
+        self.path = Path(path)
+        self.run_hash = run_fingerprint(steps)
+        self.source = source
+        self.interval_s = interval_s
+        if resume_from is not None and resume_from.run_hash != self.run_hash:
+            raise CheckpointError(f"Checkpoint journal {self.path} was written for different run steps")
+        self.start_step = resume_from.step if resume_from else 0
+        self.resume_elapsed_s = resume_from.elapsed_s if resume_from else 0.0
+        self.devices: Dict[str, Dict[str, Any]] = {k: dict(v) for k, v in (resume_from.devices if resume_from
+                                                                           else {}).items()}
+        self.writes = 0
+        self._step = self.start_step
+        self._step_started: Optional[float] = None  # perf_counter the current step started at
+        self._status = "running"
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._write()
+        self._thread = threading.Thread(target=self._writer, name="run-journal", daemon=True)
+        self._thread.start()
+
+    # Run side -------------------------------------------------------------------
+    def begin_step(self, index: int) -> float:
+        """Mark step `index` as in progress; returns the time it already ran before a resume."""
+        elapsed = self.resume_elapsed_s if index == self.start_step else 0.0
+        with self._lock:
+            self._step = index
+            self._step_started = time.perf_counter() - elapsed
+        self._wake.set()
+        return elapsed
+
+    def wrap_device(self, device: Any, name: str) -> Any:
+        if device is None or name not in _TRACKED:
+            return device
+        return _JournaledDevice(device, name, self)
+
+    def device_call(self, name: str, method: str, args: tuple) -> None:
+        with self._lock:
+            self.devices[name] = _device_update(name, method, args, self.devices.get(name, {}))
+
+    def restore(self, pump, valve) -> List[str]:
+        """Put the devices into the recorded state; returns what was sent, for logging."""
+        sent = []
+        pump_state = self.devices.get("pump", {}) if pump else {}
+        for key in ("waveform", "voltage", "freq"):
+            if pump_state.get(key) is not None:
+                getattr(pump, f"bartels_set_{key}")(pump_state[key])
+                sent.append(f"pump {key} {pump_state[key]}")
+        if "running" in pump_state:
+            pump.bartels_start() if pump_state["running"] else pump.bartels_stop()
+            sent.append(f"pump {'start' if pump_state['running'] else 'stop'}")
+        valve_state = self.devices.get("valve", {}) if valve else {}
+        if "mask" in valve_state:
+            valve.set_mask(valve_state["mask"])
+            sent.append(f"valve mask {valve_state['mask']:04X}")
+        elif "pwm" in valve_state:
+            valve.pwm(*valve_state["pwm"])
+            sent.append(f"valve pwm {valve_state['pwm'][1]}% of {valve_state['pwm'][0]} ms")
+        elif "on" in valve_state:
+            valve.on() if valve_state["on"] else valve.off()
+            sent.append(f"valve {'on' if valve_state['on'] else 'off'}")
+        return sent
+
+    def close(self, status: str = "complete") -> None:
+        """Stop the writer and write the final checkpoint with `status`."""
+        if self._stop.is_set():
+            return
+        with self._lock:
+            self._status = status
+            if status == "complete":
+                self._step_started = None
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+        self._write()
+
+    # Writer -----------------------------------------------------------------------
+    def snapshot(self) -> Checkpoint:
+        with self._lock:
+            elapsed = 0.0 if self._step_started is None else time.perf_counter() - self._step_started
+            return Checkpoint(self.run_hash, self._step, round(elapsed, 3),
+                              {k: dict(v) for k, v in self.devices.items()}, self._status, time.time(),
+                              self.source)
+
+    def _write(self) -> None:
+        data = json.dumps(self.snapshot()._asdict(), indent=2) + "\n"
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)  # atomic: a crash leaves the previous checkpoint
+        except OSError as exc:
+            logger.warning(f"Checkpoint not written to {self.path}: {exc}")
+            return
+        self.writes += 1
+
+    def _writer(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval_s)
+            self._wake.clear()
+            if self._stop.is_set():
+                return
+            self._write()
+            self._stop.wait(_MIN_WRITE_GAP_S)
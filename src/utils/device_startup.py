@@ -0,0 +1,113 @@
+"""Concurrent device initialization.
+
+Each device (pump, valve, and later robots or cameras) is discovered and
+opened in its own thread. The caller blocks on a shared readiness barrier
+until every device is ready, one fails, or its per-device timeout expires,
+so rig startup costs the slowest device rather than the sum of all of them.
+The threads are daemon threads: a factory that never returns (a hung USB
+open) cannot keep the process alive after its timeout.
+"""
+
+from __future__ import annotations
+
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, Optional
+
+
+class DeviceInitError(RuntimeError):
+    """Raised when one or more devices fail or time out during startup."""
+
+    def __init__(self, errors: Dict[str, str]):
+        self.errors = errors
+        details = "; ".join(f"{name}: {msg}" for name, msg in errors.items())
+        super().__init__(f"Device initialization failed ({details})")
+
+
+def _close_quietly(device: Any) -> None:
+    close = getattr(device, "close", None)
+    if close is None:
+        return
+    try:
+        close()
+    except Exception:
+        pass
+
+
+def start_devices(
+    factories: Dict[str, Callable[[], Any]],
+    *,
+    timeouts: Optional[Dict[str, float]] = None,
+    default_timeout: float = 10.0,
+    timings: Optional[Dict[str, float]] = None,
+) -> Dict[str, Any]:
+    """
+    Run all device factories concurrently and return ``{name: device}``.
+
+    Parameters
+    ----------
+    factories : dict
+        Maps a device name to a zero-argument callable that discovers, opens
+        and configures the device, returning the ready controller.
+    timeouts : dict, optional
+        Per-device timeout in seconds, measured from the common start time.
+    default_timeout : float, default 10.0
+        Timeout for devices not listed in `timeouts`.
+    timings : dict, optional
+        If given, filled with the seconds each successful device took.
+
+    Raises
+    ------
+    DeviceInitError
+        If any factory raises or exceeds its timeout. Devices that did come
+        up are closed before raising; a device that finishes after its
+        timeout is closed as soon as its factory returns.
+    """
+    timeouts = timeouts or {}
+    if not factories:
+        return {}
+
+    start = time.perf_counter()
+    finished_at: Dict[str, float] = {}
+
+    def _timed(name: str, factory: Callable[[], Any]) -> Any:
+        device = factory()
+        finished_at[name] = time.perf_counter() - start
+        return device
+
+    def _run(future: Future, name: str, factory: Callable[[], Any]) -> None:
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(_timed(name, factory))
+        except BaseException as exc:
+            future.set_exception(exc)
+
+    futures: Dict[str, Future] = {}
+    for name, factory in factories.items():
+        futures[name] = Future()
+        threading.Thread(target=_run, args=(futures[name], name, factory), name=f"device-init-{name}",
+                         daemon=True).start()
+
+    devices: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    # Wait in deadline order; every device has been running since `start`.
+    for name in sorted(futures, key=lambda n: timeouts.get(n, default_timeout)):
+        future = futures[name]
+        remaining = start + timeouts.get(name, default_timeout) - time.perf_counter()
+        try:
+            devices[name] = future.result(timeout=max(0.0, remaining))
+        except TimeoutError:
+            errors[name] = f"not ready within {timeouts.get(name, default_timeout):g}s"
+            future.add_done_callback(lambda f: f.exception() is None and _close_quietly(f.result()))
+        except Exception as exc:
+            errors[name] = f"{type(exc).__name__}: {exc}"
+
+    if errors:
+        for device in devices.values():
+            _close_quietly(device)
+        raise DeviceInitError(errors)
+    if timings is not None:
+        timings.update(finished_at)
+    return devices
@@ -0,0 +1,284 @@
+"""
+Closed-loop flow control: a PID loop that trims pump frequency (or
+amplitude) so a measured flow follows a setpoint.
+
+- PID: derivative on measurement (no kick on setpoint changes), low-pass
+  filtered derivative, output clamped to the pump's range, and integration
+  paused while the output is saturated in the direction of the error
+  (anti-windup).
+- CommandBudget: token bucket for pump commands. Each Bartels command is an
+  acknowledged USB round trip (~0.24 s), so the loop runs faster than it
+  commands; ticks without budget keep measuring and integrating, and
+  unchanged (rounded) outputs are never sent.
+- FlowController: fixed-rate loop on absolute deadlines with an optional
+  setpoint ramp. Used by the ``flow_setpoint:`` step.
+- StreamFlowSource: mean of the last few milliseconds of a SensorStream
+  channel. ``SimulatedFluidPump`` (sim_control) is both pump and source for
+  offline tuning.
+
+YAML:
+    flow control:
+      source: sensor        # sensor (valve sensor stream) or simulated
+      channel: flow
+      output: frequency     # or amplitude
+      kp: 5.0               # Hz per flow unit of error
+      ki: 20.0              # Hz per flow unit per second
+      kd: 0.0
+      rate_hz: 20           # loop rate
+      command_rate_hz: 2    # pump commands per second at most
+    run:
+      - pump_on: p
+      - flow_setpoint: 12.0  # flow units of the source (e.g. uL/min)
+        duration: 30
+        ramp: 1.0            # optional, units per second
+"""
+
+from __future__ import annotations
+
+import logging
+import math
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Output -> (pump method, hardware range); see UsbPumpController.set_frequency/set_amplitude
+_OUTPUTS = {
+    "frequency": ("bartels_set_freq", (1, 300)),
+    "amplitude": ("bartels_set_voltage", (1, 250)),
+}
+
+
+class FlowControlError(RuntimeError):
+    """Raised for an invalid ``flow control`` configuration or a missing flow source."""
+
+
+class PID:
+    """Positional PID with anti-windup; `update` returns the clamped output."""
+
+    def __init__(self, kp: float, ki: float = 0.0, kd: float = 0.0, *, out_min: float = -math.inf,
+                 out_max: float = math.inf, derivative_tau_s: float = 0.1):
+        self.kp, self.ki, self.kd = kp, ki, kd
+        self.out_min, self.out_max = out_min, out_max
+        self.derivative_tau_s = derivative_tau_s
+        self.reset()
+
+    def reset(self, output: float = 0.0) -> None:
+        """Bumpless start: the first update continues from `output`."""
+        self.integral = min(max(output, self.out_min), self.out_max)
+        self._last_measurement: Optional[float] = None
+        self._derivative = 0.0
+
+    def update(self, setpoint: float, measurement: float, dt: float) -> float:
+        error = setpoint - measurement
+        if self._last_measurement is not None and dt > 0:
+            raw = -(measurement - self._last_measurement) / dt
+            alpha = dt / (self.derivative_tau_s + dt)
+            self._derivative += alpha * (raw - self._derivative)
+        self._last_measurement = measurement
+        proportional = self.kp * error
+        derivative = self.kd * self._derivative
+        candidate = self.integral + self.ki * error * dt
+        unclamped = proportional + candidate + derivative
+        # Conditional integration: do not wind further into a saturated output
+        if not ((unclamped > self.out_max and error > 0) or (unclamped < self.out_min and error < 0)):
+            self.integral = min(max(candidate, self.out_min), self.out_max)
+        return min(max(proportional + self.integral + derivative, self.out_min), self.out_max)
+
+
+class CommandBudget:
+    """Token bucket: at most `rate_hz` commands per second on average, bursts of `burst`."""
+
+    def __init__(self, rate_hz: float, burst: int = 1, clock: Callable[[], float] = time.perf_counter):
+        self.rate_hz = float(rate_hz)
+        self.burst = burst
+        self._clock = clock
+        self._tokens = float(burst)
+        self._t = clock()
+
+    def take(self) -> bool:
+        now = self._clock()
+        self._tokens = min(self.burst, self._tokens + (now - self._t) * self.rate_hz)
+        self._t = now
+        if self._tokens >= 1.0:
+            self._tokens -= 1.0
+            return True
+        return False
+
+
+class StreamFlowSource:
+    """Flow from a SensorStream channel, averaged over the last `window_s`."""
+
+    def __init__(self, stream, channel: str = "flow", window_s: float = 0.05):
+        if channel not in stream.channels:
+            raise FlowControlError(f"Sensor stream has no channel {channel!r} (have {list(stream.channels)})")
+        self.stream = stream
+        self.channel = channel
+        self.samples = max(1, int(window_s * stream.rate_hz))
+
+    def read(self) -> Optional[float]:
+        _, values = self.stream.latest(self.samples, channel=self.channel)
+        return float(values.mean()) if len(values) else None
+
+
+class FlowSample(NamedTuple):
+    t: float              # perf_counter
+    setpoint: float       # ramped setpoint at this tick
+    flow: Optional[float]
+    output: float         # PID output (before rounding)
+    sent: bool            # a pump command went out this tick
+
+
+class FlowController:
+    """Runs the PID loop against `pump` (``bartels_*`` API) and `source` (``read() -> flow``)."""
+
+    def __init__(self, pump, source, *, kp: float = 5.0, ki: float = 20.0, kd: float = 0.0,
+                 output: str = "frequency", out_min: Optional[float] = None, out_max: Optional[float] = None,
+                 rate_hz: float = 20.0, command_rate_hz: float = 2.0, initial_output: Optional[float] = None,
+                 clock: Callable[[], float] = time.perf_counter):
+        if output not in _OUTPUTS:
+            raise FlowControlError(f"Unknown flow control output {output!r}; use one of {sorted(_OUTPUTS)}")
+        method, (low, high) = _OUTPUTS[output]
+        self.pump = pump
+        self.source = source
+        self.output = output
+        self._command = method
+        self.rate_hz = float(rate_hz)
+        self.pid = PID(kp, ki, kd, out_min=low if out_min is None else out_min,
+                       out_max=high if out_max is None else out_max)
+        self.budget = CommandBudget(command_rate_hz, clock=clock)
+        self._clock = clock
+        # The pump already runs at `initial_output` (profile or last acknowledged value)
+        self.last_sent: Optional[int] = None if initial_output is None else int(round(initial_output))
+        self.output_value = initial_output
+        self.setpoint: Optional[float] = None
+        self.log: List[FlowSample] = []
+        self.commands = 0
+        self.deferred = 0     # ticks whose new output waited for command budget
+        self.errors = 0
+
+    @classmethod
+    def from_config(cls, settings: Dict[str, Any], pump, source) -> "FlowController":
+        keys = ("kp", "ki", "kd", "output", "out_min", "out_max", "rate_hz", "command_rate_hz", "initial_output")
+        return cls(pump, source, **{k: settings[k] for k in keys if k in settings})
+
+    def _send(self, value: int) -> bool:
+        try:
+            getattr(self.pump, self._command)(value)
+        except Exception as exc:
+            self.errors += 1
+            logger.warning(f"Flow control: pump {self.output} command failed: {exc}")
+            return False
+        self.last_sent = value
+        self.commands += 1
+        return True
+
+    def hold(self, target: float, duration_s: float, *, ramp_per_s: Optional[float] = None,
+             sleep: Callable[[float], None] = time.sleep) -> Dict[str, Any]:
+        """Regulate towards `target` for `duration_s`; returns the step's summary."""
+        period = 1.0 / self.rate_hz
+        start = self._clock()
+        setpoint = target if self.setpoint is None or not ramp_per_s else self.setpoint
+        if self.output_value is None:
+            self.output_value = self.pid.out_min
+        self.pid.reset(self.output_value)
+        first = len(self.log)
+        deadline = start
+        last_tick = start
+        while True:
+            now = self._clock()
+            if now - start >= duration_s:
+                break
+            dt = now - last_tick
+            last_tick = now
+            if ramp_per_s:
+                step = ramp_per_s * dt
+                setpoint = min(target, setpoint + step) if setpoint < target else max(target, setpoint - step)
+            else:
+                setpoint = target
+            self.setpoint = setpoint
+            flow = self.source.read()
+            sent = False
+            if flow is not None:
+                self.output_value = self.pid.update(setpoint, flow, dt if dt > 0 else period)
+                value = int(round(self.output_value))
+                if value != self.last_sent:
+                    if self.budget.take():
+                        sent = self._send(value)
+                    else:
+                        self.deferred += 1
+            self.log.append(FlowSample(now, setpoint, flow, self.output_value, sent))
+            # Fixed rate on absolute deadlines; ticks missed behind a slow command are skipped
+            deadline += period
+            now = self._clock()
+            if deadline < now:
+                deadline = now + period - ((now - deadline) % period)
+            sleep(max(0.0, min(deadline, start + duration_s) - now))
+        self.setpoint = setpoint
+        return self.summary(first, target)
+
+    def summary(self, first: int = 0, target: Optional[float] = None, band: float = 0.05) -> Dict[str, Any]:
+        """Tracking statistics for log entries from `first` (one hold step)."""
+        rows = [r for r in self.log[first:] if r.flow is not None]
+        result: Dict[str, Any] = {"ticks": len(self.log) - first, "measured": len(rows),
+                                  "commands": sum(r.sent for r in self.log[first:])}
+        if not rows:
+            return result
+        target = rows[-1].setpoint if target is None else target
+        tail = rows[len(rows) // 2:]
+        result["mean_abs_error"] = sum(abs(r.setpoint - r.flow) for r in tail) / len(tail)
+        result["final_flow"] = sum(r.flow for r in rows[-5:]) / len(rows[-5:])
+        tolerance = band * abs(target) if target else band
+        settled = None
+        for r in reversed(rows):
+            if abs(r.flow - target) > tolerance:
+                break
+            settled = r.t
+        result["settle_s"] = None if settled is None else settled - self.log[first].t
+        outputs = [r.output for r in rows]
+        result["output_range"] = (min(outputs), max(outputs))
+        return result
+
+    def format_summary(self, target: float, s: Dict[str, Any]) -> str:
+        line = f"[FLOW] setpoint {target:g}: {s['commands']} pump commands over {s['ticks']} ticks"
+        if "mean_abs_error" in s:
+            low, high = s["output_range"]
+            settle = "not settled" if s["settle_s"] is None else f"settled (±5%) after {s['settle_s']:.1f}s"
+            line += (f", final flow {s['final_flow']:.3g}, mean |error| {s['mean_abs_error']:.3g} "
+                     f"(second half), {settle}, {self.output} {low:.0f}..{high:.0f}")
+        else:
+            line += ", no flow readings"
+        return line
+
+
+def build_flow_controller(settings: Dict[str, Any], pump, valve, *, dry_run: bool = False
+                          ) -> Tuple[FlowController, Any]:
+    """FlowController for the ``flow control`` YAML block.
+
+    Returns ``(controller, simulated_model_or_None)``. With ``source:
+    simulated`` (or in a dry run) the controller drives a SimulatedFluidPump
+    instead of `pump`.
+    """
+    source_kind = str(settings.get("source", "simulated" if dry_run else "sensor")).lower()
+    if source_kind == "simulated" or dry_run:
+        from src.controllers.sim_control import SimulatedFluidPump
+
+        model_keys = ("latency_s", "gain", "rolloff_hz", "tau_s", "viscosity_drift", "noise", "voltage", "freq")
+        model = SimulatedFluidPump(**{k: settings["model"][k] for k in model_keys if k in (settings.get("model") or {})})
+        model.bartels_start()
+        settings = {"initial_output": model.freq if settings.get("output", "frequency") == "frequency"
+                    else model.voltage, **settings}
+        return FlowController.from_config(settings, model, model), model
+    if source_kind != "sensor":
+        raise FlowControlError(f"Unknown flow control source {source_kind!r}; use 'sensor' or 'simulated'")
+    stream = getattr(valve, "stream", None) if valve else None
+    if stream is None:
+        raise FlowControlError("Flow control source 'sensor' needs a running 'sensor stream' on the valve")
+    if not pump:
+        raise FlowControlError("Flow control needs the pump")
+    source = StreamFlowSource(stream, settings.get("channel", "flow"), float(settings.get("window_ms", 50)) / 1e3)
+    state = getattr(pump, "state", None) or {}
+    key = "frequency" if settings.get("output", "frequency") == "frequency" else "amplitude"
+    if "initial_output" not in settings and state.get(key) is not None:
+        settings = {**settings, "initial_output": state[key]}
+    return FlowController.from_config(settings, pump, source), None
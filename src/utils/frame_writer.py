@@ -0,0 +1,399 @@
+"""
+Background writer for microscope frames.
+
+``FrameWriter`` follows a ``FrameRing`` (see ``microscope_control``) on a
+drain thread, copies frames into chunk slots of a shared-memory block and
+hands full chunks to a pool of worker processes, which compress them and
+write one file per chunk. The control loop never touches the disk and the
+GIL is not held during compression.
+
+When the workers fall behind, the drain thread waits for a free chunk slot;
+if the camera laps the ring meanwhile, frames are dropped. Both conditions
+are counted (``stats()``) and logged, so a run shows whether the disk kept
+up with the camera.
+
+Run directory layout::
+
+    meta.json          shape, dtype, chunk_frames, compression
+    index.npy          one row per frame: frame number, timestamp, chunk, position
+    chunks/000000.npy  raw chunk (compression "none"; np.load(..., mmap_mode="r"))
+    chunks/000000.zlib compressed chunk (raw C-order bytes)
+
+``FrameStore`` reads a run back (memory-mapped for raw chunks).
+
+Example:
+    writer = FrameWriter("frames/run-001", scope.ring.frames.shape[1:], scope.ring.frames.dtype)
+    writer.attach(scope.ring)
+    ...
+    writer.close()
+    print(FrameWriter.format_stats(writer.stats()))
+    store = FrameStore("frames/run-001")
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import multiprocessing as mp
+import os
+import queue
+import threading
+import time
+import zlib
+from multiprocessing import shared_memory
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None
+
+try:
+    import lz4.frame as lz4_frame
+except ImportError:  # pragma: no cover - optional dependency
+    lz4_frame = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIONS = ("none", "zlib", "lz4")
+_SUFFIX = {"none": ".npy", "zlib": ".zlib", "lz4": ".lz4"}
+INDEX_DTYPE = [("frame", "<i8"), ("timestamp", "<f8"), ("chunk", "<i4"), ("position", "<i4")]
+
+
+class FrameWriterError(RuntimeError):
+    """Raised when the writer cannot be set up or a worker fails."""
+
+
+def _chunk_path(run_dir: Path, chunk: int, compression: str) -> Path:
+    return run_dir / "chunks" / f"{chunk:06d}{_SUFFIX[compression]}"
+
+
+def _compress(data, compression: str, level: int) -> bytes:
+    if compression == "zlib":
+        return zlib.compress(data, level)
+    return lz4_frame.compress(data, compression_level=level)
+
+
+def _worker_main(shm_name: str, slot_bytes: int, shape: Tuple[int, ...], dtype: str, run_dir: str,
+                 compression: str, level: int, tasks, done) -> None:
+    """Worker process: compress and write chunks named in `tasks` until None arrives."""
+    shm = shared_memory.SharedMemory(name=shm_name)
+    frame_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    root = Path(run_dir)
+    try:
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            slot, chunk, nframes = task
+            start = time.perf_counter()
+            raw = nframes * frame_bytes
+            data = shm.buf[slot * slot_bytes: slot * slot_bytes + raw]
+            path = _chunk_path(root, chunk, compression)
+            tmp = path.with_suffix(path.suffix + ".tmp")
+            try:
+                with open(tmp, "wb") as f:
+                    if compression == "none":
+                        frames = np.ndarray((nframes,) + tuple(shape), dtype=dtype, buffer=data)
+                        np.lib.format.write_array(f, frames, allow_pickle=False)
+                        del frames
+                    else:
+                        f.write(_compress(data, compression, level))
+                    written = f.tell()
+                os.replace(tmp, path)
+                done.put((slot, chunk, raw, written, time.perf_counter() - start, None))
+            except Exception as exc:  # report, keep serving
+                done.put((slot, chunk, raw, 0, time.perf_counter() - start, str(exc)))
+            finally:
+                data.release()
+    finally:
+        shm.close()
+
+
+class FrameWriter:
+    """Chunked, compressed frame storage written by a pool of worker processes.
+
+    ``write()`` copies one frame into the current chunk slot (one memcpy);
+    ``attach()`` does this continuously from a FrameRing. ``slots`` chunk
+    buffers are shared with the workers (default ``2 * workers + 2``).
+    """
+
+    def __init__(self, run_dir: Union[str, Path], shape: Tuple[int, ...], dtype, *, workers: int = 2,
+                 chunk_frames: int = 32, slots: Optional[int] = None, compression: str = "zlib",
+                 level: int = 1, slot_timeout: float = 1.0):
+        if np is None:
+            raise FrameWriterError("Frame writing requires numpy (pip install numpy)")
+        if compression not in COMPRESSIONS:
+            raise FrameWriterError(f"Unknown compression {compression!r}; use one of {COMPRESSIONS}")
+        if compression == "lz4" and lz4_frame is None:
+            raise FrameWriterError("lz4 compression requires the lz4 package (pip install lz4)")
+        self.run_dir = Path(run_dir)
+        (self.run_dir / "chunks").mkdir(parents=True, exist_ok=True)
+        self.shape = tuple(int(n) for n in shape)
+        self.dtype = np.dtype(dtype)
+        self.chunk_frames = int(chunk_frames)
+        self.compression = compression
+        self.slot_timeout = slot_timeout
+        self.slots = int(slots or 2 * workers + 2)
+        frame_bytes = int(np.prod(self.shape)) * self.dtype.itemsize
+        self._slot_bytes = frame_bytes * self.chunk_frames
+
+        self._shm = shared_memory.SharedMemory(create=True, size=self._slot_bytes * self.slots)
+        self._buffers = np.ndarray((self.slots, self.chunk_frames) + self.shape, dtype=self.dtype,
+                                   buffer=self._shm.buf)
+        self._free: "queue.Queue[int]" = queue.Queue()
+        for slot in range(self.slots):
+            self._free.put(slot)
+
+        ctx = mp.get_context("spawn")  # no fork with live capture/control threads
+        self._tasks = ctx.Queue()
+        self._done = ctx.Queue()
+        self._procs = [
+            ctx.Process(target=_worker_main, name=f"frame-writer-{i}", daemon=True,
+                        args=(self._shm.name, self._slot_bytes, self.shape, self.dtype.str, str(self.run_dir),
+                              compression, level, self._tasks, self._done))
+            for i in range(max(1, int(workers)))
+        ]
+        for proc in self._procs:
+            proc.start()
+
+        # Current chunk being filled
+        self._slot: Optional[int] = None
+        self._fill = 0
+        self._chunk = 0
+        self._index: List[Tuple[int, float, int, int]] = []
+
+        # Statistics
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.frames = 0
+        self.dropped = 0
+        self.raw_bytes = 0
+        self.written_bytes = 0
+        self.worker_s = 0.0
+        self.slot_wait_s = 0.0
+        self.max_slots_used = 0
+        self.errors: List[str] = []
+        self._last_warning = 0.0
+        self._started = time.perf_counter()
+
+        self._closing = False
+        self._collector = threading.Thread(target=self._collect, name="frame-writer-collect", daemon=True)
+        self._collector.start()
+        self._drain_thread: Optional[threading.Thread] = None
+        self._drain_stop = threading.Event()
+
+    # Backpressure ---------------------------------------------------------------
+    @property
+    def slots_in_use(self) -> int:
+        return self.slots - self._free.qsize()
+
+    def _warn(self, message: str) -> None:
+        now = time.perf_counter()
+        if now - self._last_warning >= 1.0:
+            self._last_warning = now
+            logger.warning(f"[WRITER] {message} (slots in use {self.slots_in_use}/{self.slots}, "
+                           f"dropped {self.dropped})")
+
+    def _acquire_slot(self) -> bool:
+        try:
+            self._slot = self._free.get_nowait()
+        except queue.Empty:
+            start = time.perf_counter()
+            try:
+                self._slot = self._free.get(timeout=self.slot_timeout)
+            except queue.Empty:
+                self._slot = None
+            self.slot_wait_s += time.perf_counter() - start
+            self._warn("disk is not keeping up; waiting for a free chunk buffer")
+        if self._slot is None:
+            return False
+        self.max_slots_used = max(self.max_slots_used, self.slots_in_use)
+        return True
+
+    # Producer side --------------------------------------------------------------
+    def write(self, frame, timestamp: float, number: Optional[int] = None, *,
+              valid: Optional[Callable[[], bool]] = None) -> bool:
+        """Copy `frame` into the current chunk; False if it had to be dropped.
+
+        `valid` is checked after the copy and before the frame is committed
+        (e.g. the ring slot was not overwritten while it was being copied);
+        a rejected frame leaves the chunk untouched.
+        """
+        if self._slot is None and not self._acquire_slot():
+            self.dropped += 1
+            return False
+        position = self._fill
+        self._buffers[self._slot, position] = frame
+        if valid is not None and not valid():
+            self.dropped += 1  # the position is reused by the next frame
+            return False
+        self._index.append((self.frames if number is None else number, timestamp, self._chunk, position))
+        self._fill += 1
+        self.frames += 1
+        if self._fill == self.chunk_frames:
+            self.flush()
+        return True
+
+    def flush(self) -> None:
+        """Hand the current (possibly partial) chunk to the workers."""
+        if self._slot is None or self._fill == 0:
+            return
+        with self._lock:
+            self.submitted += 1
+        self._tasks.put((self._slot, self._chunk, self._fill))
+        self._slot = None
+        self._fill = 0
+        self._chunk += 1
+
+    def _collect(self) -> None:
+        while True:
+            with self._lock:
+                if self._closing and self.completed >= self.submitted:
+                    return
+            try:
+                slot, chunk, raw, written, seconds, error = self._done.get(timeout=0.1)
+            except queue.Empty:
+                if self._closing and not any(p.is_alive() for p in self._procs):
+                    return
+                continue
+            with self._lock:
+                self.completed += 1
+                self.raw_bytes += raw
+                self.written_bytes += written
+                self.worker_s += seconds
+            if error:
+                self.errors.append(f"chunk {chunk}: {error}")
+                logger.error(f"[WRITER] chunk {chunk} failed: {error}")
+            self._free.put(slot)
+
+    # Ring follower --------------------------------------------------------------
+    def attach(self, ring) -> None:
+        """Write every new frame of `ring` (a FrameRing) from a background thread."""
+        self._drain_stop.clear()
+        self._drain_thread = threading.Thread(target=self._drain, args=(ring,), name="frame-writer-drain",
+                                              daemon=True)
+        self._drain_thread.start()
+
+    def _drain(self, ring) -> None:
+        next_number = ring.count
+        while True:
+            stopping = self._drain_stop.is_set()
+            if not stopping:
+                ring.wait_frame(next_number - 1, timeout=0.1)
+            end = ring.count
+            oldest = end - ring.capacity + 1
+            if next_number < oldest:
+                self.dropped += oldest - next_number
+                self._warn("camera lapped the frame ring before frames were saved")
+                next_number = oldest
+            for number in range(next_number, end):
+                item = ring.get(number)
+                if item is None:
+                    self.dropped += 1
+                    continue
+                # Overwritten in the ring while being copied: dropped, not committed
+                self.write(item[0], item[1], number, valid=lambda: ring.is_valid(number))
+            next_number = end
+            if stopping:
+                return
+
+    # Shutdown -------------------------------------------------------------------
+    def close(self, timeout: float = 30.0) -> None:
+        """Save remaining frames, stop the workers and write the index."""
+        if self._closing:
+            return
+        if self._drain_thread is not None:
+            self._drain_stop.set()
+            self._drain_thread.join()
+        self.flush()
+        for _ in self._procs:
+            self._tasks.put(None)
+        with self._lock:
+            self._closing = True
+        deadline = time.perf_counter() + timeout
+        for proc in self._procs:
+            proc.join(max(0.0, deadline - time.perf_counter()))
+        self._collector.join(max(0.0, deadline - time.perf_counter()))
+        for proc in self._procs:
+            if proc.is_alive():
+                proc.terminate()
+                self.errors.append(f"{proc.name} did not finish within {timeout}s")
+        self._elapsed = time.perf_counter() - self._started
+
+        index = np.array(self._index, dtype=INDEX_DTYPE)
+        np.save(self.run_dir / "index.npy", index)
+        meta = {"shape": list(self.shape), "dtype": self.dtype.str, "chunk_frames": self.chunk_frames,
+                "compression": self.compression, "chunks": self._chunk, "frames": len(index)}
+        (self.run_dir / "meta.json").write_text(json.dumps(meta, indent=2), encoding="utf-8")
+
+        del self._buffers
+        self._shm.close()
+        self._shm.unlink()
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = getattr(self, "_elapsed", time.perf_counter() - self._started)
+        return {
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "chunks": self.completed,
+            "raw_mb": self.raw_bytes / 1e6,
+            "written_mb": self.written_bytes / 1e6,
+            "ratio": self.raw_bytes / self.written_bytes if self.written_bytes else 0.0,
+            "throughput_mb_s": self.raw_bytes / 1e6 / elapsed if elapsed > 0 else 0.0,
+            "worker_s": self.worker_s,
+            "slot_wait_s": self.slot_wait_s,
+            "max_slots_used": self.max_slots_used,
+            "slots": self.slots,
+            "errors": list(self.errors),
+        }
+
+    @staticmethod
+    def format_stats(s: Dict[str, Any]) -> str:
+        return (f"[WRITER] {s['frames']} frames in {s['chunks']} chunks, {s['raw_mb']:.1f} MB -> "
+                f"{s['written_mb']:.1f} MB (x{s['ratio']:.2f}), {s['throughput_mb_s']:.1f} MB/s; "
+                f"dropped {s['dropped']}, waited {s['slot_wait_s']:.2f}s for buffers, "
+                f"peak {s['max_slots_used']}/{s['slots']} buffers"
+                + (f"; {len(s['errors'])} errors" if s["errors"] else ""))
+
+
+class FrameStore:
+    """Read-only access to a run written by FrameWriter."""
+
+    def __init__(self, run_dir: Union[str, Path]):
+        if np is None:
+            raise FrameWriterError("Reading frames requires numpy (pip install numpy)")
+        self.run_dir = Path(run_dir)
+        self.meta = json.loads((self.run_dir / "meta.json").read_text(encoding="utf-8"))
+        self.index = np.load(self.run_dir / "index.npy")
+        self.shape = tuple(self.meta["shape"])
+        self.dtype = np.dtype(self.meta["dtype"])
+        self.compression = self.meta["compression"]
+        self._cached: Tuple[int, Any] = (-1, None)
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    @property
+    def timestamps(self):
+        return self.index["timestamp"]
+
+    def chunk(self, chunk: int):
+        """All frames of one chunk (memory-mapped when stored uncompressed)."""
+        if self._cached[0] == chunk:
+            return self._cached[1]
+        path = _chunk_path(self.run_dir, chunk, self.compression)
+        if self.compression == "none":
+            frames = np.load(path, mmap_mode="r")
+        else:
+            raw = path.read_bytes()
+            data = zlib.decompress(raw) if self.compression == "zlib" else lz4_frame.decompress(raw)
+            frames = np.frombuffer(data, dtype=self.dtype).reshape((-1,) + self.shape)
+        self._cached = (chunk, frames)
+        return frames
+
+    def __getitem__(self, i: int):
+        row = self.index[i]
+        return self.chunk(int(row["chunk"]))[int(row["position"])]
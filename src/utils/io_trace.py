@@ -0,0 +1,320 @@
+"""
+Record and replay the byte-level device I/O of the pump and valve.
+
+Recording sets a tap on a controller's transport (``src/utils/transport.py``)
+and logs every write and read, with its start time and how long the call
+blocked, to a compact binary trace file. Replay builds controllers on top of
+a ReplayTransport that returns the recorded responses after the recorded
+latencies, so controller and scheduler changes can be benchmarked offline
+against real device behaviour.
+
+Trace file layout (little-endian)::
+
+    b"MPTRACE1"
+    record*  = <Q t_ns> <I dur_ns> <B channel> <B kind> <I length> payload
+
+``t_ns`` is relative to the start of the recording. ``KIND_CHANNEL`` records
+declare a channel: their payload is JSON metadata (name, transport type,
+endpoints). Write payloads are the bytes sent, read payloads the bytes
+returned, error payloads the exception text.
+
+Example::
+
+    with TraceWriter("run.trace") as trace:
+        record_pump(pump, trace)
+        record_valve(valve, trace)
+        run_sequence(...)
+
+    replay = load_trace("run.trace")
+    pump = replay_pump(replay)
+    valve = replay_valve(replay)
+"""
+
+from __future__ import annotations
+
+import json
+import struct
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Union
+
+from src.utils.transport import Transport, TransportError
+
+MAGIC = b"MPTRACE1"
+_RECORD = struct.Struct("<QIBBI")
+_MAX_DUR_NS = 0xFFFFFFFF
+
+KIND_CHANNEL = 0
+KIND_WRITE = 1
+KIND_READ = 2
+KIND_ERROR = 3
+
+
+class TraceReplayError(RuntimeError):
+    """Raised when a replayed controller diverges from the recorded exchange."""
+
+
+class TraceEvent(NamedTuple):
+    t_ns: int
+    dur_ns: int
+    kind: int
+    payload: bytes
+
+
+class TraceWriter:
+    """Thread-safe writer for trace files (one per run, shared by all devices)."""
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._fh = self.path.open("wb")
+        self._fh.write(MAGIC)
+        self._lock = threading.Lock()
+        self.origin_ns = time.perf_counter_ns()
+        self._channels: Dict[str, int] = {}
+
+    def __enter__(self) -> "TraceWriter":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    def now_ns(self) -> int:
+        return time.perf_counter_ns() - self.origin_ns
+
+    def channel(self, name: str, **meta: Any) -> int:
+        """Declare a channel (device) and return its id."""
+        with self._lock:
+            if name in self._channels:
+                return self._channels[name]
+            channel_id = len(self._channels)
+            if channel_id > 0xFF:
+                raise ValueError("Too many trace channels")
+            self._channels[name] = channel_id
+        payload = json.dumps(dict(meta, name=name)).encode("utf-8")
+        self.record(channel_id, KIND_CHANNEL, payload, self.now_ns(), 0)
+        return channel_id
+
+    def record(self, channel: int, kind: int, payload: bytes, t_ns: int, dur_ns: int) -> None:
+        header = _RECORD.pack(t_ns, min(dur_ns, _MAX_DUR_NS), channel, kind, len(payload))
+        with self._lock:
+            self._fh.write(header)
+            self._fh.write(payload)
+
+    def close(self) -> None:
+        with self._lock:
+            if not self._fh.closed:
+                self._fh.close()
+
+
+class Trace:
+    """Parsed trace: channel metadata plus the ordered events of each channel."""
+
+    def __init__(self, channels: Dict[str, Dict[str, Any]], events: Dict[str, List[TraceEvent]]):
+        self.channels = channels
+        self.events = events
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """Per channel: number of writes/reads/errors and mean read latency (ms)."""
+        out: Dict[str, Dict[str, float]] = {}
+        for name, events in self.events.items():
+            reads = [e.dur_ns for e in events if e.kind == KIND_READ]
+            out[name] = {
+                "writes": sum(1 for e in events if e.kind == KIND_WRITE),
+                "reads": len(reads),
+                "errors": sum(1 for e in events if e.kind == KIND_ERROR),
+                "mean_read_ms": (sum(reads) / len(reads) / 1e6) if reads else 0.0,
+            }
+        return out
+
+
+def load_trace(path: Union[str, Path]) -> Trace:
+    """Parse a trace file written by :class:`TraceWriter`."""
+    data = Path(path).read_bytes()
+    if not data.startswith(MAGIC):
+        raise ValueError(f"{path} is not a device trace file")
+    names: Dict[int, str] = {}
+    channels: Dict[str, Dict[str, Any]] = {}
+    events: Dict[str, List[TraceEvent]] = {}
+    offset = len(MAGIC)
+    view = memoryview(data)
+    while offset + _RECORD.size <= len(data):
+        t_ns, dur_ns, channel, kind, length = _RECORD.unpack_from(data, offset)
+        offset += _RECORD.size
+        payload = bytes(view[offset:offset + length])
+        offset += length
+        if kind == KIND_CHANNEL:
+            meta = json.loads(payload)
+            names[channel] = meta["name"]
+            channels[meta["name"]] = meta
+            events[meta["name"]] = []
+        else:
+            events[names[channel]].append(TraceEvent(t_ns, dur_ns, kind, payload))
+    return Trace(channels, events)
+
+
+# Recording -------------------------------------------------------------------
+
+_TAP_KINDS = {"write": KIND_WRITE, "read": KIND_READ, "error": KIND_ERROR}
+
+
+class TraceTap:
+    """Transport tap writing every transfer of one channel to a trace."""
+
+    def __init__(self, trace: TraceWriter, channel: int):
+        self._trace = trace
+        self._channel = channel
+
+    def on_io(self, kind: str, data, start_ns: int, dur_ns: int) -> None:
+        self._trace.record(self._channel, _TAP_KINDS[kind], bytes(data), start_ns - self._trace.origin_ns, dur_ns)
+
+
+def record_pump(pump, trace: TraceWriter, name: str = "pump") -> None:
+    """Start recording a connected ``UsbPumpController`` into `trace`."""
+    if not pump.connected:
+        raise RuntimeError("Pump must be connected before recording")
+    tap = TraceTap(trace, trace.channel(name, **pump.transport.describe()))
+    pump.transport.tap = tap
+    attach = pump._attach
+
+    def recording_attach(transport):  # keep recording across automatic reconnects
+        transport.tap = tap
+        attach(transport)
+
+    pump._attach = recording_attach
+
+
+def record_valve(valve, trace: TraceWriter, name: str = "valve") -> None:
+    """Start recording a ``ValveController`` (or any controller with a ``transport``) into `trace`."""
+    if valve.transport is None:
+        raise RuntimeError("Valve serial port is not open")
+    meta = dict(valve.transport.describe())
+    meta.setdefault("port", valve.port)
+    meta.setdefault("baudrate", valve.baudrate)
+    valve.transport.tap = TraceTap(trace, trace.channel(name, **meta))
+
+
+# Replay ----------------------------------------------------------------------
+
+class _Player:
+    """Serves the recorded events of one channel in order."""
+
+    def __init__(self, name: str, events: List[TraceEvent], *, speed: float, strict: bool):
+        self.name = name
+        self._events: Deque[TraceEvent] = deque(e for e in events if e.kind != KIND_CHANNEL)
+        self._speed = speed
+        self._strict = strict
+        self._lock = threading.Lock()
+
+    @property
+    def remaining(self) -> int:
+        return len(self._events)
+
+    def _next(self, expect: str) -> TraceEvent:
+        with self._lock:
+            if not self._events:
+                raise TraceReplayError(f"{self.name}: trace exhausted (expected a {expect})")
+            return self._events.popleft()
+
+    def _wait(self, event: TraceEvent) -> None:
+        if self._speed > 0 and event.dur_ns:
+            time.sleep(event.dur_ns / 1e9 / self._speed)
+
+    def write(self, data: bytes) -> TraceEvent:
+        event = self._next("write")
+        if event.kind == KIND_READ or (self._strict and event.kind == KIND_WRITE and event.payload != bytes(data)):
+            raise TraceReplayError(
+                f"{self.name}: write {bytes(data)!r} does not match recorded {event.payload!r}"
+            )
+        self._wait(event)
+        return event
+
+    def read(self) -> TraceEvent:
+        event = self._next("read")
+        if event.kind == KIND_WRITE:
+            raise TraceReplayError(f"{self.name}: read requested but trace has write {event.payload!r}")
+        self._wait(event)
+        return event
+
+
+class ReplayTransport(Transport):
+    """Transport serving a recorded channel: reads return the recorded chunks after the recorded latency."""
+
+    kind = "replay"
+
+    def __init__(self, player: _Player, meta: Optional[Dict[str, Any]] = None, *, timeout: float = 2.0):
+        super().__init__(timeout=timeout)
+        self._player = player
+        self.meta = dict(meta or {})
+        self.serial_number = self.meta.get("serial")
+        self._leftover = b""  # recorded chunk larger than the free buffer space
+        self._open = True
+
+    def _write(self, data) -> None:
+        event = self._player.write(data)
+        if event.kind == KIND_ERROR:
+            raise TransportError(event.payload.decode("utf-8", "replace"))
+
+    def _read_into(self, view: memoryview, timeout: Optional[float]) -> int:
+        data = self._leftover
+        if not data:
+            event = self._player.read()
+            if event.kind == KIND_ERROR:
+                raise TransportError(event.payload.decode("utf-8", "replace"))
+            data = event.payload
+        n = min(len(data), len(view))
+        view[:n] = data[:n]
+        self._leftover = data[n:]
+        return n
+
+    @property
+    def readable(self) -> bool:  # type: ignore[override]
+        return self.meta.get("in_endpoint", True) is not None
+
+    @property
+    def is_open(self) -> bool:
+        return self._open
+
+    def close(self) -> None:
+        self._open = False
+
+    def describe(self) -> Dict[str, Any]:
+        return dict(self.meta, replay=True)
+
+
+def _player(trace: Union[Trace, str, Path], name: str, speed: float, strict: bool) -> tuple[Trace, _Player]:
+    if not isinstance(trace, Trace):
+        trace = load_trace(trace)
+    if name not in trace.channels:
+        raise TraceReplayError(f"Trace has no channel '{name}' (available: {sorted(trace.channels)})")
+    return trace, _Player(name, trace.events[name], speed=speed, strict=strict)
+
+
+def replay_pump(trace: Union[Trace, str, Path], name: str = "pump", *, speed: float = 1.0,
+                strict: bool = True):
+    """Return a ``UsbPumpController`` backed by a recorded pump channel.
+
+    `speed` scales the recorded latencies (2.0 = twice as fast, 0 = no waits).
+    With `strict`, every write must match the recorded bytes.
+    """
+    from src.controllers.pump_control import UsbPumpController
+
+    trace, player = _player(trace, name, speed, strict)
+    meta = trace.channels[name]
+    pump = UsbPumpController(vid=meta.get("vid"), pid=meta.get("pid"), auto_connect=False, auto_reconnect=False)
+    pump._attach(ReplayTransport(player, meta))
+    return pump
+
+
+def replay_valve(trace: Union[Trace, str, Path], name: str = "valve", *, speed: float = 1.0,
+                 strict: bool = True, bank: bool = False):
+    """Return a ``ValveController`` (``ValveBank`` with `bank`) backed by a recorded valve channel."""
+    from src.controllers.valve_bank_control import ValveBank
+    from src.controllers.valve_control import ValveController
+
+    trace, player = _player(trace, name, speed, strict)
+    meta = trace.channels[name]
+    controller = ValveBank if bank else ValveController
+    return controller.from_transport(ReplayTransport(player, meta), meta.get("port", ""),
+                                     meta.get("baudrate", 115200))
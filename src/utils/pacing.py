@@ -0,0 +1,199 @@
+"""
+Per-device command pacing: minimum reliable inter-command delay, ack
+timeout and (for Arduinos) boot time after a reset.
+
+The built-in values (``DEFAULT_PACING``) are conservative guesses that suit
+every setup. ``calibrate.py`` measures each connected device and stores a
+PacingProfile per device id in a JSON file (``pacing.json`` in the project
+root, or ``$PACING_PROFILES``). Controllers look their device up when they
+connect and use the stored profile automatically, so every device runs at
+its own safe rate.
+
+Device ids are ``pump:<usb serial>`` and ``valve:<usb serial>`` (the
+Arduino's USB serial number). Devices without one fall back to
+``pump:<vid>:<pid>`` or ``valve:<port>``.
+
+Example:
+    store = PacingStore()
+    result = calibrate(pump.pacing_probe, default=DEFAULT_PACING["pump"])
+    store.put(pump.device_id, result.profile)
+"""
+
+from __future__ import annotations
+
+import json
+import logging
+import os
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, NamedTuple, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+_ACK_TIMEOUT_FACTOR = 3.0   # ack timeout = slowest observed ack x factor
+_MIN_ACK_TIMEOUT_S = 0.05
+
+
+class PacingError(RuntimeError):
+    """Raised when a device cannot be calibrated or the profile file is invalid."""
+
+
+class PacingProfile(NamedTuple):
+    command_delay_s: float                  # pause between a command and the next one
+    ack_timeout_s: float                    # how long to wait for a reply
+    ready_timeout_s: Optional[float] = None  # firmware boot after a port-open reset
+    calibrated_at: Optional[float] = None   # time.time()
+    trials: int = 0                         # probes per tested delay
+
+    def to_json(self) -> Dict[str, object]:
+        return {k: v for k, v in self._asdict().items() if v is not None}
+
+    @classmethod
+    def from_json(cls, data: Dict[str, object]) -> "PacingProfile":
+        try:
+            return cls(**{k: data[k] for k in cls._fields if k in data})
+        except TypeError as exc:
+            raise PacingError(f"Invalid pacing profile {data!r}: {exc}") from exc
+
+
+DEFAULT_PACING = {
+    "pump": PacingProfile(command_delay_s=0.12, ack_timeout_s=1.0),
+    "valve": PacingProfile(command_delay_s=0.0, ack_timeout_s=2.0, ready_timeout_s=2.5),
+}
+
+
+def default_store_path() -> str:
+    return os.getenv("PACING_PROFILES") or str(Path(__file__).resolve().parents[2] / "pacing.json")
+
+
+class PacingStore:
+    """JSON file of ``{device_id: profile}``; re-read when it changes on disk."""
+
+    def __init__(self, path: Union[str, Path, None] = None):
+        self.path = Path(path or default_store_path())
+        self._profiles: Dict[str, PacingProfile] = {}
+        self._mtime: Optional[float] = None
+
+    def load(self) -> Dict[str, PacingProfile]:
+        try:
+            mtime = self.path.stat().st_mtime
+        except FileNotFoundError:
+            self._profiles, self._mtime = {}, None
+            return {}
+        if mtime != self._mtime:
+            try:
+                raw = json.loads(self.path.read_text(encoding="utf-8"))
+            except (OSError, ValueError) as exc:
+                raise PacingError(f"Cannot read pacing profiles from {self.path}: {exc}") from exc
+            self._profiles = {device: PacingProfile.from_json(data) for device, data in raw.items()}
+            self._mtime = mtime
+        return dict(self._profiles)
+
+    def get(self, device_id: str) -> Optional[PacingProfile]:
+        return self.load().get(device_id)
+
+    def put(self, device_id: str, profile: PacingProfile) -> None:
+        profiles = self.load()
+        profiles[device_id] = profile
+        data = {device: p.to_json() for device, p in sorted(profiles.items())}
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps(data, indent=2) + "\n", encoding="utf-8")
+        os.replace(tmp, self.path)  # atomic: a running controller never sees half a file
+        self._profiles, self._mtime = profiles, self.path.stat().st_mtime
+
+
+_default_store: Optional[PacingStore] = None
+
+
+def lookup(device_id: str) -> Optional[PacingProfile]:
+    """Stored profile for `device_id` from the default store (None if absent or unreadable)."""
+    global _default_store
+    path = default_store_path()
+    if _default_store is None or str(_default_store.path) != path:
+        _default_store = PacingStore(path)
+    try:
+        return _default_store.get(device_id)
+    except PacingError as exc:
+        logger.warning(f"{exc}; using default pacing")
+        return None
+
+
+def pump_device_id(serial: Optional[str], vid: int, pid: int) -> str:
+    return f"pump:{serial}" if serial else f"pump:{vid:04x}:{pid:04x}"
+
+
+def valve_device_id(port: str) -> str:
+    if "://" not in port:
+        from src.utils.serial_manager import port_serial_number
+
+        serial = port_serial_number(port)
+        if serial:
+            return f"valve:{serial}"
+    return f"valve:{port}"
+
+
+class CalibrationResult(NamedTuple):
+    profile: PacingProfile
+    latencies: List[float]                   # ack latencies at the default pacing
+    tested: List[Tuple[float, bool]]         # (delay, all probes acknowledged)
+    verified: bool                           # the final pacing passed a longer run
+
+
+def calibrate(probe: Callable[[float, float], Optional[float]], *, default: PacingProfile,
+              trials: int = 10, resolution_s: float = 0.005, margin: float = 1.25, min_delay_s: float = 0.0,
+              recover: Optional[Callable[[], None]] = None) -> CalibrationResult:
+    """Find the smallest reliable command delay and a matching ack timeout.
+
+    `probe(delay_s, ack_timeout_s)` sends one harmless command with the given
+    pacing and returns its ack latency, or None if it was not acknowledged.
+    Delays between `min_delay_s` and ``default.command_delay_s`` are bisected
+    down to `resolution_s`; a delay passes when `trials` probes in a row are
+    acknowledged. The result gets a `margin` and must then pass ``2 * trials``
+    probes, otherwise the default delay is kept. Pass
+    ``min_delay_s=default.command_delay_s`` when a reply does not prove the
+    command was accepted, so only the ack timeout is measured. `recover`
+    runs after a failed batch (e.g. drain late replies).
+    """
+    tested: List[Tuple[float, bool]] = []
+
+    def batch(delay: float, timeout: float, n: int) -> Optional[List[float]]:
+        latencies = []
+        for _ in range(n):
+            latency = probe(delay, timeout)
+            if latency is None:
+                tested.append((delay, False))
+                time.sleep(max(default.command_delay_s, 0.05))  # let the device settle
+                if recover is not None:
+                    recover()
+                return None
+            latencies.append(latency)
+        tested.append((delay, True))
+        return latencies
+
+    baseline = batch(default.command_delay_s, default.ack_timeout_s, trials)
+    if baseline is None:
+        raise PacingError("Device does not acknowledge commands reliably even at the default pacing")
+    ack_timeout = min(default.ack_timeout_s, max(_MIN_ACK_TIMEOUT_S, _ACK_TIMEOUT_FACTOR * max(baseline)))
+
+    low, high = min(min_delay_s, default.command_delay_s), default.command_delay_s  # `high` always passes
+    if high > low and batch(low, ack_timeout, trials) is not None:
+        high = low
+    while high - low > resolution_s:
+        mid = (low + high) / 2
+        if batch(mid, ack_timeout, trials) is not None:
+            high = mid
+        else:
+            low = mid
+    delay = max(min_delay_s, min(default.command_delay_s, high * margin if high else 0.0))
+    verified = batch(delay, ack_timeout, 2 * trials) is not None
+    if not verified:
+        delay = default.command_delay_s
+    profile = default._replace(command_delay_s=round(delay, 4), ack_timeout_s=round(ack_timeout, 4),
+                               calibrated_at=time.time(), trials=trials)
+    return CalibrationResult(profile, baseline, tested, verified)
+
+
+def measure_ready(reopen: Callable[[], float], *, trials: int = 3, margin: float = 1.5) -> float:
+    """Ready timeout from `trials` reset-to-banner times (`reopen` returns one, in seconds)."""
+    times = [reopen() for _ in range(trials)]
+    return round(max(times) * margin + 0.1, 3)
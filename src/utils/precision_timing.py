@@ -0,0 +1,167 @@
+"""
+Opt-in precision timing for protocol execution (``cli.py --precise``).
+
+``time.sleep`` wakes up late by the OS timer slack and scheduler latency,
+and a Python thread can additionally be held up by garbage collection or
+other threads holding the GIL. ``PrecisionTimer`` waits on
+``perf_counter_ns`` deadlines: it sleeps until shortly before the deadline,
+then spins for the remainder.
+
+``TimingEngine`` runs a callable on a dedicated thread configured for low
+latency:
+
+- garbage collection is paused and the interpreter's GIL switch interval is
+  shortened for the duration of the run;
+- optionally (Linux, where permitted) the thread gets ``SCHED_FIFO``
+  priority, is pinned to a CPU, and process memory is locked with
+  ``mlockall`` so page faults cannot stall a transition.
+
+Settings that the OS refuses (no CAP_SYS_NICE, RLIMIT_MEMLOCK, non-Linux)
+are skipped with a warning; ``engine.applied`` lists what took effect.
+
+Example:
+    engine = TimingEngine(realtime=True, cpu=3)
+    engine.run(run_sequence, config, pump, valve, profiles, sleep=engine.sleep)
+"""
+
+from __future__ import annotations
+
+import ctypes
+import ctypes.util
+import gc
+import os
+import sys
+import threading
+import time
+import warnings
+from typing import Any, Callable, List, Optional
+
+_MCL_CURRENT = 1
+_MCL_FUTURE = 2
+
+
+class PrecisionTimer:
+    """Hybrid sleep + spin waits on the ``perf_counter_ns`` clock.
+
+    `spin_s` is the final stretch before a deadline that is busy-waited; it
+    should exceed the host's typical ``time.sleep`` overshoot (~0.1 ms on
+    an idle Linux host, 1-2 ms under load or with default Windows timers).
+    """
+
+    def __init__(self, spin_s: float = 0.002, cancel: Optional[threading.Event] = None):
+        self.spin_ns = int(spin_s * 1e9)
+        self.cancel = cancel or threading.Event()
+        self.max_late_ns = 0
+
+    def sleep_until_ns(self, deadline_ns: int) -> None:
+        """Return at `deadline_ns` (perf_counter_ns); raises KeyboardInterrupt if cancelled."""
+        clock = time.perf_counter_ns
+        remaining = deadline_ns - clock()
+        coarse = remaining - self.spin_ns
+        if coarse > 0:
+            # Event.wait so a cancel request ends the wait immediately
+            if self.cancel.wait(coarse / 1e9):
+                raise KeyboardInterrupt
+        while clock() < deadline_ns:
+            pass
+        if self.cancel.is_set():
+            raise KeyboardInterrupt
+        self.max_late_ns = max(self.max_late_ns, clock() - deadline_ns)
+
+    def sleep(self, seconds: float) -> None:
+        """Drop-in replacement for ``time.sleep``."""
+        start = time.perf_counter_ns()
+        if seconds > 0:
+            self.sleep_until_ns(start + int(seconds * 1e9))
+        elif self.cancel.is_set():
+            raise KeyboardInterrupt
+
+
+def _libc():
+    name = ctypes.util.find_library("c")
+    return ctypes.CDLL(name, use_errno=True) if name else None
+
+
+class TimingEngine(PrecisionTimer):
+    """Runs a callable on a dedicated low-latency thread using PrecisionTimer waits."""
+
+    def __init__(self, *, spin_s: float = 0.002, realtime: bool = False, priority: int = 50,
+                 cpu: Optional[int] = None, lock_memory: Optional[bool] = None,
+                 switch_interval_s: float = 0.0005):
+        super().__init__(spin_s)
+        self.realtime = realtime
+        self.priority = priority
+        self.cpu = cpu
+        self.lock_memory = realtime if lock_memory is None else lock_memory
+        self.switch_interval_s = switch_interval_s
+        self.applied: List[str] = []
+
+    # Thread setup -----------------------------------------------------------------
+    def _skip(self, what: str, exc: BaseException) -> None:
+        warnings.warn(f"Precision timing: {what} not applied ({exc})", RuntimeWarning, stacklevel=3)
+
+    def _configure_thread(self) -> None:
+        if self.cpu is not None:
+            try:
+                os.sched_setaffinity(0, {self.cpu})  # Linux: 0 = calling thread
+                self.applied.append(f"affinity cpu{self.cpu}")
+            except (AttributeError, OSError, ValueError) as exc:
+                self._skip(f"CPU affinity {self.cpu}", exc)
+        if self.realtime:
+            try:
+                os.sched_setscheduler(0, os.SCHED_FIFO, os.sched_param(self.priority))
+                self.applied.append(f"SCHED_FIFO {self.priority}")
+            except (AttributeError, OSError) as exc:
+                self._skip("SCHED_FIFO", exc)
+        if self.lock_memory:
+            libc = _libc() if sys.platform.startswith("linux") else None
+            if libc is None:
+                self._skip("mlockall", OSError("not supported on this platform"))
+            elif libc.mlockall(_MCL_CURRENT | _MCL_FUTURE) != 0:
+                self._skip("mlockall", OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno())))
+            else:
+                self.applied.append("mlockall")
+
+    # Run --------------------------------------------------------------------------
+    def run(self, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+        """Call ``fn(*args, **kwargs)`` on the timing thread and return its result.
+
+        Ctrl+C in the calling thread cancels the run: the next wait on the
+        timing thread raises KeyboardInterrupt, which is re-raised here.
+        """
+        result: List[Any] = []
+        error: List[BaseException] = []
+
+        def target() -> None:
+            self._configure_thread()
+            try:
+                result.append(fn(*args, **kwargs))
+            except BaseException as exc:  # re-raised in the caller
+                error.append(exc)
+
+        self.cancel.clear()
+        gc_was_enabled = gc.isenabled()
+        old_interval = sys.getswitchinterval()
+        gc.collect()
+        gc.disable()
+        sys.setswitchinterval(self.switch_interval_s)
+        self.applied = ["gc paused", f"switch interval {1e3 * self.switch_interval_s:g} ms"]
+        thread = threading.Thread(target=target, name="timing-engine", daemon=True)
+        try:
+            thread.start()
+            interrupted = False
+            while thread.is_alive():
+                try:
+                    thread.join(0.1)
+                except KeyboardInterrupt:
+                    interrupted = True
+                    self.cancel.set()
+            if interrupted and not error:
+                raise KeyboardInterrupt
+        finally:
+            sys.setswitchinterval(old_interval)
+            if gc_was_enabled:
+                gc.enable()
+        if error:
+            raise error[0]
+        return result[0] if result else None
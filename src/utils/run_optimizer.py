@@ -0,0 +1,227 @@
+"""
+Peephole optimizer for ``run:`` plans: removes device commands that cannot
+change anything.
+
+The pass walks the steps once while tracking what each command leaves the
+devices in (pump running, voltage, frequency, waveform, valve state). A
+step is dropped when
+
+- it sets a value the device already has (``pump_voltage: 100`` twice,
+  ``valve_off`` after a timed block whose last command was ``valve_off``), or
+- it is overridden before any time passes: of the commands between two
+  waits that set the same thing, only the last one is sent, and if that
+  restores the value from before the group, none is (``pump_stop``
+  immediately followed by ``pump_start`` on a running pump).
+
+Waits, timed blocks, pulses and state queries are barriers: commands are
+never moved or merged across them, so every wait still starts and ends in
+the same device state as before. Timed blocks are kept as they are; only
+their final valve state is carried forward. Anything the pass does not
+understand makes the affected state unknown, and unknown state is never
+treated as redundant.
+
+The pass assumes commands succeed. ``run_sequence`` logs and continues
+after a failed command, so with the optimizer a later identical command is
+not there to retry it.
+
+Example:
+    result = optimize_run(config["run"], initial=initial_pump_state(profiles))
+    config["run"] = result.steps
+    print(result.format_report())
+"""
+
+from __future__ import annotations
+
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+# Step key -> (tracked attribute, value written), for steps that set state
+_SETTERS = {
+    "pump_on": ("pump", lambda v: "running"),
+    "pump_start": ("pump", lambda v: "running"),
+    "pump_stop": ("pump", lambda v: "stopped"),
+    "pump_off": ("pump", lambda v: "stopped"),
+    "pump_voltage": ("voltage", lambda v: float(v)),
+    "pump_freq": ("freq", lambda v: float(v)),
+    "pump_waveform": ("waveform", lambda v: str(v).strip().upper()),
+    "valve_on": ("valve", lambda v: "on"),
+    "valve_off": ("valve", lambda v: "off"),
+    "valve_mask": ("valve", lambda v: ("mask", _mask(v))),
+    "valve_pwm": ("valve", lambda v: _pwm(v)),
+}
+
+_BLOCK_ACTIONS = {
+    "valve_on": lambda cmd: "on",
+    "valve_off": lambda cmd: "off",
+    "valve_mask": lambda cmd: ("mask", _mask(cmd.get("mask", 0))),
+}
+
+_PUMP_PARAMETERS = ("voltage", "freq", "waveform")
+
+# A block command starting this close to the block's end may or may not run
+_BLOCK_END_MARGIN_S = 0.05
+
+_UNKNOWN = object()
+_DROPPED = object()
+
+
+def _mask(value: Any) -> Any:
+    from src.controllers.valve_bank_control import parse_valve_mask
+
+    try:
+        return parse_valve_mask(value)
+    except (TypeError, ValueError):
+        return repr(value)
+
+
+def _pwm(value: Any) -> Any:
+    """Valve state after a ``valve_pwm`` step (0 % / 100 % / off hold the relay)."""
+    from src.controllers.valve_control import parse_valve_pwm
+
+    try:
+        setting = parse_valve_pwm(value)
+    except ValueError:
+        return repr(value)
+    if setting is None or setting[1] == 0:
+        return "off"
+    return "on" if setting[1] == 100 else ("pwm",) + setting
+
+
+class RemovedStep(NamedTuple):
+    index: int       # position in the original ``run:`` list
+    step: Dict[str, Any]
+    reason: str
+
+
+class OptimizeResult(NamedTuple):
+    steps: List[Any]
+    removed: List[RemovedStep]
+    original_steps: int
+
+    @property
+    def saved_transactions(self) -> int:
+        # Every removable step is a single device command
+        return len(self.removed)
+
+    def format_report(self, verbose: bool = False) -> str:
+        line = (f"[OPTIMIZE] {len(self.steps)}/{self.original_steps} steps kept, "
+                f"{self.saved_transactions} device transactions saved")
+        if not verbose:
+            return line
+        return "\n".join([line] + [f"  - step {r.index}: {r.step} ({r.reason})" for r in self.removed])
+
+
+def initial_pump_state(pump_profiles: Dict[str, Any]) -> Dict[str, Any]:
+    """Pump state after ``init_pump``: stopped, first profile applied."""
+    state: Dict[str, Any] = {"pump": "stopped"}
+    profile = next(iter(pump_profiles.values()), None) if pump_profiles else None
+    for key in ("voltage", "freq", "waveform"):
+        if profile and profile.get(key) is not None:
+            state[key] = _SETTERS[f"pump_{key}"][1](profile[key])
+    return state
+
+
+def _block_final_valve(step: Dict[str, Any]) -> Any:
+    """Valve state a timed block ends in, or _UNKNOWN if timing makes it ambiguous."""
+    total = float(step.get("duration", 0) or 0)
+    commands = [c for c in step.get("commands") or [] if isinstance(c, dict)]
+    timed = [c for c in commands if c.get("action") in _BLOCK_ACTIONS]
+    if total <= 0 or not timed:
+        return None  # the block sends nothing
+    if len(timed) != len(commands) or sum(float(c.get("duration", 0)) for c in timed) <= 0:
+        return _UNKNOWN
+    elapsed, last = 0.0, None
+    while True:
+        for cmd in timed:
+            if elapsed >= total - _BLOCK_END_MARGIN_S:
+                if elapsed < total:
+                    return _UNKNOWN  # too close to call: latency decides whether it runs
+                return last
+            last = _BLOCK_ACTIONS[cmd["action"]](cmd)
+            elapsed += float(cmd.get("duration", 0))
+
+
+def optimize_run(steps: List[Any], *, initial: Optional[Dict[str, Any]] = None) -> OptimizeResult:
+    """Return `steps` without redundant device commands (the input list is not modified)."""
+    known: Dict[str, Any] = dict(initial or {})
+    out: List[Any] = []
+    origin: List[int] = []
+    removed: List[RemovedStep] = []
+    # attribute -> (position in `out` of the last command since the previous barrier,
+    #               value before that group of commands)
+    group: Dict[str, Tuple[int, Any]] = {}
+
+    def barrier(*forget: str) -> None:
+        group.clear()
+        for attr in forget:
+            known.pop(attr, None)
+
+    for index, step in enumerate(steps):
+        setter = None
+        if isinstance(step, dict) and len(step) == 1:
+            key = next(iter(step))
+            setter = _SETTERS.get(key)
+        if setter is None:
+            out.append(step)
+            origin.append(index)
+            if not isinstance(step, dict):
+                continue
+            if "duration" in step and "commands" in step:
+                final = _block_final_valve(step)
+                barrier()
+                if final is _UNKNOWN:
+                    known.pop("valve", None)
+                elif final is not None:
+                    known["valve"] = final
+            elif "pump_cycle" in step:
+                barrier()
+                known["pump"] = "stopped"
+            elif "valve_toggle" in step:
+                barrier()
+                if known.get("valve") in ("on", "off"):
+                    known["valve"] = "off" if known["valve"] == "on" else "on"
+                else:
+                    known.pop("valve", None)
+            elif "valve_pulse" in step:
+                barrier("valve")
+            elif list(step) == ["duration"]:
+                if float(step["duration"] or 0) > 0:
+                    barrier()
+            elif "valve_state" in step:
+                barrier()
+            else:
+                # Unrecognised or multi-key steps
+                barrier(*[attr for attr, _ in _SETTERS.values()])
+            continue
+
+        attr, convert = setter
+        try:
+            value = convert(step[key])
+        except (TypeError, ValueError):
+            out.append(step)
+            origin.append(index)
+            barrier(attr)
+            continue
+        if known.get(attr, _UNKNOWN) == value:
+            removed.append(RemovedStep(index, step, f"{attr} already {value!r}"))
+            continue
+        before = known.get(attr, _UNKNOWN)
+        if attr in group:
+            position, before = group.pop(attr)
+            removed.append(RemovedStep(origin[position], out[position], f"overridden by step {index}"))
+            out[position] = _DROPPED
+            if before == value:
+                removed.append(RemovedStep(index, step, f"restores {attr} {value!r}"))
+                known[attr] = before
+                continue
+        group[attr] = (len(out), before)
+        if attr in _PUMP_PARAMETERS:
+            # Parameters are changed on a stopped pump on purpose (see apply_pump_profile):
+            # keep a preceding stop even if the pump is restarted right after
+            group.pop("pump", None)
+        out.append(step)
+        origin.append(index)
+        known[attr] = value
+
+    kept = [s for s in out if s is not _DROPPED]
+    removed.sort(key=lambda r: r.index)
+    return OptimizeResult(kept, removed, len(steps))
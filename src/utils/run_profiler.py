@@ -0,0 +1,235 @@
+"""
+Per-step profiling for ``cli.run_sequence`` (``--profile``).
+
+The profiler wraps the pump/valve objects and the sleep function used by the
+runner. For every executed step it attributes wall time to device I/O
+(controller calls), intentional sleeps and the remaining host overhead, and
+tracks scheduling lateness against the protocol's intended timeline. At the
+end it prints (or returns as a dict) a breakdown per step type and per device
+plus the worst offending steps.
+"""
+
+from __future__ import annotations
+
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+
+def step_kind(step: Dict[str, Any]) -> str:
+    """Short type name of a ``run:`` step (``block``, ``wait`` or its command key)."""
+    if "duration" in step and "commands" in step:
+        return "block"
+    if list(step.keys()) == ["duration"]:
+        return "wait"
+    return next(iter(step), "empty")
+
+
+def intended_duration(step: Dict[str, Any]) -> float:
+    """How long the protocol means a step to take (0 for instantaneous commands)."""
+    kind = step_kind(step)
+    try:
+        if kind in ("block", "wait", "flow_setpoint"):
+            return float(step.get("duration", 0)) or 0.0
+        if kind == "pump_cycle":
+            return float(step["pump_cycle"]) or 0.0
+    except (TypeError, ValueError):
+        pass
+    return 0.0
+
+
+class _StepRecord:
+    __slots__ = ("index", "kind", "start", "end", "intended_start", "intended", "io", "sleep", "oversleep")
+
+    def __init__(self, index: int, kind: str, start: float, intended_start: float, intended: float):
+        self.index = index
+        self.kind = kind
+        self.start = start
+        self.end = start
+        self.intended_start = intended_start
+        self.intended = intended
+        self.io = 0.0
+        self.sleep = 0.0
+        self.oversleep = 0.0
+
+    @property
+    def wall(self) -> float:
+        return self.end - self.start
+
+    @property
+    def lateness(self) -> float:
+        return self.start - self.intended_start
+
+    @property
+    def overrun(self) -> float:
+        return self.wall - self.intended
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "index": self.index,
+            "kind": self.kind,
+            "wall_s": self.wall,
+            "io_s": self.io,
+            "sleep_s": self.sleep,
+            "overhead_s": max(0.0, self.wall - self.io - self.sleep),
+            "oversleep_s": self.oversleep,
+            "lateness_s": self.lateness,
+            "overrun_s": self.overrun,
+        }
+
+
+class _ProfiledDevice:
+    """Proxy timing every method call on a controller."""
+
+    def __init__(self, device: Any, name: str, profiler: "RunProfiler"):
+        self._device = device
+        self._name = name
+        self._profiler = profiler
+
+    def __getattr__(self, attr: str):
+        value = getattr(self._device, attr)
+        if not callable(value):
+            return value
+
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            ok = False
+            try:
+                result = value(*args, **kwargs)
+                ok = True
+                return result
+            finally:
+                self._profiler._record_call(self._name, attr, time.perf_counter() - start, start, ok)
+
+        return timed
+
+    def __bool__(self) -> bool:
+        return bool(self._device)
+
+
+class RunProfiler:
+    """Collects step, device-call and sleep timings for one run.
+
+    An optional ``listener`` receives every record as it completes:
+    ``on_call(device, method, start, elapsed, ok)`` and ``on_step(record)``
+    (used by ``run_store.RunRecorder`` to persist them).
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter, listener: Any = None):
+        self._clock = clock
+        self.listener = listener
+        self.steps: List[_StepRecord] = []
+        self.calls: Dict[str, Dict[str, List[float]]] = {}
+        self._current: Optional[_StepRecord] = None
+        self._run_start: Optional[float] = None
+        self._intended_elapsed = 0.0
+        self._block_origin: Optional[float] = None
+        self._block_offset = 0.0
+        self.max_block_lateness = 0.0
+
+    # Hooks used by run_sequence ---------------------------------------------
+    def wrap_device(self, device: Any, name: str) -> Any:
+        return _ProfiledDevice(device, name, self) if device is not None else None
+
+    def wrap_sleep(self, sleep: Callable[[float], None]) -> Callable[[float], None]:
+        def profiled_sleep(seconds: float) -> None:
+            start = self._clock()
+            sleep(seconds)
+            elapsed = self._clock() - start
+            if self._current is not None:
+                self._current.sleep += elapsed
+                self._current.oversleep += max(0.0, elapsed - max(0.0, seconds))
+        return profiled_sleep
+
+    def begin_step(self, index: int, step: Any) -> None:
+        """Close the previous step and start timing `step`."""
+        now = self._clock()
+        self.end_step(now)
+        if self._run_start is None:
+            self._run_start = now
+        kind = step_kind(step) if isinstance(step, dict) else "invalid"
+        intended = intended_duration(step) if isinstance(step, dict) else 0.0
+        self._current = _StepRecord(index, kind, now, self._run_start + self._intended_elapsed, intended)
+        self._intended_elapsed += intended
+        self._block_origin = None
+
+    def block_command(self, segment: float) -> None:
+        """Called before each command inside a timed block to track in-block lateness."""
+        now = self._clock()
+        if self._block_origin is None:
+            self._block_origin = now
+            self._block_offset = 0.0
+        lateness = now - (self._block_origin + self._block_offset)
+        self.max_block_lateness = max(self.max_block_lateness, lateness)
+        self._block_offset += max(0.0, segment)
+
+    def end_step(self, now: Optional[float] = None) -> None:
+        if self._current is not None:
+            self._current.end = self._clock() if now is None else now
+            self.steps.append(self._current)
+            if self.listener is not None:
+                self.listener.on_step(self._current)
+            self._current = None
+
+    def _record_call(self, device: str, method: str, elapsed: float, start: float = 0.0, ok: bool = True) -> None:
+        self.calls.setdefault(device, {}).setdefault(method, []).append(elapsed)
+        if self._current is not None:
+            self._current.io += elapsed
+        if self.listener is not None:
+            self.listener.on_call(device, method, start, elapsed, ok)
+
+    # Reporting ----------------------------------------------------------------
+    def summary(self, top: int = 5) -> Dict[str, Any]:
+        by_kind: Dict[str, Dict[str, float]] = {}
+        for rec in self.steps:
+            row = by_kind.setdefault(rec.kind, {"count": 0, "wall_s": 0.0, "io_s": 0.0, "sleep_s": 0.0,
+                                                "overhead_s": 0.0, "max_lateness_s": 0.0})
+            d = rec.as_dict()
+            row["count"] += 1
+            for key in ("wall_s", "io_s", "sleep_s", "overhead_s"):
+                row[key] += d[key]
+            row["max_lateness_s"] = max(row["max_lateness_s"], rec.lateness)
+
+        by_device: Dict[str, Dict[str, Dict[str, float]]] = {}
+        for device, methods in self.calls.items():
+            by_device[device] = {
+                method: {"count": len(t), "total_s": sum(t), "mean_s": sum(t) / len(t), "max_s": max(t)}
+                for method, t in methods.items()
+            }
+
+        total_wall = sum(r.wall for r in self.steps)
+        return {
+            "total_wall_s": total_wall,
+            "intended_s": self._intended_elapsed,
+            "final_lateness_s": (self.steps[-1].end - self._run_start - self._intended_elapsed)
+            if self.steps and self._run_start is not None else 0.0,
+            "max_block_lateness_s": self.max_block_lateness,
+            "by_step_type": by_kind,
+            "by_device": by_device,
+            "worst_overrun": [r.as_dict() for r in sorted(self.steps, key=lambda r: r.overrun, reverse=True)[:top]],
+            "worst_lateness": [r.as_dict() for r in sorted(self.steps, key=lambda r: r.lateness, reverse=True)[:top]],
+        }
+
+    def format_report(self, top: int = 5) -> str:
+        s = self.summary(top)
+        ms = lambda v: f"{1e3 * v:10.1f}"  # noqa: E731
+        lines = [
+            "[PROFILE] Run breakdown",
+            f"  total wall {s['total_wall_s']:.3f}s, intended {s['intended_s']:.3f}s, "
+            f"end lateness {1e3 * s['final_lateness_s']:.1f} ms, "
+            f"max in-block lateness {1e3 * s['max_block_lateness_s']:.1f} ms",
+            "  per step type (ms):      count       wall         io      sleep   overhead  max late",
+        ]
+        for kind, row in sorted(s["by_step_type"].items(), key=lambda kv: -kv[1]["wall_s"]):
+            lines.append(f"    {kind:<20} {row['count']:>6} {ms(row['wall_s'])} {ms(row['io_s'])} "
+                         f"{ms(row['sleep_s'])} {ms(row['overhead_s'])} {ms(row['max_lateness_s'])}")
+        lines.append("  per device call (ms):      count      total       mean        max")
+        for device, methods in s["by_device"].items():
+            for method, row in sorted(methods.items(), key=lambda kv: -kv[1]["total_s"]):
+                lines.append(f"    {device + '.' + method:<24} {row['count']:>6} {ms(row['total_s'])} "
+                             f"{ms(row['mean_s'])} {ms(row['max_s'])}")
+        lines.append("  worst offenders (overrun beyond intended duration):")
+        for d in s["worst_overrun"]:
+            lines.append(f"    step {d['index']:>3} {d['kind']:<16} overrun {1e3 * d['overrun_s']:8.1f} ms "
+                         f"(io {1e3 * d['io_s']:.1f}, oversleep {1e3 * d['oversleep_s']:.1f}, "
+                         f"overhead {1e3 * d['overhead_s']:.1f})")
+        return "\n".join(lines)
@@ -0,0 +1,354 @@
+"""
+Persistent run-event store (SQLite) with indexed cross-run queries.
+
+Every CLI run started with ``--store`` appends to one database:
+
+- ``runs``          one row per run: rig, protocol, start/end time, status, config
+- ``steps``         every executed ``run:`` step with wall / I/O / sleep / lateness
+- ``transactions``  every pump/valve controller call with its latency and outcome
+- ``measurements``  named values (device start-up times, capture offsets, ...)
+
+Event tables are append-only and carry the rig and an epoch timestamp, with
+covering indexes on ``(rig, device, method, t, latency_s)`` and
+``(name, rig, t, value)``, so questions such as "median valve ack latency
+on rig 3 over the last 30 days" are answered from an index range scan.
+
+Rows are buffered by ``RunRecorder`` and written in batches from a
+background thread (WAL journal), so recording does not add disk I/O to the
+control loop.
+
+Query from the command line:
+    python -m src.utils.run_store latency valve on --rig rig3 --since 30d
+    python -m src.utils.run_store runs --rig rig3 --since 7d
+    python -m src.utils.run_store import-probe logs_raw_usb/20250916_115850/summary.jsonl
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import os
+import re
+import socket
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id    INTEGER PRIMARY KEY,
+    started   REAL NOT NULL,
+    ended     REAL,
+    rig       TEXT NOT NULL,
+    protocol  TEXT,
+    host      TEXT,
+    status    TEXT,
+    config    TEXT
+);
+CREATE INDEX IF NOT EXISTS runs_rig_started ON runs (rig, started);
+
+CREATE TABLE IF NOT EXISTS steps (
+    run_id     INTEGER NOT NULL,
+    idx        INTEGER NOT NULL,
+    kind       TEXT,
+    t          REAL NOT NULL,
+    wall_s     REAL,
+    io_s       REAL,
+    sleep_s    REAL,
+    lateness_s REAL,
+    overrun_s  REAL
+);
+CREATE INDEX IF NOT EXISTS steps_run ON steps (run_id, idx);
+CREATE INDEX IF NOT EXISTS steps_kind ON steps (kind, t);
+
+CREATE TABLE IF NOT EXISTS transactions (
+    run_id    INTEGER NOT NULL,
+    rig       TEXT NOT NULL,
+    t         REAL NOT NULL,
+    device    TEXT NOT NULL,
+    method    TEXT NOT NULL,
+    latency_s REAL NOT NULL,
+    ok        INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS tx_rig ON transactions (rig, device, method, t, latency_s);
+CREATE INDEX IF NOT EXISTS tx_all ON transactions (device, method, t, latency_s);
+CREATE INDEX IF NOT EXISTS tx_run ON transactions (run_id);
+
+CREATE TABLE IF NOT EXISTS measurements (
+    run_id INTEGER NOT NULL,
+    rig    TEXT NOT NULL,
+    t      REAL NOT NULL,
+    name   TEXT NOT NULL,
+    value  REAL,
+    detail TEXT
+);
+CREATE INDEX IF NOT EXISTS meas_lookup ON measurements (name, rig, t, value);
+CREATE INDEX IF NOT EXISTS meas_run ON measurements (run_id);
+"""
+
+_DURATION_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([smhdw])\s*$")
+_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 7 * 86400}
+
+
+def default_store_path() -> str:
+    """``RUN_STORE_DB`` or ``runs.sqlite`` in the project root."""
+    return os.getenv("RUN_STORE_DB") or str(Path(__file__).resolve().parents[2] / "runs.sqlite")
+
+
+def default_rig() -> str:
+    return os.getenv("RIG_ID") or socket.gethostname()
+
+
+def parse_time(value: Union[str, float, None], now: Optional[float] = None) -> Optional[float]:
+    """Epoch seconds from ``None``, a number, a relative age (``"30d"``, ``"12h"``) or an ISO date."""
+    if value is None or isinstance(value, (int, float)):
+        return value
+    match = _DURATION_RE.match(value)
+    if match:
+        return (time.time() if now is None else now) - float(match.group(1)) * _UNITS[match.group(2)]
+    return datetime.fromisoformat(value).timestamp()
+
+
+def _percentile(ordered: Sequence[float], q: float) -> float:
+    if not ordered:
+        return float("nan")
+    pos = q * (len(ordered) - 1)
+    lo = int(pos)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (pos - lo)
+
+
+class RunStore:
+    """SQLite database of runs, steps, device transactions and measurements."""
+
+    def __init__(self, path: Union[str, Path, None] = None):
+        self.path = str(path or default_store_path())
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    # Writing --------------------------------------------------------------------
+    def begin_run(self, rig: str, protocol: str = "", config: Any = None, started: Optional[float] = None) -> int:
+        with self._lock, self._conn:
+            cur = self._conn.execute(
+                "INSERT INTO runs (started, rig, protocol, host, status, config) VALUES (?, ?, ?, ?, ?, ?)",
+                (time.time() if started is None else started, rig, protocol, socket.gethostname(), "running",
+                 json.dumps(config, default=str) if config is not None else None),
+            )
+            return int(cur.lastrowid)
+
+    def end_run(self, run_id: int, status: str = "ok", ended: Optional[float] = None) -> None:
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE runs SET ended = ?, status = ? WHERE run_id = ?",
+                               (time.time() if ended is None else ended, status, run_id))
+
+    def append(self, steps: Iterable[tuple] = (), transactions: Iterable[tuple] = (),
+               measurements: Iterable[tuple] = ()) -> None:
+        """Insert batches of rows (tuples in table column order) in one transaction."""
+        with self._lock, self._conn:
+            self._conn.executemany("INSERT INTO steps VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", steps)
+            self._conn.executemany("INSERT INTO transactions VALUES (?, ?, ?, ?, ?, ?, ?)", transactions)
+            self._conn.executemany("INSERT INTO measurements VALUES (?, ?, ?, ?, ?, ?)", measurements)
+
+    # Queries --------------------------------------------------------------------
+    def _query(self, sql: str, params: Sequence[Any]) -> List[tuple]:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    @staticmethod
+    def _window(column: str, rig: Optional[str], since, until) -> Tuple[str, List[Any]]:
+        clauses, params = [], []
+        if rig is not None:
+            clauses.append("rig = ?")
+            params.append(rig)
+        since, until = parse_time(since), parse_time(until)
+        if since is not None:
+            clauses.append(f"{column} >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append(f"{column} < ?")
+            params.append(until)
+        return "".join(f" AND {c}" for c in clauses), params
+
+    def latencies(self, device: str, method: str, *, rig: Optional[str] = None, since=None, until=None,
+                  ok_only: bool = True) -> List[float]:
+        """Sorted latencies of ``device.method`` calls (index-only scan)."""
+        where, params = self._window("t", rig, since, until)
+        sql = f"SELECT latency_s FROM transactions WHERE device = ? AND method = ?{where}"
+        if ok_only:
+            sql += " AND ok = 1"
+        return sorted(row[0] for row in self._query(sql, [device, method] + params))
+
+    def latency_stats(self, device: str, method: str, **window) -> Dict[str, float]:
+        values = self.latencies(device, method, **window)
+        return {
+            "count": len(values),
+            "median_s": _percentile(values, 0.5),
+            "p95_s": _percentile(values, 0.95),
+            "mean_s": sum(values) / len(values) if values else float("nan"),
+            "max_s": values[-1] if values else float("nan"),
+        }
+
+    def measurement_values(self, name: str, *, rig: Optional[str] = None, since=None, until=None) -> List[float]:
+        where, params = self._window("t", rig, since, until)
+        return sorted(row[0] for row in self._query(
+            f"SELECT value FROM measurements WHERE name = ?{where} AND value IS NOT NULL", [name] + params))
+
+    def runs(self, *, rig: Optional[str] = None, since=None, until=None) -> List[Dict[str, Any]]:
+        where, params = self._window("started", rig, since, until)
+        rows = self._query(
+            "SELECT run_id, started, ended, rig, protocol, status FROM runs WHERE 1 = 1"
+            f"{where} ORDER BY started", params)
+        keys = ("run_id", "started", "ended", "rig", "protocol", "status")
+        return [dict(zip(keys, row)) for row in rows]
+
+
+class RunRecorder:
+    """Listener for ``RunProfiler`` that streams one run into a RunStore.
+
+    Rows are buffered and flushed every `flush_interval` seconds from a
+    background thread, and on ``close()``. A batch the database refuses
+    (e.g. "database is locked" while another rig writes) is kept and sent
+    again with the next one.
+    """
+
+    def __init__(self, store: RunStore, *, rig: Optional[str] = None, protocol: str = "", config: Any = None,
+                 flush_interval: float = 1.0):
+        self.store = store
+        self.rig = rig or default_rig()
+        # perf_counter -> epoch, fixed for the run so events stay on one timeline
+        self._epoch_offset = time.time() - time.perf_counter()
+        self.run_id = store.begin_run(self.rig, protocol, config)
+        self._lock = threading.Lock()
+        self._steps: List[tuple] = []
+        self._transactions: List[tuple] = []
+        self._measurements: List[tuple] = []
+        self._stop = threading.Event()
+        self._flusher = threading.Thread(target=self._flush_loop, args=(flush_interval,),
+                                         name="run-store-flush", daemon=True)
+        self._flusher.start()
+
+    def epoch(self, perf_t: float) -> float:
+        return self._epoch_offset + perf_t
+
+    # RunProfiler listener ------------------------------------------------------
+    def on_call(self, device: str, method: str, start: float, elapsed: float, ok: bool) -> None:
+        with self._lock:
+            self._transactions.append((self.run_id, self.rig, self.epoch(start), device, method, elapsed, int(ok)))
+
+    def on_step(self, rec) -> None:
+        with self._lock:
+            self._steps.append((self.run_id, rec.index, rec.kind, self.epoch(rec.start), rec.wall, rec.io,
+                                rec.sleep, rec.lateness, rec.overrun))
+
+    def measure(self, name: str, value: Optional[float], detail: Any = None, t: Optional[float] = None) -> None:
+        """Record a named value; `t` is a perf_counter time (default now)."""
+        if detail is not None and not isinstance(detail, str):
+            detail = json.dumps(detail, default=str)
+        with self._lock:
+            self._measurements.append((self.run_id, self.rig, self.epoch(time.perf_counter() if t is None else t),
+                                       name, value, detail))
+
+    # Flushing -------------------------------------------------------------------
+    def flush(self) -> None:
+        with self._lock:
+            steps, self._steps = self._steps, []
+            transactions, self._transactions = self._transactions, []
+            measurements, self._measurements = self._measurements, []
+        if steps or transactions or measurements:
+            try:
+                self.store.append(steps, transactions, measurements)
+            except sqlite3.OperationalError:
+                with self._lock:  # put the batch back in front of what arrived meanwhile
+                    self._steps[:0] = steps
+                    self._transactions[:0] = transactions
+                    self._measurements[:0] = measurements
+                raise
+
+    def _flush_loop(self, interval: float) -> None:
+        while not self._stop.wait(interval):
+            try:
+                self.flush()
+            except sqlite3.OperationalError as exc:
+                logger.warning(f"Run store {self.store.path} not written, retrying with the next batch: {exc}")
+
+    def close(self, status: str = "ok") -> None:
+        self._stop.set()
+        self._flusher.join()
+        self.flush()
+        self.store.end_run(self.run_id, status)
+
+
+def import_probe_summary(store: RunStore, path: Union[str, Path], rig: Optional[str] = None) -> int:
+    """Import a raw-USB probe ``summary.jsonl`` as one run; returns the run id.
+
+    Each probe attempt becomes a ``probe_success`` measurement (1/0) whose
+    detail holds the tried config and notes.
+    """
+    path = Path(path)
+    rig = rig or default_rig()
+    started = path.stat().st_mtime
+    run_id = store.begin_run(rig, f"raw_usb_probe:{path.parent.name}", started=started)
+    rows = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            detail = json.dumps({"config": entry.get("config"), "notes": entry.get("notes")})
+            rows.append((run_id, rig, started, "probe_success", float(bool(entry.get("success"))), detail))
+    store.append(measurements=rows)
+    store.end_run(run_id, "imported", ended=started)
+    return run_id
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    p = argparse.ArgumentParser(description="Query the run-event store.")
+    p.add_argument("--db", default=None, help="Database path (default: RUN_STORE_DB or ./runs.sqlite)")
+    sub = p.add_subparsers(dest="cmd", required=True)
+
+    q = sub.add_parser("latency", help="Latency statistics of one device call")
+    q.add_argument("device")
+    q.add_argument("method")
+    for parser in (q, sub.add_parser("runs", help="List runs")):
+        parser.add_argument("--rig", default=None)
+        parser.add_argument("--since", default=None, help="Age (30d, 12h) or ISO date")
+        parser.add_argument("--until", default=None)
+    imp = sub.add_parser("import-probe", help="Import a logs_raw_usb/*/summary.jsonl file")
+    imp.add_argument("path")
+    imp.add_argument("--rig", default=None)
+    args = p.parse_args(argv)
+
+    store = RunStore(args.db)
+    try:
+        if args.cmd == "latency":
+            start = time.perf_counter()
+            s = store.latency_stats(args.device, args.method, rig=args.rig, since=args.since, until=args.until)
+            took = 1e3 * (time.perf_counter() - start)
+            print(f"{args.device}.{args.method}: n={s['count']} median {1e3 * s['median_s']:.2f} ms, "
+                  f"p95 {1e3 * s['p95_s']:.2f} ms, max {1e3 * s['max_s']:.2f} ms  (query {took:.1f} ms)")
+        elif args.cmd == "runs":
+            for run in store.runs(rig=args.rig, since=args.since, until=args.until):
+                started = datetime.fromtimestamp(run["started"]).isoformat(timespec="seconds")
+                print(f"{run['run_id']:>6}  {started}  {run['rig']:<12} {run['status'] or '':<9} {run['protocol']}")
+        elif args.cmd == "import-probe":
+            print(f"Imported as run {import_probe_summary(store, args.path, args.rig)}")
+    finally:
+        store.close()
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
@@ -2,8 +2,11 @@
 """
 Serial utilities for device_control.
 
-- send_command: open port, send a single command, read a single line response.
+- send_command: open port (or reuse a pooled link), send a single command, read a single line response.
 - discover_ports: enumerate available serial ports (for convenience).
+- port_serial_number: USB serial number of the adapter behind a port.
+- open_serial: open a port, optionally without triggering the Arduino auto-reset.
+- wait_for_banner: block until the firmware prints its ready banner.
 
 Requires: pyserial
 """
@@ -11,11 +14,18 @@ Requires: pyserial
 from __future__ import annotations
 
 import time
-from typing import List, Optional
+from typing import TYPE_CHECKING, List, Optional
 
 from serial import Serial, SerialException  # type: ignore
 from serial.tools import list_ports  # type: ignore
 
+if TYPE_CHECKING:
+    from src.utils.transport import TransportPool
+
+
+# First line printed by hardware/valve_serial/valve_serial.ino after boot
+READY_BANNER = "Valve controller ready"
+
 
 def discover_ports() -> List[str]:
     """
@@ -25,16 +35,76 @@ def discover_ports() -> List[str]:
     return [p.device for p in list_ports.comports()]
 
 
+def port_serial_number(port: str) -> Optional[str]:
+    """USB serial number of the device behind `port` (None if unknown or not USB)."""
+    for info in list_ports.comports():
+        if info.device == port:
+            return getattr(info, "serial_number", None) or None
+    return None
+
+
+def open_serial(port: str, baudrate: int = 115200, *, timeout: float = 2.0, reset: bool = True) -> Serial:
+    """
+    Open a serial port, optionally suppressing the Arduino auto-reset.
+
+    Most Arduino boards reboot when DTR is asserted on port open. With
+    ``reset=False`` DTR/RTS are de-asserted before the port is opened so the
+    MCU keeps running (and keeps its relay state). Whether this works depends
+    on the OS and USB-serial chip; callers should still accept a banner in
+    case the board rebooted anyway.
+
+    Raises
+    ------
+    SerialException
+        If the port cannot be opened.
+    """
+    ser = Serial()
+    ser.port = port
+    ser.baudrate = baudrate
+    ser.timeout = timeout
+    if not reset:
+        ser.dtr = False
+        ser.rts = False
+    ser.open()
+    return ser
+
+
+def wait_for_banner(ser: Serial, banner: str = READY_BANNER, timeout: float = 2.5,
+                    encoding: str = "ascii") -> bool:
+    """
+    Read lines until one starts with `banner` or `timeout` seconds elapse.
+
+    Returns True as soon as the banner is seen, so a freshly reset board is
+    used the moment its firmware is ready instead of after a fixed delay.
+    Lines received before the banner (bootloader noise) are discarded.
+    """
+    deadline = time.monotonic() + timeout
+    saved_timeout = ser.timeout
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            ser.timeout = remaining
+            line = ser.readline().decode(encoding, errors="ignore").strip()
+            if line.startswith(banner):
+                return True
+    finally:
+        ser.timeout = saved_timeout
+
+
 def send_command(
     port: str,
     command: str,
     baudrate: int = 115200,
     *,
     read_timeout: float = 2.5,
-    reset_delay: float = 1.8,
+    reset_delay: Optional[float] = None,
     newline: str = "\n",
     retries: int = 1,
     encoding: str = "ascii",
+    suppress_reset: bool = False,
+    pool: Optional["TransportPool"] = None,
 ) -> str:
     """
     Open the serial port, send `command` (+ newline), and return the first response line.
@@ -49,14 +119,24 @@ def send_command(
         Baud rate used by the device firmware.
     read_timeout : float, default 2.5
         Seconds to wait for a response line before timing out.
-    reset_delay : float, default 1.8
-        Delay after opening the port to allow Arduino auto-reset to complete.
+    reset_delay : float, optional
+        Maximum time to wait for the firmware ready banner after the Arduino
+        auto-reset. The command is sent as soon as the banner arrives.
+        Defaults to the device's calibrated boot time (see
+        ``src/utils/pacing.py``), else 1.8 s.
     newline : str, default '\\n'
         Line terminator appended to the command.
     retries : int, default 1
         Number of additional attempts if no response is received.
     encoding : str, default 'ascii'
         Encoding for command/response.
+    suppress_reset : bool, default False
+        Keep DTR/RTS low when opening the port so the Arduino does not reboot.
+        No banner wait is needed in that case.
+    pool : TransportPool, optional
+        Reuse the pool's open link to `port` instead of opening (and
+        resetting) the port for every command. `port` may then also be a
+        ``tcp://`` or ``sim://`` target.
 
     Returns
     -------
@@ -70,12 +150,22 @@ def send_command(
     """
     attempt = 0
     last_exc: Optional[Exception] = None
+    if reset_delay is None:
+        from src.utils.pacing import lookup, valve_device_id
+
+        profile = None if suppress_reset else lookup(valve_device_id(port))
+        reset_delay = profile.ready_timeout_s if profile and profile.ready_timeout_s else 1.8
 
     while attempt <= retries:
         try:
-            with Serial(port=port, baudrate=baudrate, timeout=read_timeout) as ser:
-                # Give Arduino time to reboot after opening the port (common on UNO)
-                time.sleep(max(0.0, reset_delay))
+            if pool is not None:
+                return _pooled_command(pool, port, command, baudrate, read_timeout=read_timeout,
+                                       reset_delay=reset_delay, newline=newline, encoding=encoding,
+                                       suppress_reset=suppress_reset)
+            with open_serial(port, baudrate, timeout=read_timeout, reset=not suppress_reset) as ser:
+                if not suppress_reset:
+                    # Wait for the Arduino to reboot after opening the port (common on UNO)
+                    wait_for_banner(ser, timeout=max(0.0, reset_delay), encoding=encoding)
 
                 # Clear any startup banner
                 ser.reset_input_buffer()
@@ -91,6 +181,8 @@ def send_command(
                 return resp
         except SerialException as e:
             last_exc = e
+            if pool is not None:
+                pool.discard(port)
             # Immediate failure opening/using port → break unless we want to retry
             if attempt == retries:
                 raise
@@ -108,3 +200,18 @@ def send_command(
     if last_exc:
         raise SerialException(f"Serial operation failed after retries: {last_exc}")
     return ""
+
+
+def _pooled_command(pool: "TransportPool", port: str, command: str, baudrate: int, *, read_timeout: float,
+                    reset_delay: float, newline: str, encoding: str, suppress_reset: bool) -> str:
+    from src.utils.transport import TransportError
+
+    try:
+        transport = pool.get(port, baudrate=baudrate, reset=not suppress_reset, timeout=read_timeout)
+        if transport.resets_on_open and not transport.writes:
+            transport.wait_for_line(READY_BANNER.encode(), max(0.0, reset_delay))
+        transport.reset_input()
+        transport.write((command.strip() + newline).encode(encoding, errors="ignore"))
+        return str(transport.read_line(newline.encode(encoding), read_timeout), encoding, "ignore").strip()
+    except TransportError as exc:
+        raise SerialException(str(exc)) from exc
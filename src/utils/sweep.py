@@ -0,0 +1,291 @@
+"""
+Parameter sweeps of a protocol over pump voltage, frequency and waveform.
+
+The ``sweep:`` section of a protocol YAML lists the swept parameters; the
+protocol's ``run:`` steps are executed once per point on devices that stay
+open for the whole sweep (see ``sweep.py``). Between points only the
+parameters that differ from the previous point are sent to the pump, in
+the hardware-safe order waveform -> voltage -> frequency.
+
+- ``grid``: every combination of the levels, visited in snake order
+  (reflected mixed-radix Gray code, waveform varying slowest), so
+  consecutive points differ in exactly one parameter.
+- ``lhs``: `points` Latin-hypercube samples. Each parameter's range is cut
+  into `points` strata and every stratum is used once, which covers the
+  space with far fewer points than a grid. Values are rounded to whole
+  Vpp/Hz, as the pump only accepts integers.
+
+YAML:
+    sweep:
+      method: grid            # or lhs
+      points: 40              # lhs only
+      seed: 0                 # lhs only
+      settle_ms: 500          # ignore flow samples this long after a point starts
+      sample_hz: 20           # flow sampling rate during waits
+      parameters:
+        voltage: [80, 120, 160]                # explicit levels
+        freq: {min: 50, max: 250, steps: 5}    # range (grid: `steps` levels; lhs: sampled)
+        waveform: [RECT, SINE]
+
+Flow is read from the ``flow control`` source (sensor stream channel, or
+the simulated fluid model in dry runs) during the run's waits. Every point
+becomes one row of a SweepResults table, which can be written as CSV or
+converted to NumPy arrays.
+
+Example:
+    spec = parse_sweep(config["sweep"])
+    for point in plan_points(spec):
+        for name, value in pump_changes(current, point):
+            getattr(pump, f"bartels_set_{name}")(value)
+            current[name] = value
+"""
+
+from __future__ import annotations
+
+import csv
+import math
+import random
+import statistics
+import time
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - optional dependency
+    np = None  # type: ignore
+
+# Swept pump parameters in the order they are applied; hardware range for numeric ones
+PARAMETERS = ("waveform", "voltage", "freq")
+_LIMITS = {"voltage": (1, 250), "freq": (1, 300)}
+METHODS = ("grid", "lhs")
+# ``flow control`` output -> the pump parameter a flow_setpoint step changes
+_FLOW_OUTPUTS = {"frequency": "freq", "amplitude": "voltage"}
+
+
+class SweepError(RuntimeError):
+    """Raised for an invalid ``sweep:`` section or a protocol that conflicts with it."""
+
+
+def _require_numpy() -> None:
+    if np is None:
+        raise SweepError("NumPy is required for sweep result arrays (pip install numpy)")
+
+
+class SweepParameter(NamedTuple):
+    name: str
+    levels: Optional[List[Any]]      # explicit values (None for a range)
+    low: Optional[float] = None      # range bounds
+    high: Optional[float] = None
+    steps: Optional[int] = None      # grid levels across the range
+
+
+class SweepSpec(NamedTuple):
+    parameters: List[SweepParameter]  # in PARAMETERS order
+    method: str = "grid"
+    points: int = 0                   # lhs sample count
+    seed: Optional[int] = 0
+    settle_s: float = 0.5
+    sample_hz: float = 20.0
+
+
+def _value(name: str, value: Any) -> Any:
+    if name == "waveform":
+        return str(value).strip().upper()
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise SweepError(f"Sweep {name} value {value!r} is not a number") from None
+    low, high = _LIMITS[name]
+    if not low <= number <= high:
+        raise SweepError(f"Sweep {name} value {value!r} outside the pump range {low}-{high}")
+    return int(round(number))
+
+
+def _parameter(name: str, raw: Any) -> SweepParameter:
+    if name not in PARAMETERS:
+        raise SweepError(f"Unknown sweep parameter {name!r}; use {', '.join(PARAMETERS)}")
+    if isinstance(raw, dict):
+        if name == "waveform":
+            raise SweepError("Sweep waveform needs a list of waveforms, not a range")
+        try:
+            low, high = _value(name, raw["min"]), _value(name, raw["max"])
+        except KeyError as exc:
+            raise SweepError(f"Sweep {name} range needs 'min' and 'max'") from exc
+        if low > high:
+            raise SweepError(f"Sweep {name} range min {low} > max {high}")
+        steps = raw.get("steps")
+        return SweepParameter(name, None, low, high, None if steps is None else max(1, int(steps)))
+    levels = raw if isinstance(raw, list) else [raw]
+    if not levels:
+        raise SweepError(f"Sweep {name} has no values")
+    return SweepParameter(name, list(dict.fromkeys(_value(name, v) for v in levels)))
+
+
+def parse_sweep(settings: Dict[str, Any], *, method: Optional[str] = None, points: Optional[int] = None,
+                seed: Optional[int] = None) -> SweepSpec:
+    """Validate a ``sweep:`` section; keyword arguments override its values."""
+    raw = (settings or {}).get("parameters") or {}
+    if not raw:
+        raise SweepError("The 'sweep' section needs 'parameters' (voltage, freq and/or waveform)")
+    parameters = [_parameter(name, raw[name]) for name in PARAMETERS if name in raw]
+    unknown = set(raw) - set(PARAMETERS)
+    if unknown:
+        raise SweepError(f"Unknown sweep parameter(s) {sorted(unknown)}; use {', '.join(PARAMETERS)}")
+    method = str(method or settings.get("method", "grid")).lower()
+    if method not in METHODS:
+        raise SweepError(f"Unknown sweep method {method!r}; use {' or '.join(METHODS)}")
+    count = int(points if points is not None else settings.get("points", 0))
+    if method == "lhs" and count < 1:
+        raise SweepError("Latin-hypercube sweeps need 'points' (number of samples)")
+    if method == "grid":
+        for p in parameters:
+            if p.levels is None and p.steps is None:
+                raise SweepError(f"Grid sweep of {p.name} needs 'steps' for its range")
+    return SweepSpec(parameters, method, count, seed if seed is not None else settings.get("seed", 0),
+                     float(settings.get("settle_ms", 500)) / 1e3, float(settings.get("sample_hz", 20)))
+
+
+def _levels(p: SweepParameter) -> List[Any]:
+    if p.levels is not None:
+        return p.levels
+    if p.steps == 1 or p.low == p.high:
+        return [p.low]
+    return list(dict.fromkeys(int(round(p.low + i * (p.high - p.low) / (p.steps - 1))) for i in range(p.steps)))
+
+
+def grid_points(levels: Dict[str, List[Any]]) -> List[Dict[str, Any]]:
+    """All combinations, first key slowest, ordered so neighbours differ in one value."""
+    points: List[Dict[str, Any]] = [{}]
+    for name, values in levels.items():
+        points = [{**p, name: v} for i, p in enumerate(points) for v in (values if i % 2 == 0 else values[::-1])]
+    return points
+
+
+def latin_hypercube(parameters: List[SweepParameter], n: int, seed: Optional[int] = 0) -> List[Dict[str, Any]]:
+    """`n` Latin-hypercube points, sorted by parameter (waveform first) to limit changes."""
+    rng = random.Random(seed)
+    columns = {}
+    for p in parameters:
+        strata = list(range(n))
+        rng.shuffle(strata)
+        if p.levels is not None:
+            columns[p.name] = [p.levels[s * len(p.levels) // n] for s in strata]
+        else:
+            columns[p.name] = [int(round(p.low + (s + rng.random()) / n * (p.high - p.low))) for s in strata]
+    points = [{name: values[i] for name, values in columns.items()} for i in range(n)]
+    points.sort(key=lambda point: tuple(point[p.name] for p in parameters))
+    return points
+
+
+def plan_points(spec: SweepSpec) -> List[Dict[str, Any]]:
+    if spec.method == "lhs":
+        return latin_hypercube(spec.parameters, spec.points, spec.seed)
+    return grid_points({p.name: _levels(p) for p in spec.parameters})
+
+
+def pump_changes(current: Dict[str, Any], point: Dict[str, Any]) -> List[Tuple[str, Any]]:
+    """``(parameter, value)`` to send to move the pump from `current` to `point`, in safe order."""
+    return [(name, point[name]) for name in PARAMETERS if name in point and current.get(name) != point[name]]
+
+
+def conflicting_steps(steps: List[Any], spec: SweepSpec, *, flow_output: str = "frequency") -> List[int]:
+    """Indices of ``run:`` steps that set a swept parameter themselves.
+
+    ``flow_setpoint`` steps conflict when the flow controller drives a swept
+    parameter (`flow_output` is the ``flow control`` output).
+    """
+    keys = {f"pump_{p.name}" for p in spec.parameters}
+    if _FLOW_OUTPUTS.get(flow_output) in {p.name for p in spec.parameters}:
+        keys.add("flow_setpoint")
+    return [i for i, step in enumerate(steps) if isinstance(step, dict) and keys & set(step)]
+
+
+class FlowSampler:
+    """``sleep`` replacement that reads a flow source while the run waits."""
+
+    def __init__(self, source, *, sample_hz: float = 20.0, settle_s: float = 0.5,
+                 sleep: Callable[[float], None] = time.sleep):
+        self.source = source
+        self.interval_s = 1.0 / sample_hz
+        self.settle_s = settle_s
+        self._sleep = sleep
+        self._t0 = time.perf_counter()
+        self.values: List[float] = []
+
+    def begin(self) -> None:
+        self._t0 = time.perf_counter()
+        self.values = []
+
+    def sleep(self, seconds: float) -> None:
+        end = time.perf_counter() + seconds
+        while True:
+            now = time.perf_counter()
+            if self.source is not None and now - self._t0 >= self.settle_s:
+                value = self.source.read()
+                if value is not None:
+                    self.values.append(float(value))
+            remaining = end - time.perf_counter()
+            if remaining <= 0:
+                return
+            self._sleep(min(remaining, self.interval_s))
+
+    def summary(self) -> Dict[str, Any]:
+        v = self.values
+        return {"flow_mean": statistics.fmean(v) if v else math.nan,
+                "flow_std": statistics.pstdev(v) if len(v) > 1 else math.nan,
+                "flow_samples": len(v)}
+
+
+def stream_means(stream, t0: float, t1: float) -> Dict[str, float]:
+    """Mean of each sensor channel over the perf_counter window ``[t0, t1]``."""
+    t_us, values = stream.latest()
+    host_t = stream.to_host_time(t_us)
+    if host_t is None:
+        return {f"sensor_mean.{name}": math.nan for name in stream.channels}
+    mask = (host_t >= t0) & (host_t <= t1)
+    window = values[mask]
+    return {f"sensor_mean.{name}": float(window[:, i].mean()) if len(window) else math.nan
+            for i, name in enumerate(stream.channels)}
+
+
+class SweepResults:
+    """One row per sweep point: its parameters and what was measured."""
+
+    def __init__(self):
+        self.rows: List[Dict[str, Any]] = []
+        self.columns: List[str] = []
+
+    def add(self, row: Dict[str, Any]) -> None:
+        for key in row:
+            if key not in self.columns:
+                self.columns.append(key)
+        self.rows.append(row)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    def column(self, name: str) -> List[Any]:
+        return [row.get(name) for row in self.rows]
+
+    def arrays(self) -> Dict[str, Any]:
+        """Columns as NumPy arrays (float64 for numbers, str for waveforms)."""
+        _require_numpy()
+        out = {}
+        for name in self.columns:
+            values = self.column(name)
+            if all(isinstance(v, (int, float)) or v is None for v in values):
+                out[name] = np.array([math.nan if v is None else v for v in values], dtype=np.float64)
+            else:
+                out[name] = np.array(["" if v is None else str(v) for v in values])
+        return out
+
+    def save(self, path: str) -> None:
+        """Write ``.npz`` (NumPy arrays) or CSV, by file extension."""
+        if path.endswith(".npz"):
+            arrays = self.arrays()
+            np.savez(path, **arrays)
+            return
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=self.columns)
+            writer.writeheader()
+            writer.writerows(self.rows)
@@ -0,0 +1,669 @@
+"""
+Byte transports under the device controllers.
+
+A Transport moves bytes to and from one device; controllers only build
+commands and parse replies. Every transport reads into one preallocated
+buffer that is reused for the lifetime of the link, and replies are handed
+out as ``memoryview`` slices of it (valid until the next read), so a
+command/reply round trip allocates no intermediate ``bytes``. Encoded
+commands are cached per transport.
+
+Implementations:
+
+- SerialTransport: pyserial port (Arduino valve, valve bank), optionally
+  opened without the Arduino auto-reset.
+- UsbBulkTransport: usbx bulk/interrupt endpoints (Bartels pump); one read
+  returns one USB transfer.
+- TcpTransport: raw TCP socket (serial-to-Ethernet bridges); reads go
+  straight into the buffer with ``recv_into``.
+- PtyTransport: a pseudo-terminal whose other end is served by a firmware
+  simulator thread (POSIX), so the full serial code path runs without
+  hardware.
+
+Cross-cutting features hook in here once for all devices: a ``tap`` sees
+every write and read with its timing (``io_trace`` records traces through
+it), ``writes``/``reads``/``bytes_*`` count traffic, and a TransportPool
+keeps links open between one-shot commands.
+
+``open_transport`` picks the transport from a port string:
+``tcp://host:port``, ``sim://valve`` or a serial port name (``COM5``,
+``/dev/ttyACM0``).
+"""
+
+from __future__ import annotations
+
+import os
+import select
+import socket
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Union
+
+BytesLike = Union[bytes, bytearray, memoryview]
+
+_ENCODE_CACHE_MAX = 256
+
+
+class TransportError(RuntimeError):
+    """Raised when the link itself fails (cannot open, write or read)."""
+
+
+class Transport:
+    """Base class: buffered line/chunk reads over a subclass's raw ``_write``/``_read_into``.
+
+    A ``tap`` object, if set, gets ``on_io(kind, data, start_ns, dur_ns)``
+    for every ``"write"``, ``"read"`` and ``"error"`` (times from
+    ``time.perf_counter_ns``).
+    """
+
+    kind = "abstract"
+    resets_on_open = False  # device reboots (and prints its banner) when the link opens
+    readable = True
+
+    def __init__(self, *, timeout: float = 2.0, buffer_size: int = 4096):
+        self.timeout = timeout
+        self._buf = bytearray(buffer_size)
+        self._view = memoryview(self._buf)
+        self._head = 0  # first unread byte
+        self._tail = 0  # end of received data
+        self._encoded: Dict[tuple, bytes] = {}
+        self.tap: Any = None
+        self.writes = 0
+        self.reads = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+
+    # Subclass interface -----------------------------------------------------------
+    def _write(self, data: BytesLike) -> None:
+        raise NotImplementedError
+
+    def _read_into(self, view: memoryview, timeout: Optional[float]) -> int:
+        """Read up to len(view) bytes; 0 on timeout. Link failures raise TransportError or OSError."""
+        raise NotImplementedError
+
+    def _discard_input(self) -> None:
+        """Drop input waiting below this transport (OS / device buffers)."""
+
+    @property
+    def is_open(self) -> bool:
+        return True
+
+    def close(self) -> None:
+        pass
+
+    def describe(self) -> Dict[str, Any]:
+        """Metadata for traces and logs."""
+        return {"transport": self.kind}
+
+    def __enter__(self) -> "Transport":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
+
+    # Writing ----------------------------------------------------------------------
+    def write(self, data: BytesLike) -> None:
+        start = time.perf_counter_ns()
+        try:
+            self._write(data)
+        except (TransportError, OSError) as exc:
+            self._tap("error", str(exc).encode("utf-8", "replace"), start)
+            if isinstance(exc, TransportError):
+                raise
+            raise TransportError(f"Write failed: {exc}") from exc
+        self.writes += 1
+        self.bytes_written += len(data)
+        self._tap("write", data, start)
+
+    def encode(self, command: str, terminator: bytes = b"\n") -> bytes:
+        """``command`` + terminator as ASCII, cached (devices repeat a handful of commands)."""
+        key = (command, terminator)
+        payload = self._encoded.get(key)
+        if payload is None:
+            payload = command.strip().encode("ascii", errors="ignore") + terminator
+            if len(self._encoded) >= _ENCODE_CACHE_MAX:
+                self._encoded.clear()
+            self._encoded[key] = payload
+        return payload
+
+    def send_line(self, command: str, terminator: bytes = b"\n") -> None:
+        self.write(self.encode(command, terminator))
+
+    # Reading ----------------------------------------------------------------------
+    def _tap(self, kind: str, data: BytesLike, start_ns: int) -> None:
+        if self.tap is not None:
+            self.tap.on_io(kind, data, start_ns, time.perf_counter_ns() - start_ns)
+
+    def _fill(self, timeout: Optional[float]) -> int:
+        """Receive more bytes after ``_tail``; compacts or grows the buffer when full."""
+        if self._head == self._tail:
+            self._head = self._tail = 0
+        elif self._tail == len(self._buf):
+            pending = self._tail - self._head
+            if self._head:
+                self._buf[:pending] = self._buf[self._head:self._tail]
+            else:  # a single line longer than the buffer
+                grown = bytearray(2 * len(self._buf))
+                grown[:pending] = self._buf
+                self._buf, self._view = grown, memoryview(grown)
+            self._head, self._tail = 0, pending
+        start = time.perf_counter_ns()
+        try:
+            n = self._read_into(self._view[self._tail:], timeout)
+        except (TransportError, OSError) as exc:
+            self._tap("error", str(exc).encode("utf-8", "replace"), start)
+            if isinstance(exc, TransportError):
+                raise
+            raise TransportError(f"Read failed: {exc}") from exc
+        self._tap("read", self._view[self._tail:self._tail + n], start)
+        if n:
+            self._tail += n
+            self.reads += 1
+            self.bytes_read += n
+        return n
+
+    def read_line(self, terminator: bytes = b"\n", timeout: Optional[float] = None) -> memoryview:
+        """Next line without its terminator (what arrived before the timeout if none completes)."""
+        deadline = time.perf_counter() + (self.timeout if timeout is None else timeout)
+        scanned = 0  # bytes after _head already searched
+        while True:
+            i = self._buf.find(terminator, self._head + scanned, self._tail)
+            if i >= 0:
+                line = self._view[self._head:i]
+                self._head = i + len(terminator)
+                return line
+            scanned = max(0, self._tail - self._head - len(terminator) + 1)
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0 or not self._fill(remaining):
+                line = self._view[self._head:self._tail]
+                self._head = self._tail
+                return line
+
+    def read_chunk(self, timeout: Optional[float] = None) -> memoryview:
+        """Whatever is buffered, else the next received chunk (empty on timeout)."""
+        if self._head == self._tail:
+            self._fill(self.timeout if timeout is None else timeout)
+        chunk = self._view[self._head:self._tail]
+        self._head = self._tail
+        return chunk
+
+    def exchange(self, command: str, terminator: bytes = b"\n", timeout: Optional[float] = None) -> memoryview:
+        """Send one command line and return the reply line."""
+        self.send_line(command, terminator)
+        return self.read_line(terminator, timeout)
+
+    def exchange_many(self, commands: Sequence[str], terminator: bytes = b"\n",
+                      timeout: Optional[float] = None) -> List[bytes]:
+        """Pipelined exchange: all commands in one write, then one reply line each.
+
+        Over a network link this costs one round trip instead of one per command.
+        A reply that does not arrive within `timeout` (shared by all) is ``b""``.
+        """
+        self.write(b"".join(self.encode(command, terminator) for command in commands))
+        deadline = time.perf_counter() + (self.timeout if timeout is None else timeout)
+        return [bytes(self.read_line(terminator, max(0.0, deadline - time.perf_counter()))) for _ in commands]
+
+    def poll_line(self, terminator: bytes = b"\n") -> Optional[memoryview]:
+        """A complete line if one has arrived (one non-blocking read), else None; nothing is consumed then."""
+        i = self._buf.find(terminator, self._head, self._tail)
+        if i < 0:
+            self._fill(0.0)
+            i = self._buf.find(terminator, self._head, self._tail)
+            if i < 0:
+                return None
+        line = self._view[self._head:i]
+        self._head = i + len(terminator)
+        return line
+
+    def reset_input(self) -> None:
+        self._head = self._tail = 0
+        self._discard_input()
+
+    def wait_for_line(self, prefix: bytes, timeout: float) -> bool:
+        """Read lines until one starts with `prefix` (True) or `timeout` passes (False)."""
+        deadline = time.perf_counter() + timeout
+        while True:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                return False
+            if bytes(self.read_line(timeout=remaining)).strip().startswith(prefix):
+                return True
+
+
+class SerialTransport(Transport):
+    """pyserial port; `ser` adopts an already-open serial-like object instead of opening `port`."""
+
+    kind = "serial"
+
+    def __init__(self, port: str, baudrate: int = 115200, *, reset: bool = True, timeout: float = 2.0,
+                 ser: Any = None):
+        super().__init__(timeout=timeout)
+        self.port = port
+        self.baudrate = baudrate
+        self.resets_on_open = reset and ser is None
+        if ser is None:
+            from serial import SerialException  # type: ignore
+
+            from src.utils.serial_manager import open_serial
+
+            try:
+                ser = open_serial(port, baudrate, timeout=timeout, reset=reset)
+            except SerialException as exc:
+                raise TransportError(f"Cannot open serial port {port}: {exc}") from exc
+        self.ser = ser
+
+    def _write(self, data: BytesLike) -> None:
+        self.ser.write(data)
+        self.ser.flush()
+
+    def _read_into(self, view: memoryview, timeout: Optional[float]) -> int:
+        ser = self.ser
+        waiting = getattr(ser, "in_waiting", 0) or 0
+        if not waiting:
+            # Changing the timeout reconfigures the port, so only do it when it matters
+            current = ser.timeout
+            if timeout is None or current is None or abs(current - timeout) > 0.1 * timeout:
+                ser.timeout = timeout
+        data = ser.read(min(max(waiting, 1), len(view)))
+        n = len(data)
+        view[:n] = data
+        return n
+
+    def _discard_input(self) -> None:
+        self.ser.reset_input_buffer()
+
+    @property
+    def is_open(self) -> bool:
+        return bool(getattr(self.ser, "is_open", True))
+
+    def close(self) -> None:
+        try:
+            self.ser.close()
+        except Exception:
+            pass
+
+    def describe(self) -> Dict[str, Any]:
+        return {"transport": self.kind, "port": self.port, "baudrate": self.baudrate}
+
+
+class UsbBulkTransport(Transport):
+    """usbx device with a claimed interface; each read returns one IN transfer."""
+
+    kind = "usb"
+
+    def __init__(self, device: Any, interface_number: int, out_endpoint: int, in_endpoint: Optional[int], *,
+                 vid: Optional[int] = None, pid: Optional[int] = None, timeout: float = 1.0):
+        super().__init__(timeout=timeout, buffer_size=512)
+        self.device = device
+        self.serial_number: Optional[str] = (getattr(device, "serial", None)
+                                             or getattr(device, "serial_number", None))
+        self.interface_number = interface_number
+        self.out_endpoint = out_endpoint
+        self.in_endpoint = in_endpoint
+        self.vid, self.pid = vid, pid
+        self._open = True
+
+    @classmethod
+    def open(cls, vid: int, pid: int, serial: Optional[str] = None, *, timeout: float = 1.0) -> "UsbBulkTransport":
+        """Find the device (by VID/PID and optional USB serial number), open it and claim its interface."""
+        from usbx import TransferDirection, USBError, usb  # type: ignore
+
+        if serial is None:
+            device = usb.find_device(vid=vid, pid=pid)
+        else:
+            device = next((d for d in usb.get_devices()
+                           if d.vid == vid and d.pid == pid
+                           and (getattr(d, "serial", None) or getattr(d, "serial_number", None)) == serial), None)
+        if device is None:
+            raise TransportError(f"USB device VID=0x{vid:04x} PID=0x{pid:04x}"
+                                 + (f" serial {serial}" if serial else "") + " not found")
+        interface_number = _usb_interface(device)
+        out_endpoint = _usb_endpoint(device, interface_number, TransferDirection.OUT)
+        if out_endpoint is None:
+            raise TransportError("Unable to determine the USB OUT endpoint")
+        in_endpoint = _usb_endpoint(device, interface_number, TransferDirection.IN)
+        try:
+            device.open()
+            device.claim_interface(interface_number)
+        except USBError as exc:
+            try:
+                device.close()
+            except USBError:
+                pass
+            raise TransportError(f"Failed to open/claim USB interface {interface_number}: {exc}") from exc
+        return cls(device, interface_number, out_endpoint, in_endpoint, vid=vid, pid=pid, timeout=timeout)
+
+    @property
+    def readable(self) -> bool:  # type: ignore[override]
+        return self.in_endpoint is not None
+
+    def _write(self, data: BytesLike) -> None:
+        from usbx import USBError  # type: ignore
+
+        try:
+            self.device.transfer_out(self.out_endpoint, bytes(data))
+        except USBError as exc:
+            raise TransportError(f"USB write failed: {exc}") from exc
+
+    def _read_into(self, view: memoryview, timeout: Optional[float]) -> int:
+        from usbx import USBError  # type: ignore
+
+        if self.in_endpoint is None:
+            return 0
+        try:
+            data = self.device.transfer_in(self.in_endpoint, timeout=timeout)
+        except USBError as exc:
+            raise TransportError(f"USB read failed: {exc}") from exc
+        n = len(data)
+        if n > len(view):
+            raise TransportError(f"USB transfer of {n} bytes exceeds the read buffer")
+        view[:n] = data
+        return n
+
+    @property
+    def is_open(self) -> bool:
+        return self._open
+
+    def close(self) -> None:
+        if not self._open:
+            return
+        self._open = False
+        try:
+            self.device.release_interface(self.interface_number)
+        except Exception:
+            pass
+        try:
+            self.device.close()
+        except Exception:
+            pass
+
+    def describe(self) -> Dict[str, Any]:
+        return {"transport": self.kind, "vid": self.vid, "pid": self.pid, "serial": self.serial_number,
+                "out_endpoint": self.out_endpoint, "in_endpoint": self.in_endpoint}
+
+
+def _usb_interface(device: Any) -> int:
+    """First interface exposing a bulk/interrupt OUT endpoint."""
+    from usbx import TransferDirection, TransferType  # type: ignore
+
+    for intf in device.configuration.interfaces:
+        for endpoint in intf.current_alternate.endpoints:
+            if endpoint.transfer_type in (TransferType.BULK, TransferType.INTERRUPT) and \
+                    endpoint.direction == TransferDirection.OUT:
+                return intf.number
+    raise TransportError("USB device has no bulk/interrupt OUT endpoint")
+
+
+def _usb_endpoint(device: Any, interface_number: int, direction: Any) -> Optional[int]:
+    from usbx import TransferType  # type: ignore
+
+    interface = device.get_interface(interface_number)
+    if interface is None:
+        return None
+    for endpoint in interface.current_alternate.endpoints:
+        if endpoint.direction == direction and endpoint.transfer_type in (TransferType.BULK, TransferType.INTERRUPT):
+            return endpoint.number
+    return None
+
+
+def _enable_keepalive(sock: socket.socket, idle_s: float, interval_s: float, count: int) -> None:
+    """TCP keepalive probes after `idle_s` of silence (detects dead bridges and keeps NAT/firewall state)."""
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+    if hasattr(socket, "SIO_KEEPALIVE_VALS"):  # Windows
+        sock.ioctl(socket.SIO_KEEPALIVE_VALS, (1, int(idle_s * 1000), int(interval_s * 1000)))
+        return
+    idle_option = getattr(socket, "TCP_KEEPIDLE", None) or getattr(socket, "TCP_KEEPALIVE", None)  # Linux / macOS
+    for option, value in ((idle_option, idle_s), (getattr(socket, "TCP_KEEPINTVL", None), interval_s),
+                          (getattr(socket, "TCP_KEEPCNT", None), count)):
+        if option is not None:
+            sock.setsockopt(socket.IPPROTO_TCP, option, max(1, int(value)))
+
+
+class TcpTransport(Transport):
+    """Raw TCP stream to a serial-to-Ethernet bridge (or any line-oriented TCP device).
+
+    The connection is kept open between commands with TCP keepalive probes
+    every `keepalive_s`. If the bridge dropped it (restart, idle timeout),
+    the next write reconnects once and resends; a reply lost with the old
+    connection is never resent. ``reconnects`` counts reconnections, so
+    callers with pipelined commands can fail the ones whose replies were
+    lost.
+    """
+
+    kind = "tcp"
+
+    def __init__(self, host: str, port: int, *, timeout: float = 2.0, connect_timeout: float = 3.0,
+                 keepalive_s: Optional[float] = 10.0):
+        super().__init__(timeout=timeout)
+        self.host = host
+        self.port = int(port)
+        self.connect_timeout = connect_timeout
+        self.keepalive_s = keepalive_s
+        self.reconnects = 0
+        self.sock: Optional[socket.socket] = None
+        self._open = True
+        self._connect()
+
+    def _connect(self) -> None:
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self.connect_timeout)
+        except OSError as exc:
+            raise TransportError(f"Cannot connect to {self.host}:{self.port}: {exc}") from exc
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if self.keepalive_s:
+            _enable_keepalive(sock, self.keepalive_s, max(1.0, self.keepalive_s / 3), 3)
+        self.sock = sock
+        self._sock_timeout: Optional[float] = self.connect_timeout
+
+    def _drop(self) -> None:
+        if self.sock is not None:
+            try:
+                self.sock.close()
+            except OSError:
+                pass
+            self.sock = None
+
+    def _settimeout(self, timeout: Optional[float]) -> None:
+        if timeout != self._sock_timeout:
+            self.sock.settimeout(timeout)
+            self._sock_timeout = timeout
+
+    def _write(self, data: BytesLike) -> None:
+        if not self._open:
+            raise TransportError(f"Connection to {self.host}:{self.port} is closed")
+        if self.sock is not None:
+            try:
+                self._settimeout(self.timeout)
+                self.sock.sendall(data)
+                return
+            except OSError:
+                self._drop()
+        # Persistent connection went away: reconnect once, drop replies of the old one
+        self._connect()
+        self.reconnects += 1
+        self._head = self._tail = 0
+        self._settimeout(self.timeout)
+        self.sock.sendall(data)
+
+    def _read_into(self, view: memoryview, timeout: Optional[float]) -> int:
+        if self.sock is None:
+            raise TransportError(f"Not connected to {self.host}:{self.port}")
+        self._settimeout(timeout)
+        try:
+            n = self.sock.recv_into(view)
+        except (socket.timeout, BlockingIOError):
+            return 0
+        except OSError:
+            self._drop()
+            raise
+        if n == 0:
+            self._drop()
+            raise TransportError(f"Connection to {self.host}:{self.port} closed by peer")
+        return n
+
+    def _discard_input(self) -> None:
+        if self.sock is None:
+            return
+        self._settimeout(0.0)
+        try:
+            while self.sock.recv_into(self._view):
+                pass
+        except (BlockingIOError, socket.timeout):
+            pass
+        except OSError:
+            self._drop()  # the next write reconnects
+
+    @property
+    def is_open(self) -> bool:
+        return self._open
+
+    def close(self) -> None:
+        self._open = False
+        self._drop()
+
+    def describe(self) -> Dict[str, Any]:
+        return {"transport": self.kind, "host": self.host, "port": self.port}
+
+
+class FdTransport(Transport):
+    """Transport over a POSIX file descriptor (tty, pty, pipe); reads with ``os.readv`` into the buffer."""
+
+    kind = "fd"
+
+    def __init__(self, fd: int, *, timeout: float = 2.0):
+        super().__init__(timeout=timeout)
+        self.fd = fd
+
+    def _write(self, data: BytesLike) -> None:
+        view = memoryview(data)
+        while view:
+            view = view[os.write(self.fd, view):]
+
+    def _read_into(self, view: memoryview, timeout: Optional[float]) -> int:
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return 0
+        n = os.readv(self.fd, [view])
+        if n == 0:
+            raise TransportError("Device closed the connection")
+        return n
+
+    def _discard_input(self) -> None:
+        while select.select([self.fd], [], [], 0)[0]:
+            if not os.readv(self.fd, [self._view]):
+                break
+
+    @property
+    def is_open(self) -> bool:
+        return self.fd >= 0
+
+    def close(self) -> None:
+        if self.fd >= 0:
+            try:
+                os.close(self.fd)
+            except OSError:
+                pass
+            self.fd = -1
+
+
+class PtyTransport(FdTransport):
+    """Pseudo-terminal whose device side is served by `simulator` (``serve(fd, stop_event)``) on a thread."""
+
+    kind = "pty"
+
+    def __init__(self, simulator: Any, *, timeout: float = 2.0):
+        import pty
+        import tty
+
+        master, slave = pty.openpty()
+        tty.setraw(master)
+        tty.setraw(slave)
+        super().__init__(slave, timeout=timeout)
+        self.simulator = simulator
+        self.resets_on_open = bool(getattr(simulator, "banner", False))
+        self.path = os.ttyname(slave)
+        self._master = master
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=simulator.serve, args=(master, self._stop),
+                                        name=f"pty-{type(simulator).__name__}", daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        super().close()
+        self._thread.join(1.0)
+        try:
+            os.close(self._master)
+        except OSError:
+            pass
+
+    def describe(self) -> Dict[str, Any]:
+        return {"transport": self.kind, "port": self.path, "simulator": type(self.simulator).__name__}
+
+
+_SIMULATORS: Dict[str, Callable[[], Any]] = {}
+
+
+def _simulator(name: str) -> Any:
+    if not _SIMULATORS:
+        from src.controllers.sim_control import ValveFirmwareSimulator
+
+        _SIMULATORS["valve"] = ValveFirmwareSimulator
+    try:
+        return _SIMULATORS[name]()
+    except KeyError:
+        raise TransportError(f"Unknown simulator {name!r}; available: {sorted(_SIMULATORS)}") from None
+
+
+def open_transport(target: str, baudrate: int = 115200, *, reset: bool = True, timeout: float = 2.0) -> Transport:
+    """Transport for a port string: ``tcp://host:port``, ``sim://valve`` or a serial port name."""
+    if target.startswith("tcp://"):
+        host, _, port = target[len("tcp://"):].rpartition(":")
+        if not host or not port.isdigit():
+            raise TransportError(f"Invalid TCP address {target!r}; expected tcp://host:port")
+        return TcpTransport(host.strip("[]"), int(port), timeout=timeout)
+    if target.startswith("sim://"):
+        return PtyTransport(_simulator(target[len("sim://"):]), timeout=timeout)
+    return SerialTransport(target, baudrate, reset=reset, timeout=timeout)
+
+
+class TransportPool:
+    """Open transports shared by target, so repeated one-shot commands reuse one link.
+
+    Opening a serial port reboots most Arduinos (about 2 s until the banner);
+    a pooled link pays that once. Closed or failed links are reopened on the
+    next ``get``.
+    """
+
+    def __init__(self, opener: Optional[Callable[..., Transport]] = None):
+        self._opener = opener or open_transport
+        self._transports: Dict[str, Transport] = {}
+        self._lock = threading.Lock()
+
+    def get(self, target: str, **kwargs: Any) -> Transport:
+        """Open transport for `target` (``open_transport`` arguments apply only when it is opened)."""
+        with self._lock:
+            transport = self._transports.get(target)
+            if transport is None or not transport.is_open:
+                transport = self._opener(target, **kwargs)
+                self._transports[target] = transport
+            return transport
+
+    def discard(self, target: str) -> None:
+        """Close and forget `target`'s link (after an error)."""
+        with self._lock:
+            transport = self._transports.pop(target, None)
+        if transport is not None:
+            transport.close()
+
+    def close(self) -> None:
+        with self._lock:
+            transports, self._transports = list(self._transports.values()), {}
+        for transport in transports:
+            transport.close()
+
+    def __enter__(self) -> "TransportPool":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        self.close()
@@ -0,0 +1,219 @@
+"""
+Pipelined well processing: overlap stage motion with the post-dispense wait.
+
+For each well the robot moves the stage, dispenses (valve open + pump
+running for ``dispense_s``) and then waits ``post_wait_s`` for the fluid to
+settle. Run in series a well costs ``move + dispense + wait``. The pipeline
+starts the move to well N+1 as soon as well N's fluid path is closed, so the
+move runs during well N's post-dispense wait and a well costs roughly
+``dispense + max(move, wait)``.
+
+Dependencies per well N:
+- move(N)     after dispense(N-1) has closed the valve and stopped the pump
+- dispense(N) after move(N) has finished and wait(N-1) has elapsed
+
+An ``Interlock`` enforces the safety rule independently of the schedule:
+the stage may never move while fluid is flowing, and fluid may never flow
+while the stage is moving. Any violation raises ``InterlockError``; on any
+error or stop request the pump is stopped and the valve forced OFF.
+
+Example:
+    from src.utils.well_pipeline import WellPipeline
+    pipeline = WellPipeline(robot, pump, valve, dispense_s=0.5, post_wait_s=2.0)
+    report = pipeline.run(["A1", "A2", "B1"])
+    print(pipeline.format_report(report))
+"""
+
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class InterlockError(RuntimeError):
+    """Raised when stage motion and fluid flow would overlap."""
+
+
+class Interlock:
+    """Mutual exclusion between stage motion and fluid flow."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.moving = False
+        self.flowing = False
+
+    def begin_move(self) -> None:
+        with self._lock:
+            if self.flowing:
+                raise InterlockError("Stage move requested while fluid is flowing")
+            if self.moving:
+                raise InterlockError("Stage move requested while another move is in progress")
+            self.moving = True
+
+    def end_move(self) -> None:
+        with self._lock:
+            self.moving = False
+
+    def begin_flow(self) -> None:
+        with self._lock:
+            if self.moving:
+                raise InterlockError("Dispense requested while the stage is moving")
+            self.flowing = True
+
+    def end_flow(self) -> None:
+        with self._lock:
+            self.flowing = False
+
+
+class WellPipeline:
+    """Process wells with the next move overlapped with the current post-dispense wait.
+
+    ``robot`` needs ``plan_route(wells, optimize=...)``, ``move_to_well(well)``
+    and a ``stop`` Event (``pipetting_control.Robot``). ``pump`` uses the
+    ``bartels_start``/``bartels_stop`` API and ``valve`` ``on``/``off``;
+    either may be None. Pass ``dispense`` to replace the default
+    valve-open/pump-run/close sequence; it is called as ``dispense(well)``
+    while the fluid interlock is held.
+    """
+
+    def __init__(self, robot, pump=None, valve=None, *, dispense_s: float = 0.5, post_wait_s: float = 1.0,
+                 dispense: Optional[Callable[[str], None]] = None, pipelined: bool = True,
+                 clock: Callable[[], float] = time.perf_counter):
+        self.robot = robot
+        self.pump = pump
+        self.valve = valve
+        self.dispense_s = float(dispense_s)
+        self.post_wait_s = float(post_wait_s)
+        self._dispense = dispense
+        self.pipelined = pipelined
+        self.interlock = Interlock()
+        self._clock = clock
+        self._stop: threading.Event = getattr(robot, 'stop', None) or threading.Event()
+
+    # Phases ---------------------------------------------------------------------
+    def _wait_until(self, deadline: float) -> bool:
+        """Interruptible wait; returns False if a stop was requested."""
+        remaining = deadline - self._clock()
+        if remaining > 0:
+            self._stop.wait(remaining)
+        return not self._stop.is_set()
+
+    def _move(self, well: str) -> Dict[str, float]:
+        self.interlock.begin_move()
+        try:
+            start = self._clock()
+            self.robot.move_to_well(well)
+            return {"move_start": start, "move_end": self._clock()}
+        finally:
+            self.interlock.end_move()
+
+    def _default_dispense(self, well: str) -> None:
+        if self.valve is not None:
+            self.valve.on()
+        try:
+            if self.pump is not None:
+                self.pump.bartels_start()
+            try:
+                self._stop.wait(self.dispense_s)
+            finally:
+                if self.pump is not None:
+                    self.pump.bartels_stop()
+        finally:
+            if self.valve is not None:
+                self.valve.off()
+
+    def _dispense_at(self, well: str) -> Dict[str, float]:
+        self.interlock.begin_flow()
+        try:
+            start = self._clock()
+            (self._dispense or self._default_dispense)(well)
+            return {"dispense_start": start, "dispense_end": self._clock()}
+        finally:
+            self.interlock.end_flow()
+
+    def _safe_state(self) -> None:
+        if self.pump is not None:
+            try:
+                self.pump.bartels_stop()
+            except Exception as exc:  # pragma: no cover - best effort
+                logger.warning(f"Pump stop failed during abort: {exc}")
+        if self.valve is not None:
+            try:
+                self.valve.off()
+            except Exception as exc:  # pragma: no cover - best effort
+                logger.warning(f"Valve off failed during abort: {exc}")
+
+    # Run ------------------------------------------------------------------------
+    def run(self, wells: Iterable[str], optimize: bool = True) -> Dict[str, Any]:
+        """Process `wells` and return per-well timings plus totals."""
+        route = self.robot.plan_route(wells, optimize=optimize)
+        records: List[Dict[str, Any]] = []
+        t0 = self._clock()
+        fluid_ready_at = t0
+        aborted = False
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="stage") as motion:
+            pending = motion.submit(self._move, route[0]) if route else None
+            try:
+                for i, well in enumerate(route):
+                    record: Dict[str, Any] = {"well": well}
+                    record.update(pending.result())          # stage has arrived at `well`
+                    pending = None
+                    if not self._wait_until(fluid_ready_at):  # previous well's settle time
+                        aborted = True
+                        break
+                    record.update(self._dispense_at(well))
+                    fluid_ready_at = record["dispense_end"] + self.post_wait_s
+                    record["wait_end"] = fluid_ready_at
+                    records.append(record)
+                    if self._stop.is_set():
+                        aborted = True
+                        break
+                    if i + 1 < len(route):
+                        # Serial mode waits out the settle time before moving on
+                        if not self.pipelined and not self._wait_until(fluid_ready_at):
+                            aborted = True
+                            break
+                        pending = motion.submit(self._move, route[i + 1])
+                if not aborted and records:
+                    aborted = not self._wait_until(fluid_ready_at)
+            except BaseException:
+                self._safe_state()
+                raise
+            finally:
+                if pending is not None:
+                    wait([pending])  # never leave the stage moving
+        if aborted:
+            self._safe_state()
+            logger.info("Stop requested; well pipeline aborted.")
+        total = self._clock() - t0
+        return self._report(records, total, aborted)
+
+    def _report(self, records: List[Dict[str, Any]], total: float, aborted: bool) -> Dict[str, Any]:
+        move = sum(r["move_end"] - r["move_start"] for r in records)
+        dispense = sum(r["dispense_end"] - r["dispense_start"] for r in records)
+        wait = self.post_wait_s * len(records)
+        return {
+            "wells": records,
+            "completed": len(records),
+            "aborted": aborted,
+            "total_s": total,
+            "move_s": move,
+            "dispense_s": dispense,
+            "wait_s": wait,
+            "serial_estimate_s": move + dispense + wait,
+            "per_well_s": total / len(records) if records else 0.0,
+        }
+
+    @staticmethod
+    def format_report(report: Dict[str, Any]) -> str:
+        saved = report["serial_estimate_s"] - report["total_s"]
+        return (f"[PIPELINE] {report['completed']} wells in {report['total_s']:.2f}s "
+                f"({report['per_well_s']:.2f}s/well); move {report['move_s']:.2f}s, "
+                f"dispense {report['dispense_s']:.2f}s, wait {report['wait_s']:.2f}s; "
+                f"serial estimate {report['serial_estimate_s']:.2f}s, overlap saved {saved:.2f}s"
+                + (" [ABORTED]" if report["aborted"] else ""))
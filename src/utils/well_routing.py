@@ -0,0 +1,175 @@
+"""
+Plate geometry and travel-optimised well ordering for the pipetting robot.
+
+- PlateLayout: well-name <-> (row, col) <-> stage coordinates (mm) for SBS
+  96- and 384-well plates (or any custom grid).
+- move_time: point-to-point time for an XY stage with a trapezoidal velocity
+  profile per axis (axes move simultaneously).
+- optimize_route: nearest-neighbour construction followed by 2-opt
+  improvement, minimising total stage move time over a set of wells.
+"""
+
+from __future__ import annotations
+
+import math
+import re
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+Point = Tuple[float, float]
+
+_WELL_RE = re.compile(r"^\s*([A-Za-z]{1,2})\s*0*(\d{1,3})\s*$")
+
+
+class PlateLayout:
+    """Rectangular well plate; A1 is the top-left well."""
+
+    def __init__(self, rows: int, cols: int, pitch_mm: float, a1_offset_mm: Point = (0.0, 0.0),
+                 name: str = ""):
+        self.rows = rows
+        self.cols = cols
+        self.pitch_mm = pitch_mm
+        self.a1_offset_mm = a1_offset_mm
+        self.name = name or f"{rows * cols}-well"
+
+    def __repr__(self) -> str:
+        return f"PlateLayout({self.name}, {self.rows}x{self.cols}, pitch={self.pitch_mm}mm)"
+
+    @staticmethod
+    def _row_label(row: int) -> str:
+        return chr(ord("A") + row) if row < 26 else "A" + chr(ord("A") + row - 26)
+
+    def well_name(self, row: int, col: int) -> str:
+        return f"{self._row_label(row)}{col + 1}"
+
+    def parse(self, well: str) -> Tuple[int, int]:
+        """Return zero-based ``(row, col)`` for a name like ``"B7"`` or ``"AF24"``."""
+        match = _WELL_RE.match(well)
+        if not match:
+            raise ValueError(f"Invalid well name: {well!r}")
+        letters, number = match.group(1).upper(), int(match.group(2))
+        row = ord(letters[-1]) - ord("A") + (26 if len(letters) == 2 else 0)
+        col = number - 1
+        if not (0 <= row < self.rows and 0 <= col < self.cols):
+            raise ValueError(f"Well {well!r} is outside the {self.name} plate")
+        return row, col
+
+    def position(self, well: str) -> Point:
+        """Stage coordinates (mm) of the well centre."""
+        row, col = self.parse(well)
+        return (self.a1_offset_mm[0] + col * self.pitch_mm, self.a1_offset_mm[1] + row * self.pitch_mm)
+
+    def wells(self) -> List[str]:
+        """All wells in row-major order (A1, A2, ..., B1, ...)."""
+        return [self.well_name(r, c) for r in range(self.rows) for c in range(self.cols)]
+
+    def index(self) -> Dict[str, Point]:
+        """Well-name -> coordinate index for the whole plate."""
+        return {w: self.position(w) for w in self.wells()}
+
+
+# SBS/ANSI footprint plates (A1 offset from the plate's top-left corner)
+PLATE_96 = PlateLayout(8, 12, 9.0, (14.38, 11.24), "96-well")
+PLATE_384 = PlateLayout(16, 24, 4.5, (12.13, 8.99), "384-well")
+PLATES = {96: PLATE_96, 384: PLATE_384}
+
+
+def plate_from_config(value) -> PlateLayout:
+    """Build a layout from a config value: ``96``, ``384`` or a dict with
+    ``rows``, ``cols``, ``pitch`` and optional ``a1_offset: [x, y]``."""
+    if isinstance(value, dict):
+        return PlateLayout(int(value["rows"]), int(value["cols"]), float(value["pitch"]),
+                           tuple(value.get("a1_offset", (0.0, 0.0))), value.get("name", ""))
+    try:
+        return PLATES[int(value)]
+    except (KeyError, TypeError, ValueError):
+        raise ValueError(f"Unknown plate {value!r}; use 96, 384 or a rows/cols/pitch mapping") from None
+
+
+def axis_time(distance: float, speed: float, accel: float) -> float:
+    """Time to travel `distance` on one axis with a trapezoidal (or triangular) profile."""
+    d = abs(distance)
+    if d == 0:
+        return 0.0
+    if accel <= 0:
+        return d / speed
+    ramp_distance = speed * speed / accel  # accelerate + decelerate to/from full speed
+    if d <= ramp_distance:
+        return 2.0 * math.sqrt(d / accel)
+    return 2.0 * speed / accel + (d - ramp_distance) / speed
+
+
+def move_time(a: Point, b: Point, speed: float, accel: float) -> float:
+    """XY move time; both axes move at once so the slower axis dominates."""
+    return max(axis_time(b[0] - a[0], speed, accel), axis_time(b[1] - a[1], speed, accel))
+
+
+def route_cost(points: Sequence[Point], cost: Callable[[Point, Point], float],
+               start: Optional[Point] = None) -> float:
+    path = ([start] if start is not None else []) + list(points)
+    return sum(cost(path[i], path[i + 1]) for i in range(len(path) - 1))
+
+
+def optimize_route(
+    wells: Iterable[str],
+    layout: PlateLayout,
+    *,
+    start: Optional[Point] = None,
+    cost: Optional[Callable[[Point, Point], float]] = None,
+    max_passes: int = 50,
+    time_budget_s: float = 2.0,
+) -> List[str]:
+    """Order `wells` to minimise total travel cost from `start`.
+
+    Nearest-neighbour gives the initial open path, then 2-opt segment
+    reversals are applied until no improving move remains, `max_passes`
+    is reached, or `time_budget_s` is spent. `cost` defaults to Euclidean
+    distance; pass a ``move_time`` partial to optimise stage time instead.
+    Duplicate wells are visited once.
+    """
+    unique = list(dict.fromkeys(wells))
+    if len(unique) < 2:
+        return unique
+    cost = cost or (lambda a, b: math.hypot(b[0] - a[0], b[1] - a[1]))
+    points = [layout.position(w) for w in unique]
+    origin = start if start is not None else points[0]
+
+    # Node 0 is the fixed start; nodes 1..n are wells. Precompute costs once.
+    nodes = [origin] + points
+    n = len(nodes)
+    dist = [[cost(nodes[i], nodes[j]) for j in range(n)] for i in range(n)]
+
+    # Nearest-neighbour construction
+    remaining = set(range(1, n))
+    path = [0]
+    while remaining:
+        last = dist[path[-1]]
+        nxt = min(remaining, key=last.__getitem__)
+        path.append(nxt)
+        remaining.remove(nxt)
+
+    # 2-opt on the open path (start fixed, free end)
+    deadline = time.perf_counter() + time_budget_s
+    for _ in range(max_passes):
+        improved = False
+        for i in range(1, n - 1):
+            a, b = path[i - 1], path[i]
+            d_ab = dist[a][b]
+            for j in range(i + 1, n):
+                c = path[j]
+                if j + 1 < n:
+                    d = path[j + 1]
+                    delta = dist[a][c] + dist[b][d] - d_ab - dist[c][d]
+                else:
+                    delta = dist[a][c] - d_ab
+                if delta < -1e-12:
+                    path[i:j + 1] = reversed(path[i:j + 1])
+                    b = path[i]
+                    d_ab = dist[a][b]
+                    improved = True
+            if time.perf_counter() > deadline:
+                improved = False
+                break
+        if not improved:
+            break
+    return [unique[k - 1] for k in path[1:]]
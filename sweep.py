@@ -0,0 +1,199 @@
+"""Run a protocol across a grid or Latin hypercube of pump settings.
+
+The devices are opened once. For every point of the protocol's ``sweep:``
+section (see ``src/utils/sweep.py``) only the pump parameters that changed
+are sent, the ``run:`` steps are executed, and the flow measured during the
+run's waits (plus the mean of every sensor channel, when a ``sensor
+stream`` is configured) becomes one row of the results table.
+
+The ``run:`` steps must not set the swept parameters themselves (nor run
+``flow_setpoint`` when flow control drives one); start and stop the pump in
+them as usual (``pump_on`` only starts it, so no profile is re-applied
+between points). If the sweep stops early (Ctrl+C, a failing point), the
+rows measured so far are still written.
+
+Usage examples (from project root):
+    python sweep.py protocol.yaml                          # results to protocol.sweep.csv
+    python sweep.py protocol.yaml --method lhs --points 60 --out chip7.npz
+    python sweep.py protocol.yaml --dry-run                # simulated pump + fluid model
+"""
+
+from __future__ import annotations
+
+import argparse
+import contextlib
+import io
+import math
+import os
+import sys
+import time
+from typing import Optional
+
+from cli import (DEFAULT_INIT_TIMEOUTS, apply_pump_profile, device_factories, load_yaml_config,
+                 run_sequence)
+from src.utils.device_startup import DeviceInitError, start_devices
+from src.utils.flow_control import FlowControlError, build_flow_controller
+from src.utils.sweep import (FlowSampler, SweepError, SweepResults, conflicting_steps, parse_sweep, plan_points,
+                             pump_changes, stream_means)
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    p = argparse.ArgumentParser(description="Sweep a protocol over pump voltage, frequency and waveform.")
+    p.add_argument("yaml_file", help="Protocol YAML with a 'sweep' section")
+    p.add_argument("--method", choices=("grid", "lhs"), help="Override the sweep method")
+    p.add_argument("--points", type=int, help="Latin-hypercube sample count (overrides 'points')")
+    p.add_argument("--seed", type=int, help="Latin-hypercube seed (overrides 'seed')")
+    p.add_argument("--out", help="Results file: .csv table or .npz NumPy arrays (default <yaml>.sweep.csv)")
+    p.add_argument("--dry-run", action="store_true", help="Simulated pump and fluid model; no hardware")
+    p.add_argument("--no-detect", action="store_true", help="Disable VID/PID auto-detection")
+    p.add_argument("--list", action="store_true", help="Print the planned points and exit")
+    p.add_argument("--verbose", "-v", action="store_true", help="Show the protocol's step output for every point")
+    return p
+
+
+def format_row(index: int, total: int, row: dict) -> str:
+    params = " ".join(f"{k}={row[k]}" for k in ("waveform", "voltage", "freq") if k in row)
+    flow = row["flow_mean"]
+    flow_text = "no flow readings" if math.isnan(flow) else f"flow {flow:.3f} ± {row['flow_std']:.3f}"
+    return f"[SWEEP] {index + 1}/{total} {params}: {flow_text} ({row['commands']} cmds, run {row['run_s']:.2f}s)"
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    args = build_arg_parser().parse_args(argv)
+    config = load_yaml_config(args.yaml_file)
+    required_hw = config.get("required hardware") or {}
+    pump_profiles = config.get("pump settings") or {}
+    if not required_hw.get("pump") or not pump_profiles:
+        print("A sweep needs 'pump: true' under 'required hardware' and a 'pump settings' profile.")
+        return 1
+    try:
+        spec = parse_sweep(config.get("sweep") or {}, method=args.method, points=args.points, seed=args.seed)
+    except SweepError as e:
+        print(f"Invalid 'sweep' section: {e}")
+        return 1
+    conflicts = conflicting_steps(config.get("run") or [], spec,
+                                  flow_output=(config.get("flow control") or {}).get("output", "frequency"))
+    if conflicts:
+        print(f"run steps {conflicts} set a swept parameter; remove them (the sweep sets "
+              f"{', '.join(p.name for p in spec.parameters)}).")
+        return 1
+    points = plan_points(spec)
+    if args.list:
+        for i, point in enumerate(points):
+            print(f"{i + 1:4d} " + " ".join(f"{k}={v}" for k, v in point.items()))
+        return 0
+
+    valve_bank = bool(required_hw.get("valve bank", False))
+    factories = device_factories(
+        pump_profiles,
+        pump_enabled=True,
+        valve_enabled=bool(required_hw.get("valve", False)) or valve_bank,
+        dry_run=args.dry_run,
+        prefer_detection=not args.no_detect,
+        valve_bank=valve_bank,
+    )
+    timeouts = {name: DEFAULT_INIT_TIMEOUTS.get(name, 10.0) for name in factories}
+    try:
+        devices = start_devices(factories, timeouts=timeouts)
+    except DeviceInitError as e:
+        for name, msg in e.errors.items():
+            print(f"Failed to initialize {name}: {msg}")
+        return 1
+    pump, valve = devices["pump"], devices.get("valve")
+
+    stream = None
+    stream_settings = config.get("sensor stream")
+    if valve and stream_settings:
+        try:
+            stream = valve.start_stream(int(stream_settings.get("rate_hz", 1000)),
+                                        capacity=int(stream_settings.get("buffer_samples", 65536)),
+                                        channels=stream_settings.get("channels"))
+        except Exception as e:
+            print(f"[WARN] Sensor streaming not started: {e}")
+
+    source = None
+    if args.dry_run or "flow control" in config:
+        try:
+            controller, model = build_flow_controller(config.get("flow control") or {}, pump, valve,
+                                                      dry_run=args.dry_run)
+        except FlowControlError as e:
+            print(f"[WARN] No flow source, flow is not measured: {e}")
+        else:
+            source = controller.source
+            if model is not None:
+                # The simulated fluid model stands in for the pump, so flow follows the swept settings
+                model.bartels_stop()
+                pump = model
+                apply_pump_profile(pump, next(iter(pump_profiles)), pump_profiles, start=False)
+                print("[INFO] Sweeping the simulated pump + fluid model")
+    first = pump_profiles[next(iter(pump_profiles))]
+    current = {k: (str(first[k]).strip().upper() if k == "waveform" else int(first[k]))
+               for k in ("waveform", "voltage", "freq") if first.get(k) is not None}
+
+    out = args.out or f"{os.path.splitext(args.yaml_file)[0]}.sweep.csv"
+    sampler = FlowSampler(source, sample_hz=spec.sample_hz, settle_s=spec.settle_s)
+    results = SweepResults()
+    commands = 0
+    start = time.perf_counter()
+    failed = False
+    print(f"[SWEEP] {len(points)} points ({spec.method}) over {', '.join(p.name for p in spec.parameters)}")
+    try:
+        for index, point in enumerate(points):
+            changes = pump_changes(current, point)
+            for name, value in changes:
+                getattr(pump, f"bartels_set_{name}")(value)
+                current[name] = value
+            commands += len(changes)
+            sampler.begin()
+            t0 = time.perf_counter()
+            output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+            with output:
+                run_sequence(config, pump, valve, pump_profiles, dry_run=args.dry_run, sleep=sampler.sleep)
+            t1 = time.perf_counter()
+            row = {"point": index, **point, "commands": len(changes), "run_s": round(t1 - t0, 4),
+                   **sampler.summary()}
+            if stream is not None:
+                row.update(stream_means(stream, t0 + spec.settle_s, t1))
+            results.add(row)
+            print(format_row(index, len(points), row))
+    except (KeyboardInterrupt, SystemExit, Exception) as e:
+        # run_sequence exits on config errors and devices can fail: keep the rows measured so far
+        if isinstance(e, KeyboardInterrupt):
+            print(f"\n[INTERRUPT] Caught Ctrl+C – stopping after {len(results)} of {len(points)} points...")
+        else:
+            failed = True
+            print(f"\n[SWEEP] Point {len(results) + 1} failed ({e or type(e).__name__}); "
+                  f"stopping after {len(results)} of {len(points)} points...", file=sys.stderr)
+        try:
+            pump.bartels_stop()
+        except Exception:
+            pass
+        try:
+            if valve:
+                valve.off()
+        except Exception:
+            pass
+    finally:
+        if stream is not None:
+            with contextlib.suppress(Exception):
+                valve.stop_stream()
+        for device in (devices["pump"], valve):
+            if device:
+                with contextlib.suppress(Exception):
+                    device.close()
+    total = time.perf_counter() - start
+    if results:
+        pumping = sum(results.column("run_s"))
+        print(f"[SWEEP] {len(results)} points in {total:.1f}s ({pumping:.1f}s running the protocol); "
+              f"{commands} parameter commands (full reload would send {3 * len(results)})")
+        try:
+            results.save(out)
+        except (OSError, SweepError) as e:
+            print(f"Could not save results to {out}: {e}", file=sys.stderr)
+            return 1
+        print(f"[SWEEP] Results written to {out}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    raise SystemExit(main())
@@ -40,6 +40,17 @@ def main():
             time.sleep(0.5)
         pump.stop()
         print("Stopped pump after 1 minute of pulsed valve mode.\n")
+        time.sleep(3)
+
+        # --- Firmware PWM Mode ---
+        print("--- Firmware PWM Mode ---")
+        print("Starting pump. Arduino cycles the valve (1 s period, 50% ON) for 1 minute; no host I/O.")
+        pump.start()
+        print(f"  {valve.pwm(1000, 50)}")
+        time.sleep(60)
+        print(f"  {valve.pwm_off()}")
+        pump.stop()
+        print("Stopped pump after 1 minute of firmware PWM mode.\n")
     finally:
         pump.close()
         valve.close()